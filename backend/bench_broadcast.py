@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark CPU per room broadcast: per-member encoding vs serialize-once fan-out
+
+Models the work done for one group_send in a room of N members:
+- per-member: the layer packs the dict for each member and every consumer json.dumps it again
+- serialize-once: the producer encodes one text frame and members forward it as-is
+"""
+import json
+import time
+import uuid
+
+import msgpack
+
+from rooms.broadcast import encode_frame
+
+ROOM_SIZES = [5, 10, 20, 40, 80]
+ROUNDS = 20
+
+
+def build_room_payload(participants=40, stories=150):
+    """Build a dict shaped like RoomSerializer output"""
+    now = '2025-11-10T11:10:00.000000Z'
+    people = [
+        {'id': str(uuid.uuid4()), 'username': f'user{i}', 'connected': True, 'joined_at': now, 'last_seen': now}
+        for i in range(participants)
+    ]
+    story_list = []
+    for i in range(stories):
+        votes = [
+            {'id': str(uuid.uuid4()), 'participant': p['id'], 'participant_name': p['username'],
+             'value': '5', 'revealed': True, 'created_at': now}
+            for p in people[:10]
+        ]
+        story_list.append({
+            'id': str(uuid.uuid4()), 'story_id': f'FUN-{i}', 'title': f'The Sneaky Penguin Writes Tests {i}',
+            'final_points': '5', 'estimated_at': now, 'order': i, 'votes': votes,
+            'votes_count': len(votes), 'created_at': now,
+        })
+    return {'code': 'ABC123', 'session_name': 'Planning Session', 'participants': people,
+            'stories': story_list, 'current_story': story_list[-1]['id'], 'version': 1}
+
+
+def per_member(message, members):
+    for _ in range(members):
+        msgpack.packb(message)  # channel layer serialization
+        json.dumps(message)  # consumer re-encoding
+
+
+def serialize_once(message, members):
+    event = {'type': 'room.frame', 'text': encode_frame(message)}
+    for _ in range(members):
+        msgpack.packb(event)
+
+
+def measure(fn, message, members):
+    start = time.process_time()
+    for _ in range(ROUNDS):
+        fn(message, members)
+    return (time.process_time() - start) / ROUNDS * 1000
+
+
+def run():
+    payloads = {
+        'full room snapshot': {'type': 'vote_cast', 'room': build_room_payload()},
+        'vote patch': {'type': 'vote_cast', 'version': 42,
+                       'patch': {'op': 'vote', 'story': str(uuid.uuid4()), 'participant': str(uuid.uuid4()), 'has_voted': True}},
+    }
+
+    print("📡 Broadcast CPU per group_send (ms)")
+    print("=" * 60)
+    for label, message in payloads.items():
+        print(f"\n{label} ({len(encode_frame(message))} bytes)")
+        print(f"{'members':>8} {'per-member':>12} {'once':>10} {'speedup':>9}")
+        for members in ROOM_SIZES:
+            before = measure(per_member, message, members)
+            after = measure(serialize_once, message, members)
+            print(f"{members:>8} {before:>12.3f} {after:>10.3f} {before / after:>8.1f}x")
+
+
+if __name__ == "__main__":
+    run()
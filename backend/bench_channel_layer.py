@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark room broadcasts through the sharded Redis layer vs the hybrid layer
+
+Every member of the room is a channel on this one worker, like a room whose
+connections all landed on the same Daphne process. Each round sends a vote
+patch the way RoomConsumer.broadcast does (room.frame event with pre-encoded
+frames) and waits until every member has received it. Reports broadcast
+latency and throughput per room size.
+
+Needs the Redis nodes in CHANNEL_LAYER_HOSTS to be running
+(scripts/redis_shards.sh starts local ones).
+"""
+import asyncio
+import os
+import statistics
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
+
+from django.conf import settings
+
+from rooms import patches
+from rooms.broadcast import room_frame_event
+from rooms.hybrid_layer import HybridChannelLayer
+from rooms.sharded_layer import ShardedRedisChannelLayer
+
+ROOM_SIZES = [2, 10, 40]
+ROUNDS = 200
+
+LAYERS = [
+    ('sharded redis', ShardedRedisChannelLayer),
+    ('hybrid', HybridChannelLayer),
+]
+
+
+async def broadcast_latencies(layer_class, members):
+    layer = layer_class(hosts=settings.CHANNEL_LAYER_HOSTS, prefix='bench')
+    group = 'room_BENCH1'
+    channels = [await layer.new_channel() for _ in range(members)]
+    for channel in channels:
+        await layer.group_add(group, channel)
+
+    event = room_frame_event({
+        'type': 'vote_cast',
+        'version': 1,
+        'patch': patches.votes_patch('story-1', ['participant-1']),
+    })
+    latencies = []
+    try:
+        for _ in range(ROUNDS):
+            start = time.perf_counter()
+            await layer.group_send(group, event)
+            await asyncio.gather(*(layer.receive(channel) for channel in channels))
+            latencies.append(time.perf_counter() - start)
+    finally:
+        for channel in channels:
+            await layer.group_discard(group, channel)
+        await layer.flush()
+    return latencies
+
+
+def run():
+    print("📡 Room broadcast: sharded Redis layer vs hybrid in-process fast path")
+    print(f"   {ROUNDS} broadcasts per room, all members on this worker, hosts: {', '.join(settings.CHANNEL_LAYER_HOSTS)}")
+    print("=" * 78)
+    print(f"{'members':>8} {'layer':>15} {'p50 ms':>10} {'p95 ms':>10} {'broadcasts/s':>14}")
+    for members in ROOM_SIZES:
+        for name, layer_class in LAYERS:
+            latencies = sorted(asyncio.run(broadcast_latencies(layer_class, members)))
+            print(f"{members:>8} {name:>15} {statistics.median(latencies) * 1000:>10.2f} "
+                  f"{latencies[int(len(latencies) * 0.95)] * 1000:>10.2f} {len(latencies) / sum(latencies):>14.0f}")
+
+
+if __name__ == "__main__":
+    run()
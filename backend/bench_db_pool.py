@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark consumer DB throughput against CONSUMER_DB_THREADS
+
+For a fixed duration, one room keeps requesting full snapshots of a large
+room (the slow command) while every other room casts votes through
+RoomConsumer.save_vote. Reports vote throughput and vote latency for each
+pool size; 0 is the single thread-sensitive database_sync_to_async thread.
+
+Runs against a throwaway SQLite file, not db.sqlite3.
+"""
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
+
+from django.conf import settings
+from django.db import connection
+
+from rooms.consumers import RoomConsumer
+from rooms.models import Room, Participant, Story, Vote
+
+POOL_SIZES = [0, 1, 2, 4, 8]
+VOTING_ROOMS = 8
+DURATION = 5.0
+SLOW_ROOM_STORIES = 60
+
+
+def create_room(participants, stories, votes_per_story=0):
+    room = Room.objects.create()
+    people = [
+        Participant.objects.create(room=room, username=f'user{i}', session_id=f'{room.code}-{i}')
+        for i in range(participants)
+    ]
+    story_list = [Story.objects.create(room=room, story_id=f'FUN-{i}', title=f'Story {i}', order=i) for i in range(stories)]
+    Vote.objects.bulk_create([
+        Vote(room=room, participant=p, story=s, value='5')
+        for s in story_list for p in people[:votes_per_story]
+    ])
+    return room, people, story_list
+
+
+def consumer_for(room):
+    consumer = RoomConsumer()
+    consumer.room_code = room.code
+    consumer.store = consumer
+    return consumer
+
+
+async def slow_room(consumer, stop):
+    snapshots = 0
+    while not stop.is_set():
+        await consumer.get_room_data()
+        snapshots += 1
+    return snapshots
+
+
+async def voting_room(consumer, people, story, latencies, stop):
+    i = 0
+    while not stop.is_set():
+        i += 1
+        start = time.perf_counter()
+        await consumer.save_vote(str(people[i % len(people)].id), str(story.id), '8' if i % 2 else '5')
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_once(slow, voters):
+    stop = asyncio.Event()
+    latencies = []
+    tasks = [asyncio.ensure_future(slow_room(consumer_for(slow), stop))] + [
+        asyncio.ensure_future(voting_room(consumer_for(room), people, stories[0], latencies, stop))
+        for room, people, stories in voters
+    ]
+    await asyncio.sleep(DURATION)
+    stop.set()
+    results = await asyncio.gather(*tasks)
+    return latencies, results[0]
+
+
+def run():
+    print("🧵 Consumer DB throughput vs CONSUMER_DB_THREADS")
+    print(f"   {VOTING_ROOMS} rooms voting for {DURATION:.0f}s, one room snapshotting {SLOW_ROOM_STORIES} stories meanwhile")
+    print("=" * 78)
+
+    slow, _, _ = create_room(participants=40, stories=SLOW_ROOM_STORIES, votes_per_story=10)
+    voters = [create_room(participants=10, stories=1) for _ in range(VOTING_ROOMS)]
+    connection.close()
+
+    print(f"{'threads':>8} {'votes/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'snapshots':>10}")
+    for size in POOL_SIZES:
+        settings.CONSUMER_DB_THREADS = size
+        latencies, snapshots = asyncio.run(run_once(slow, voters))
+        latencies.sort()
+        print(f"{size:>8} {len(latencies) / DURATION:>10.0f} "
+              f"{statistics.median(latencies) * 1000:>10.2f} "
+              f"{latencies[int(len(latencies) * 0.95)] * 1000:>10.2f} {snapshots:>10}")
+
+
+if __name__ == "__main__":
+    settings.DATABASES['default']['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'bench_db_pool.sqlite3')
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        run()
+    finally:
+        connection.creation.destroy_test_db(settings.DATABASES['default']['NAME'], verbosity=0)
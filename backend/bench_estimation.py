@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Compare the deck-based estimate with the original per-reveal computation
+
+The original rebuilt the Fibonacci list, searched it linearly for the spread
+and the rounding, and went through statistics.median/quantiles on every
+reveal. rooms.estimation precomputes each card's value and scale step, so a
+reveal is dict lookups, one sort and one bisect.
+"""
+import os
+import random
+import statistics
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
+
+from rooms.estimation import FIBONACCI
+
+ROUNDS = 20000
+ROOM_SIZES = [3, 8, 20, 40]
+
+
+def legacy_estimate(votes):
+    fibonacci_sequence = [1, 2, 3, 5, 8, 13, 21, 34, 55, 89]
+    numeric_votes = [v for v in votes if v not in ['?', 'coffee']]
+    if not numeric_votes:
+        return None
+    vote_values = sorted([int(v) for v in numeric_votes])
+    min_pos = next((i for i, fib in enumerate(fibonacci_sequence) if fib >= vote_values[0]), 0)
+    max_pos = next((i for i, fib in enumerate(fibonacci_sequence) if fib >= vote_values[-1]), len(fibonacci_sequence) - 1)
+    if max_pos - min_pos > 2:
+        if len(vote_values) == 1:
+            return vote_values[0]
+        target = statistics.quantiles(vote_values, n=4)[2]
+    else:
+        target = statistics.median(vote_values)
+    for fib in fibonacci_sequence:
+        if target <= fib:
+            return fib
+    return fibonacci_sequence[-1]
+
+
+def time_per_call(fn, hands):
+    start = time.perf_counter()
+    for hand in hands:
+        fn(hand)
+    return (time.perf_counter() - start) / len(hands) * 1_000_000
+
+
+def run():
+    print("🃏 Reveal estimate: original vs precomputed deck")
+    print("=" * 60)
+    rng = random.Random(42)
+    print(f"{'voters':>8} {'original µs':>14} {'deck µs':>10} {'speedup':>10}")
+    for size in ROOM_SIZES:
+        hands = [[rng.choice(FIBONACCI.cards) for _ in range(size)] for _ in range(ROUNDS)]
+        mismatches = sum(legacy_estimate(hand) != FIBONACCI.estimate(hand) for hand in hands)
+        assert not mismatches, f"{mismatches} hands estimated differently"
+        legacy = time_per_call(legacy_estimate, hands)
+        deck = time_per_call(FIBONACCI.estimate, hands)
+        print(f"{size:>8} {legacy:>14.2f} {deck:>10.2f} {legacy / deck:>9.1f}x")
+
+
+if __name__ == "__main__":
+    run()
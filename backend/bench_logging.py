@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark WebSocket messages per second with logging off, written inline, and queued
+
+A client sends sync messages for a version the replay buffer already
+covers, so each message is a full trip through RoomConsumer.receive and back
+with no database work, and still logs the usual handful of lines. Modes:
+
+- off: rooms.* loggers disabled
+- inline: the configured console and file handlers write from the event loop
+  (how every log call worked before rooms.log_queue)
+- queued: records go through the queue to the background writer thread
+
+The console handler is pointed at /dev/null so the terminal stays readable.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import override_settings
+
+from rooms.log_queue import ROOMS_LOGGERS, DeferredQueueHandler
+from rooms.replay import replay_buffer
+from rooms.routing import websocket_urlpatterns
+
+MESSAGES = 2000
+ROOM_CODE = 'BENCH1'
+
+
+async def messages_per_second():
+    client = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/room/{ROOM_CODE}/')
+    await client.connect()
+    message = json.dumps({'type': 'sync', 'version': 1})
+    start = time.perf_counter()
+    for _ in range(MESSAGES):
+        await client.send_to(text_data=message)
+        await client.receive_from(timeout=5)
+    elapsed = time.perf_counter() - start
+    await client.disconnect()
+    return MESSAGES / elapsed
+
+
+def set_mode(mode, queue_handlers):
+    for name, queue_handler in queue_handlers.items():
+        logger = logging.getLogger(name)
+        logger.setLevel(logging.CRITICAL if mode == 'off' else logging.DEBUG)
+        logger.handlers = queue_handler.targets if mode == 'inline' else [queue_handler]
+
+
+def run():
+    print("📝 WebSocket messages per second by logging mode")
+    print(f"   {MESSAGES} sync round trips per mode")
+    print("=" * 60)
+
+    queue_handlers = {}
+    devnull = open(os.devnull, 'w')
+    for name in ROOMS_LOGGERS:
+        for handler in logging.getLogger(name).handlers:
+            if isinstance(handler, DeferredQueueHandler):
+                queue_handlers[name] = handler
+                for target in handler.targets:
+                    if type(target) is logging.StreamHandler:
+                        target.setStream(devnull)
+
+    replay_buffer.record(ROOM_CODE, {'version': 1}, {'text': '{}'})
+    results = {}
+    for mode in ['off', 'inline', 'queued']:
+        set_mode(mode, queue_handlers)
+        results[mode] = asyncio.run(messages_per_second())
+    set_mode('queued', queue_handlers)
+
+    print(f"{'mode':>10} {'msgs/s':>10} {'vs off':>10}")
+    for mode, rate in results.items():
+        print(f"{mode:>10} {rate:>10.0f} {rate / results['off']:>9.0%}")
+
+
+if __name__ == "__main__":
+    layers = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+    with override_settings(CHANNEL_LAYERS=layers, ROOM_STATE_BACKEND='local', WS_RATE_LIMITS_ENABLED=False):
+        run()
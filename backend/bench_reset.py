@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark resetting a story's votes against the number of votes
+
+Times RoomConsumer.reset_votes (vote DELETE, estimate UPDATE and version
+bump) with the bulk path, and again with the per-row Vote pre_delete and
+post_delete receivers that rooms.signals used to register reconnected. With
+any such receiver Django loads every vote and signals each row (and the old
+receivers also looked up the room, participant and story of each one).
+
+Runs against a throwaway SQLite file, not db.sqlite3.
+"""
+import os
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connection
+from django.db.models.signals import post_delete, pre_delete
+from django.test.utils import CaptureQueriesContext
+
+from rooms.consumers import RoomConsumer
+from rooms.models import Room, Participant, Story, Vote
+
+VOTE_COUNTS = [10, 100, 1000, 2500]
+
+
+def per_row_pre_delete(sender, instance, **kwargs):
+    # What the removed receiver read for its log line
+    instance.room.code, instance.participant.username, instance.story.story_id
+
+
+def per_row_post_delete(sender, instance, **kwargs):
+    instance.pk
+
+
+def room_with_votes(votes):
+    room = Room.objects.create()
+    story = Story.objects.create(room=room, story_id='FUN-1', title='Story', order=0)
+    people = Participant.objects.bulk_create([
+        Participant(room=room, username=f'user{i}', session_id=f'{room.code}-{i}') for i in range(votes)
+    ])
+    Vote.objects.bulk_create([Vote(room=room, participant=p, story=story, value='5') for p in people])
+    room.current_story = story
+    room.save(update_fields=['current_story'])
+    return room
+
+
+def time_reset(votes):
+    consumer = RoomConsumer()
+    consumer.room_code = room_with_votes(votes).code
+    # The capture counts new entries in a log capped at 9000 queries
+    connection.queries_log.clear()
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        async_to_sync(consumer.reset_votes)()
+        elapsed = time.perf_counter() - start
+    return elapsed, len(queries)
+
+
+def run():
+    print("🗑️  Story reset cost vs vote count: per-row delete signals vs bulk path")
+    print("=" * 70)
+    print(f"{'votes':>8} {'per-row ms':>12} {'queries':>8} {'bulk ms':>10} {'queries':>8} {'speedup':>9}")
+    settings.CONSUMER_DB_THREADS = 0
+    for votes in VOTE_COUNTS:
+        pre_delete.connect(per_row_pre_delete, sender=Vote)
+        post_delete.connect(per_row_post_delete, sender=Vote)
+        try:
+            per_row, per_row_queries = time_reset(votes)
+        finally:
+            pre_delete.disconnect(per_row_pre_delete, sender=Vote)
+            post_delete.disconnect(per_row_post_delete, sender=Vote)
+        bulk, bulk_queries = time_reset(votes)
+        print(f"{votes:>8} {per_row * 1000:>12.1f} {per_row_queries:>8} {bulk * 1000:>10.1f} "
+              f"{bulk_queries:>8} {per_row / bulk:>8.1f}x")
+
+
+if __name__ == "__main__":
+    settings.DATABASES['default']['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'bench_reset.sqlite3')
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        run()
+    finally:
+        connection.creation.destroy_test_db(settings.DATABASES['default']['NAME'], verbosity=0)
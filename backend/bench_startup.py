@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Benchmark Django startup with and without the Redis health check in ready()
+
+RoomsConfig.ready() used to run log_redis_health() (SET, GET and two INFO
+calls with 5 second timeouts) in every process: each manage.py command, test
+run and worker boot. It is now probed in the background once the server is
+serving. Each run starts a fresh interpreter and times django.setup(), alone
+and followed by the old startup check, against:
+
+- the configured channel layer host
+- a non-routable address, as when Redis is down or firewalled
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+RUNS = 5
+
+SETUP = """
+import os, time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+start = time.perf_counter()
+import django
+django.setup()
+{extra}
+print(time.perf_counter() - start)
+"""
+
+OLD_CHECK = "from rooms.redis_health import log_redis_health; log_redis_health()"
+
+HOSTS = [
+    ('configured host', None),
+    ('unreachable host', 'redis://10.255.255.1:6379/0'),
+]
+
+
+def startup_seconds(extra, hosts):
+    env = dict(os.environ)
+    if hosts:
+        env['CHANNEL_LAYER_HOSTS'] = hosts
+    times = []
+    for _ in range(RUNS):
+        output = subprocess.run(
+            [sys.executable, '-c', SETUP.format(extra=extra)],
+            env=env, capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        times.append(float(output.stdout.strip().splitlines()[-1]))
+    return statistics.median(times)
+
+
+def run():
+    print("🚀 Cold start: django.setup() with and without the startup Redis health check")
+    print(f"   median of {RUNS} fresh interpreters per row")
+    print("=" * 70)
+    print(f"{'redis':>18} {'lazy probe ms':>15} {'startup check ms':>18} {'saved ms':>10}")
+    for name, hosts in HOSTS:
+        lazy = startup_seconds('', hosts)
+        eager = startup_seconds(OLD_CHECK, hosts)
+        print(f"{name:>18} {lazy * 1000:>15.0f} {eager * 1000:>18.0f} {(eager - lazy) * 1000:>10.0f}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Compare JSON text frames with the compact msgpack wire protocol
+
+Reports frame size and encode time for room snapshots of realistic sizes and
+for the small patches sent on most broadcasts.
+"""
+import json
+import time
+import uuid
+
+from bench_broadcast import build_room_payload
+from rooms.wire import encode_binary
+
+ROUNDS = 50
+
+ROOMS = [
+    ('small room (8 people, 20 stories)', 8, 20),
+    ('medium room (20 people, 60 stories)', 20, 60),
+    ('large room (40 people, 150 stories)', 40, 150),
+]
+
+
+def encode_time(fn, message):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        fn(message)
+    return (time.perf_counter() - start) / ROUNDS * 1000
+
+
+def run():
+    messages = []
+    for label, participants, stories in ROOMS:
+        room = build_room_payload(participants, stories)
+        messages.append((label, {'type': 'snapshot', 'version': room['version'], 'room': room}))
+    messages.append(('vote patch', {
+        'type': 'vote_cast', 'base_version': 41, 'version': 42,
+        'patch': {'op': 'votes', 'story': str(uuid.uuid4()), 'participants': [str(uuid.uuid4()) for _ in range(5)]},
+    }))
+
+    print("📦 JSON vs msgpack wire protocol")
+    print("=" * 96)
+    print(f"{'message':<38} {'json B':>9} {'msgpack B':>10} {'size':>6} {'json ms':>9} {'msgpack ms':>11}")
+    for label, message in messages:
+        text = json.dumps(message, separators=(',', ':'))
+        binary = encode_binary(message)
+        json_ms = encode_time(lambda m: json.dumps(m, separators=(',', ':')), message)
+        binary_ms = encode_time(encode_binary, message)
+        print(f"{label:<38} {len(text):>9} {len(binary):>10} {len(binary) / len(text):>6.0%} {json_ms:>9.3f} {binary_ms:>11.3f}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark sustained votes per second with 100 rooms voting at once
+
+Every room keeps casting votes through RoomConsumer.save_vote for a fixed
+duration, on 1, 4 and 8 room-sharded consumer threads. Compared setups:
+
+- rollback journal: SQLite's default journal, every thread writes itself
+- WAL: the same with the database in WAL mode (SQLITE_WAL)
+- WAL + write queue: writes go to the single writer (DB_WRITE_QUEUE_ENABLED)
+  and are committed in batches
+
+Reports votes/s, vote latency and votes that failed (e.g. "database is
+locked" after the busy timeout). Runs against a throwaway SQLite file, not
+db.sqlite3.
+"""
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
+
+from django.conf import settings
+from django.db import connection
+
+from rooms.consumers import RoomConsumer
+from rooms.models import Room, Participant, Story
+
+ROOMS = 100
+PARTICIPANTS = 8
+DURATION = 5.0
+THREAD_COUNTS = (1, 4, 8)
+
+SETUPS = [
+    ('rollback journal', False, False),
+    ('WAL', True, False),
+    ('WAL + write queue', True, True),
+]
+
+
+def create_room():
+    room = Room.objects.create()
+    people = Participant.objects.bulk_create([
+        Participant(room=room, username=f'user{i}', session_id=f'{room.code}-{i}') for i in range(PARTICIPANTS)
+    ])
+    story = Story.objects.create(room=room, story_id='FUN-1', title='Story', order=0)
+    consumer = RoomConsumer()
+    consumer.room_code = room.code
+    return consumer, [str(p.id) for p in people], str(story.id)
+
+
+async def voting_room(consumer, people, story, latencies, failures, stop):
+    i = 0
+    while not stop.is_set():
+        i += 1
+        start = time.perf_counter()
+        try:
+            await consumer.save_vote(people[i % len(people)], story, '8' if i % 2 else '5')
+        except Exception as e:
+            failures.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_once(rooms):
+    stop = asyncio.Event()
+    latencies, failures = [], []
+    tasks = [
+        asyncio.ensure_future(voting_room(consumer, people, story, latencies, failures, stop))
+        for consumer, people, story in rooms
+    ]
+    await asyncio.sleep(DURATION)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return latencies, failures
+
+
+def run():
+    print(f"🗳️  Sustained votes/s with {ROOMS} rooms voting at once")
+    print(f"   {DURATION:.0f}s per setup and consumer DB thread count")
+    print("=" * 78)
+
+    rooms = [create_room() for _ in range(ROOMS)]
+
+    print(f"{'setup':>20} {'threads':>8} {'votes/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'failed':>8}")
+    for name, wal, write_queue in SETUPS:
+        settings.SQLITE_WAL = wal
+        settings.DB_WRITE_QUEUE_ENABLED = write_queue
+        with connection.cursor() as cursor:
+            # The journal mode is stored in the database file, so every connection follows it
+            cursor.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+        for threads in THREAD_COUNTS:
+            settings.CONSUMER_DB_THREADS = threads
+            latencies, failures = asyncio.run(run_once(rooms))
+            latencies.sort()
+            print(f"{name:>20} {threads:>8} {len(latencies) / DURATION:>10.0f} "
+                  f"{statistics.median(latencies) * 1000:>10.2f} "
+                  f"{latencies[int(len(latencies) * 0.95)] * 1000:>10.2f} {len(failures):>8}")
+
+
+if __name__ == "__main__":
+    settings.SQLITE_WAL = False
+    settings.DATABASES['default']['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'bench_write_queue.sqlite3')
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        run()
+    finally:
+        connection.creation.destroy_test_db(settings.DATABASES['default']['NAME'], verbosity=0)
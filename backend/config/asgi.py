@@ -18,6 +18,14 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 django_asgi_app = get_asgi_application()
 
 from rooms.routing import websocket_urlpatterns
+from rooms.redis_health import redis_probe
+from rooms.worker_metrics import worker_metrics
+
+# Publish this worker's metrics for /metrics and probe Redis for /readyz, on
+# threads of their own; only serving processes load this module, so
+# manage.py commands and test runs start neither
+worker_metrics.ensure_publisher()
+redis_probe.ensure_started()
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
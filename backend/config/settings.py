@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so request timings include the rest of the middleware
+    'rooms.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -77,15 +80,101 @@ WSGI_APPLICATION = 'config.wsgi.application'
 ASGI_APPLICATION = 'config.asgi.application'
 
 # Channels with Redis logging
+# Redis nodes the channel layer shards room groups over (comma separated
+# URLs). After changing the list, run manage.py rebalance_channel_layer --from
+# <previous URLs>; scripts/redis_shards.sh starts several local nodes.
+CHANNEL_LAYER_HOSTS = os.environ.get('CHANNEL_LAYER_HOSTS', 'redis://127.0.0.1:6379/0').split(',')
+
+# Channel layer class. The default is the channels_redis layer sharded over
+# CHANNEL_LAYER_HOSTS. rooms.hybrid_layer.HybridChannelLayer also delivers to
+# members on the same worker in memory and only goes through Redis for other
+# workers; every worker must then run it.
+CHANNEL_LAYER_BACKEND = os.environ.get('CHANNEL_LAYER_BACKEND', 'rooms.sharded_layer.ShardedRedisChannelLayer')
+
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'rooms.redis_logger.LoggingRedisChannelLayer',
+        'BACKEND': CHANNEL_LAYER_BACKEND,
         'CONFIG': {
-            "hosts": [('127.0.0.1', 6379)],
+            "hosts": CHANNEL_LAYER_HOSTS,
         },
     },
 }
 
+# In-memory room engine (rooms/engine.py). Keeps live rooms in process memory
+# and persists writes in batches; only enable when a room's connections are
+# pinned to a single worker.
+ROOM_ENGINE_ENABLED = False
+ROOM_ENGINE_FLUSH_INTERVAL = 0.5  # seconds between write-behind flushes
+ROOM_ENGINE_IDLE_TIMEOUT = 300  # seconds before an unused room is evicted
+
+# Card deck for votes and estimates: fibonacci, modified_fibonacci, t_shirt or powers_of_two
+ESTIMATION_DECK = 'fibonacci'
+
+# Votes cast within this window are merged into one vote_cast broadcast (0 disables)
+VOTE_COALESCE_WINDOW_MS = 250
+
+# Presence, event replay and snapshot cache state: 'redis' (shared by all
+# workers) or 'local' (single process only)
+ROOM_STATE_BACKEND = 'redis'
+ROOM_STATE_REDIS_URL = 'redis://127.0.0.1:6379/1'
+PRESENCE_TTL = 60  # seconds a connection stays present without a heartbeat
+PRESENCE_FLUSH_INTERVAL = 30  # seconds between batched Participant row updates
+REPLAY_BUFFER_SIZE = 256  # recent broadcasts kept per room for reconnecting clients
+REPLAY_BUFFER_TTL = 3600  # seconds an idle room's replay buffer is kept
+ROOM_SNAPSHOT_CACHE_TTL = 30  # seconds a serialized room version stays cached (0 disables)
+
+# Opt-in SQLite WAL mode (set on every new connection), and the opt-in single
+# writer (rooms/write_queue.py) that runs consumer and presence writes in
+# batched transactions instead of letting rooms contend for the write lock.
+# WAL persists in the database file and adds -wal/-shm files next to it.
+SQLITE_WAL = False
+# PRAGMA synchronous for new SQLite connections; None keeps SQLite's FULL.
+# 'NORMAL' skips the fsync on every WAL commit: commits stay atomic and
+# survive a process crash, but a power loss or OS crash can drop the last
+# ones. Only set it where that is acceptable.
+SQLITE_SYNCHRONOUS = None
+DB_WRITE_QUEUE_ENABLED = False
+DB_WRITE_BATCH_SIZE = 256  # queued writes committed per transaction
+
+# Threads for consumer DB work, sharded by room so rooms don't queue behind
+# each other (0 runs it all on the single database_sync_to_async thread).
+# SQLite has one writer however many threads there are: in
+# bench_write_queue.py 4 threads gain at most a fifth in votes/s over 1 and
+# raise p95 from ~590ms to ~1s (WAL) or ~1.4s (rollback journal). Keep 1 on
+# SQLite; more only pay off on a database with concurrent writers.
+CONSUMER_DB_THREADS = 1
+
+# Frames a WebSocket connection may have queued before it is resynced with a
+# snapshot; filling up again before that snapshot is sent closes the socket.
+# Kept above REPLAY_BUFFER_SIZE + 1 so a whole replay (and its marker) fits.
+WS_OUTBOX_MAX_FRAMES = 512
+
+# Incoming WebSocket frames: larger or more deeply nested ones are dropped
+# unparsed, and per-command token buckets (see rooms.commands) cap how fast a
+# connection or a room may send each message type
+WS_MAX_FRAME_BYTES = 16384
+WS_MAX_JSON_DEPTH = 8
+WS_RATE_LIMITS_ENABLED = True
+
+# Append-only journal of room domain events (rooms/journal.py; read it with
+# manage.py replay_journal). Off unless given a path, which should live
+# outside the repository, e.g. /var/lib/planning-poker/events.journal.
+EVENT_JOURNAL_PATH = os.environ.get('EVENT_JOURNAL_PATH') or None
+EVENT_JOURNAL_FSYNC_INTERVAL = 1.0  # seconds between fsyncs of appended events
+
+# Text log line for every model save/delete (rooms/signals.py); can be turned
+# off in production, where the event journal is the audit trail
+DB_SIGNAL_LOGGING = True
+
+# Each worker publishes its metrics to ROOM_STATE_REDIS_URL so /metrics can
+# report all of them; workers silent for METRICS_WORKER_TTL are dropped
+METRICS_PUBLISH_INTERVAL = 15  # seconds
+METRICS_WORKER_TTL = 60  # seconds
+
+# Seconds between background Redis health probes; /readyz reports unready
+# once the latest probe failed or is three intervals old
+REDIS_HEALTH_INTERVAL = 30
+
 # CORS
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
@@ -151,7 +240,6 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Logging Configuration
-import os
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
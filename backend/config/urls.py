@@ -17,7 +17,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from rooms.views import healthz, prometheus_metrics, readyz
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('rooms.urls')),
+    path('metrics', prometheus_metrics, name='prometheus-metrics'),
+    path('healthz', healthz, name='healthz'),
+    path('readyz', readyz, name='readyz'),
 ]
@@ -14,3 +14,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+from rooms.redis_health import redis_probe
+from rooms.worker_metrics import worker_metrics
+
+# Publish this worker's metrics for /metrics and probe Redis for /readyz, on
+# threads of their own; only serving processes load this module, so
+# manage.py commands and test runs start neither
+worker_metrics.ensure_publisher()
+redis_probe.ensure_started()
@@ -1,5 +1,4 @@
 from django.apps import AppConfig
-import logging
 
 
 class RoomsConfig(AppConfig):
@@ -7,14 +6,12 @@ class RoomsConfig(AppConfig):
     name = 'rooms'
     
     def ready(self):
-        import rooms.signals
-        
-        # Initialize Redis health monitoring
-        try:
-            from .redis_health import log_redis_health
-            logger = logging.getLogger('rooms.redis')
-            logger.info("REDIS INIT - Initializing Redis health monitoring")
-            log_redis_health()
-        except Exception as e:
-            logger = logging.getLogger('rooms.redis')
-            logger.error(f"REDIS INIT - Failed to initialize Redis health monitoring: {str(e)}")
+        import rooms.signals  # noqa: F401 (registers the receivers)
+        from .log_queue import install_queue_logging
+
+        # rooms.* records are written by a background thread, off the event loop
+        install_queue_logging()
+
+        # Redis health is probed in the background once the server is serving
+        # (rooms.redis_health.redis_probe), not here: ready() runs for every
+        # manage.py command and test run too
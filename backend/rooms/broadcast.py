@@ -0,0 +1,65 @@
+"""
+Serialize-once fan-out for room broadcasts
+
+A room message is encoded to its JSON text frame once, by the consumer that
+produced it. The channel layer then only ships that pre-encoded frame, and
+every member's consumer forwards it untouched instead of re-encoding the
+message. Members that negotiated msgpack get ``binary_frame(text)``, which
+is encoded on first use and cached, so each worker encodes a broadcast's
+binary frame at most once and only when one of its members needs it. The
+same text frame is recorded in the room's replay buffer for clients that
+reconnect.
+
+REST views change rooms too; ``publish_room_message`` sends their messages
+down the same path once their transaction commits.
+"""
+import functools
+import json
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from .replay import replay_buffer
+from .wire import encode_binary
+
+
+def encode_frame(message):
+    """Encode an outbound room message into the text frame sent to every member"""
+    return json.dumps(message, default=str, separators=(',', ':'))
+
+
+@functools.lru_cache(maxsize=256)
+def binary_frame(text):
+    """The msgpack frame for a broadcast text frame"""
+    return encode_binary(json.loads(text))
+
+
+def room_frame_event(message):
+    """Group event carrying a message pre-encoded as its text frame"""
+    return {
+        'type': 'room.frame',
+        'text': encode_frame(message),
+    }
+
+
+async def send_room_frame(channel_layer, group, room_code, message):
+    """Encode, record for replay, and fan a room message out to the group"""
+    event = room_frame_event(message)
+    await replay_buffer.arecord(room_code, message, event)
+    await channel_layer.group_send(group, event)
+
+
+async def publish_room_frame(room_code, message):
+    """Broadcast a room message from outside a room consumer"""
+    # rooms.coalescing builds on this module
+    from .coalescing import vote_coalescer
+
+    # Pending coalesced votes have lower versions, so they go out first
+    await vote_coalescer.flush(room_code)
+    await send_room_frame(get_channel_layer(), f'room_{room_code}', room_code, message)
+
+
+def publish_room_message(room_code, message):
+    """Broadcast a room message from synchronous code once the current transaction commits"""
+    transaction.on_commit(lambda: async_to_sync(publish_room_frame)(room_code, message), robust=True)
@@ -0,0 +1,102 @@
+"""
+Vote burst coalescing for vote_cast broadcasts
+
+Votes cast in a room within ``VOTE_COALESCE_WINDOW_MS`` of the first one are
+merged into a single ``vote_cast`` broadcast listing every participant who
+voted. Any other room broadcast (reveal, reset, story change, ...) flushes the
+pending window first so clients still see events in order. A window of 0
+broadcasts every vote immediately.
+
+A window only spans consecutive room versions, so its ``base_version``..
+``version`` really are all in it. A vote whose version doesn't follow the
+window's (another worker or a REST request changed the room in between)
+flushes the window and opens a new one.
+"""
+import asyncio
+import logging
+
+from django.conf import settings
+
+from . import patches
+from .broadcast import send_room_frame
+
+websocket_logger = logging.getLogger('rooms.websocket')
+
+
+class VoteWindow:
+    """Votes for one story waiting to be broadcast together"""
+
+    def __init__(self, channel_layer, group, story_id, version):
+        self.channel_layer = channel_layer
+        self.group = group
+        self.story_id = story_id
+        self.base_version = version
+        self.version = version
+        self.participant_ids = []
+        self.timer = None
+
+    def add(self, participant_id, version):
+        if participant_id not in self.participant_ids:
+            self.participant_ids.append(participant_id)
+        self.version = version
+
+    def follows(self, version):
+        return version == self.version + 1
+
+    def message(self):
+        return {
+            'type': 'vote_cast',
+            'base_version': self.base_version,
+            'version': self.version,
+            'patch': patches.votes_patch(self.story_id, self.participant_ids),
+        }
+
+
+class VoteCoalescer:
+    """Per-process registry of open vote windows, keyed by room code"""
+
+    def __init__(self):
+        self.windows = {}
+
+    @property
+    def window_seconds(self):
+        return getattr(settings, 'VOTE_COALESCE_WINDOW_MS', 0) / 1000
+
+    async def add_vote(self, channel_layer, group, room_code, story_id, participant_id, version):
+        """Queue a vote for broadcast, opening a window for the room if needed"""
+        window = self.windows.get(room_code)
+        if window is not None and (window.story_id != story_id or not window.follows(version)):
+            # Votes for a different story can't share a patch, and versions
+            # made elsewhere in between must go out on their own
+            await self.flush(room_code)
+            window = None
+
+        if window is None:
+            window = VoteWindow(channel_layer, group, story_id, version)
+            self.windows[room_code] = window
+            if self.window_seconds > 0:
+                loop = asyncio.get_running_loop()
+                window.timer = loop.call_later(self.window_seconds, self._flush_later, room_code, window)
+        window.add(participant_id, version)
+
+        if window.timer is None:
+            await self.flush(room_code)
+
+    def _flush_later(self, room_code, window):
+        if self.windows.get(room_code) is window:
+            asyncio.ensure_future(self.flush(room_code))
+
+    async def flush(self, room_code):
+        """Broadcast the room's pending votes now, if any"""
+        window = self.windows.pop(room_code, None)
+        if window is None:
+            return
+        if window.timer is not None:
+            window.timer.cancel()
+
+        websocket_logger.info("WS VOTE - Broadcasting %s coalesced vote(s) to room %s", len(window.participant_ids), room_code)
+        await send_room_frame(window.channel_layer, window.group, room_code, window.message())
+
+
+# Process-wide coalescer instance
+vote_coalescer = VoteCoalescer()
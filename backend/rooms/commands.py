@@ -0,0 +1,109 @@
+"""
+WebSocket command registry
+
+Each client message type is declared once with its payload schema, the
+``RoomConsumer`` handler that runs it, whether the handler's result is
+broadcast to the room, and its rate limits per connection and per room.
+Schemas are compiled into validator functions when this module is imported,
+so dispatch is a dict lookup plus a few type checks.
+"""
+from .estimation import get_deck
+from .limits import Rate
+
+
+class CommandError(Exception):
+    """Raised when a client message fails schema validation"""
+
+
+class Field:
+    def __init__(self, types, required=False, max_length=None, choices=None):
+        """``choices`` is a collection, or a callable returning one per validation"""
+        self.types = types if isinstance(types, tuple) else (types,)
+        self.required = required
+        self.max_length = max_length
+        self.choices = choices if choices is None or callable(choices) else frozenset(choices)
+
+
+def compile_schema(schema):
+    """Turn a {name: Field} schema into a single validator function"""
+    checks = tuple(
+        (name, field.types, field.required, field.max_length, field.choices)
+        for name, field in schema.items()
+    )
+
+    def validate(data):
+        for name, types, required, max_length, choices in checks:
+            value = data.get(name)
+            if value is None:
+                if required:
+                    raise CommandError(f"'{name}' is required")
+                continue
+            # bool is an int subclass, but never a valid payload number
+            if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+                raise CommandError(f"'{name}' has the wrong type")
+            if max_length is not None and len(value) > max_length:
+                raise CommandError(f"'{name}' is longer than {max_length} characters")
+            if choices is not None and value not in (choices() if callable(choices) else choices):
+                raise CommandError(f"'{name}' is not an allowed value")
+
+    return validate
+
+
+class Command:
+    def __init__(self, type, handler, schema=None, broadcasts=True, connection_rate=None, room_rate=None):
+        self.type = type
+        self.handler = handler
+        # When set, the handler returns a message (or None) for the room broadcast
+        self.broadcasts = broadcasts
+        self.validate = compile_schema(schema or {})
+        # Token bucket rates; None leaves that scope unlimited
+        self.connection_rate = connection_rate
+        self.room_rate = room_rate
+
+
+def vote_values():
+    """Playable cards of the configured deck, the same source as ``Vote.value``"""
+    return get_deck().cards
+
+
+# Commands that write to the room and broadcast it; a person clicks these a
+# few times a minute
+ROOM_ACTION_RATE = Rate(per_second=1, burst=5)
+ROOM_ACTION_ROOM_RATE = Rate(per_second=2, burst=10)
+
+COMMANDS = {command.type: command for command in [
+    # Votes are broadcast through the vote coalescer rather than per command
+    Command('vote', 'handle_vote', {
+        'participant_id': Field(str, required=True, max_length=36),
+        'story_id': Field(str, required=True, max_length=36),
+        'value': Field(str, required=True, choices=vote_values),
+    }, broadcasts=False, connection_rate=Rate(per_second=4, burst=10), room_rate=Rate(per_second=50, burst=100)),
+    Command('reveal', 'handle_reveal', connection_rate=ROOM_ACTION_RATE, room_rate=ROOM_ACTION_ROOM_RATE),
+    Command('reset', 'handle_reset', connection_rate=ROOM_ACTION_RATE, room_rate=ROOM_ACTION_ROOM_RATE),
+    Command('confirm_points', 'handle_confirm_points', {
+        'points': Field((str, int), required=True),
+    }, connection_rate=ROOM_ACTION_RATE, room_rate=ROOM_ACTION_ROOM_RATE),
+    Command('add_story', 'handle_add_story', {
+        'story_id': Field(str, max_length=100),
+        'title': Field(str, max_length=255),
+    }, connection_rate=ROOM_ACTION_RATE, room_rate=ROOM_ACTION_ROOM_RATE),
+    Command('change_story', 'handle_change_story', {
+        'story_id': Field(str, required=True, max_length=36),
+    }, connection_rate=ROOM_ACTION_RATE, room_rate=ROOM_ACTION_ROOM_RATE),
+    Command('switch_to_existing_story', 'handle_switch_to_existing_story', {
+        'story_id': Field(str, required=True, max_length=36),
+    }, connection_rate=ROOM_ACTION_RATE, room_rate=ROOM_ACTION_ROOM_RATE),
+    Command('user_joined', 'handle_user_joined', {
+        'username': Field(str, max_length=50),
+        'participant_id': Field(str, max_length=36),
+        'last_version': Field(int),
+    }, connection_rate=Rate(per_second=0.2, burst=3)),
+    Command('user_left', 'handle_user_left', {
+        'participant_id': Field(str, max_length=36),
+    }, connection_rate=Rate(per_second=0.2, burst=3)),
+    # Clients heartbeat every 20 seconds
+    Command('heartbeat', 'handle_heartbeat', connection_rate=Rate(per_second=0.5, burst=3)),
+    Command('sync', 'handle_sync', {
+        'version': Field(int),
+    }, broadcasts=False, connection_rate=Rate(per_second=1, burst=5)),
+]}
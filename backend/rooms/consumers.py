@@ -1,10 +1,32 @@
 import json
 import logging
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.utils import timezone
-from .models import Room, Participant, Vote, Story
-from .serializers import RoomSerializer, ParticipantSerializer, VoteSerializer
+from .models import Participant, bump_room_version, clear_story_estimate, clear_votes, upsert_vote
+from .serializers import ParticipantSerializer, VoteSerializer
+from .snapshots import room_snapshot
+from . import patches
+from .broadcast import binary_frame, encode_frame, send_room_frame
+from .wire import DECODE_ERRORS, SUBPROTOCOL_MSGPACK, encode_binary, decode_binary
+from .engine import room_engine
+from .journal import journal
+from .coalescing import vote_coalescer
+from .db_executor import room_database_sync_to_async
+from .write_queue import room_database_write
+from .outbox import Outbox
+from .presence import presence
+from .replay import replay_buffer
+from .commands import COMMANDS, CommandError
+from .estimation import summarize_votes
+from .limits import MessageTooDeep, RateLimiter, frame_too_large, json_too_deep, room_limiter
+from .metrics import (
+    command_latency, command_errors, rejected_messages, resumes, ws_connections, ws_connections_opened, ws_messages
+)
 
 # Set up loggers
 websocket_logger = logging.getLogger('rooms.websocket')
@@ -17,512 +39,466 @@ class RoomConsumer(AsyncWebsocketConsumer):
         self.room_code = self.scope['url_route']['kwargs']['room_code']
         self.room_group_name = f'room_{self.room_code}'
         self.participant_id = None
+        # Commands run against the live in-memory room when the engine is enabled
+        self.store = room_engine.store_for(self.room_code, self) if room_engine.enabled else self
         
-        websocket_logger.info(f"WS CONNECT - New WebSocket connection to room {self.room_code}")
-        websocket_logger.debug(f"WS CONNECT - Channel name: {self.channel_name}")
+        websocket_logger.info("WS CONNECT - New WebSocket connection to room %s", self.room_code)
+        websocket_logger.debug("WS CONNECT - Channel name: %s", self.channel_name)
 
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        websocket_logger.info(f"WS CONNECT - Joined group {self.room_group_name}")
-
-        await self.accept()
-        websocket_logger.info(f"WS CONNECT - WebSocket connection accepted for room {self.room_code}")
+        websocket_logger.info("WS CONNECT - Joined group %s", self.room_group_name)
+
+        # Clients opt into compact binary frames through the WebSocket subprotocol
+        self.binary = SUBPROTOCOL_MSGPACK in self.scope.get('subprotocols', [])
+        await self.accept(subprotocol=SUBPROTOCOL_MSGPACK if self.binary else None)
+        websocket_logger.info("WS CONNECT - WebSocket connection accepted for room %s", self.room_code)
+        ws_connections.inc()
+        ws_connections_opened.inc()
+
+        # Outbound frames go through a bounded queue so a slow client can't pile them up
+        self.outbox = Outbox(
+            self.send_frame, self.snapshot_frame, self.close,
+            max_frames=getattr(settings, 'WS_OUTBOX_MAX_FRAMES', 512)
+        )
+        self.outbox.start()
+        presence.ensure_flusher()
+        self.rate_limiter = RateLimiter()
 
     async def disconnect(self, close_code):
-        websocket_logger.info(f"WS DISCONNECT - WebSocket disconnecting from room {self.room_code}, close_code: {close_code}")
+        websocket_logger.info("WS DISCONNECT - WebSocket disconnecting from room %s, close_code: %s", self.room_code, close_code)
         
         # Mark participant as disconnected if we have their ID
         if self.participant_id:
-            websocket_logger.info(f"WS DISCONNECT - Marking participant {self.participant_id} as disconnected")
-            await self.mark_user_disconnected(self.participant_id)
-            room_data = await self.get_room_data()
+            websocket_logger.info("WS DISCONNECT - Marking participant %s as disconnected", self.participant_id)
+            try:
+                result = await self.store.mark_user_disconnected(self.participant_id)
+            except CommandError:
+                # Removed from the room while connected
+                result = None
 
             # Broadcast user disconnection to room
-            websocket_logger.info(f"WS DISCONNECT - Broadcasting user_left for participant {self.participant_id}")
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_left_broadcast',
+            if result:
+                websocket_logger.info("WS DISCONNECT - Broadcasting user_left for participant %s", self.participant_id)
+                await self.broadcast({
+                    'type': 'user_left',
                     'participant_id': self.participant_id,
-                    'room': room_data
-                }
-            )
+                    'version': result['version'],
+                    'patch': patches.presence_patch(result['participant'], connected=False)
+                })
         else:
-            websocket_logger.info(f"WS DISCONNECT - No participant ID to disconnect")
+            websocket_logger.info("WS DISCONNECT - No participant ID to disconnect")
 
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
-        websocket_logger.info(f"WS DISCONNECT - Left group {self.room_group_name}")
+        websocket_logger.info("WS DISCONNECT - Left group %s", self.room_group_name)
 
-    async def receive(self, text_data):
-        websocket_logger.info(f"WS RECEIVE - Message received in room {self.room_code}")
-        websocket_logger.debug(f"WS RECEIVE - Raw message: {text_data}")
-        
+        if self.store is not self:
+            room_engine.release(self.room_code)
+
+        if hasattr(self, 'outbox'):
+            ws_connections.dec()
+            await self.outbox.stop()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        websocket_logger.info("WS RECEIVE - Message received in room %s", self.room_code)
+        websocket_logger.debug("WS RECEIVE - Raw message: %s", text_data if text_data is not None else bytes_data)
+
+        # Size and nesting are checked before the frame is parsed
+        max_bytes = getattr(settings, 'WS_MAX_FRAME_BYTES', 16384)
+        max_depth = getattr(settings, 'WS_MAX_JSON_DEPTH', 8)
+        if frame_too_large(text_data if text_data is not None else bytes_data, max_bytes):
+            await self.reject(None, 'too_large', f"Message is larger than {max_bytes} bytes")
+            return
+        if text_data is not None and json_too_deep(text_data, max_depth):
+            await self.reject(None, 'too_deep', f"Message is nested deeper than {max_depth} levels")
+            return
+
+        try:
+            data = json.loads(text_data) if text_data is not None else decode_binary(bytes_data, max_depth)
+        except MessageTooDeep as e:
+            await self.reject(None, 'too_deep', str(e))
+            return
+        except (json.JSONDecodeError, *DECODE_ERRORS) as e:
+            websocket_logger.error("WS RECEIVE - Invalid message payload: %s", e)
+            return
+
+        message_type = data.get('type') if isinstance(data, dict) else None
+        command = COMMANDS.get(message_type)
+        ws_messages.inc(type=command.type if command else 'unknown')
+        if command is None:
+            websocket_logger.warning("WS RECEIVE - Unknown message type: %s", message_type)
+            return
+
+        if not await self.within_rate_limits(command):
+            return
+
+        websocket_logger.info("WS RECEIVE - Handling %s message", message_type)
+        await self.dispatch_command(command, data)
+
+    async def within_rate_limits(self, command):
+        """Take a token from the connection and room buckets, rejecting the command if either is empty"""
+        if not getattr(settings, 'WS_RATE_LIMITS_ENABLED', True):
+            return True
+        if command.connection_rate and not self.rate_limiter.allow(command.type, command.connection_rate):
+            reason = 'connection_rate'
+        elif command.room_rate and not room_limiter.allow((self.room_code, command.type), command.room_rate):
+            reason = 'room_rate'
+        else:
+            return True
+        await self.reject(command.type, reason, 'Too many requests, slow down')
+        return False
+
+    async def reject(self, message_type, reason, message):
+        rejected_messages.inc(type=message_type or 'unknown', reason=reason)
+        websocket_logger.warning("WS RECEIVE - Rejected %s in room %s: %s", message_type or 'message', self.room_code, reason)
+        error = {'type': 'error', 'message': message}
+        if message_type:
+            error['command'] = message_type
+        await self.send_message(error)
+
+    async def dispatch_command(self, command, data):
+        start_time = time.perf_counter()
         try:
-            data = json.loads(text_data)
-            message_type = data.get('type')
-            websocket_logger.info(f"WS RECEIVE - Message type: {message_type}")
-            websocket_logger.debug(f"WS RECEIVE - Parsed data: {json.dumps(data, default=str)}")
-
-            if message_type == 'vote':
-                websocket_logger.info(f"WS RECEIVE - Handling vote message")
-                await self.handle_vote(data)
-            elif message_type == 'reveal':
-                websocket_logger.info(f"WS RECEIVE - Handling reveal message")
-                await self.handle_reveal(data)
-            elif message_type == 'reset':
-                websocket_logger.info(f"WS RECEIVE - Handling reset message")
-                await self.handle_reset(data)
-            elif message_type == 'confirm_points':
-                websocket_logger.info(f"WS RECEIVE - Handling confirm_points message")
-                await self.handle_confirm_points(data)
-            elif message_type == 'add_story':
-                websocket_logger.info(f"WS RECEIVE - Handling add_story message")
-                await self.handle_add_story(data)
-            elif message_type == 'change_story':
-                websocket_logger.info(f"WS RECEIVE - Handling change_story message")
-                await self.handle_change_story(data)
-            elif message_type == 'switch_to_existing_story':
-                websocket_logger.info(f"WS RECEIVE - Handling switch_to_existing_story message")
-                await self.handle_switch_to_existing_story(data)
-            elif message_type == 'user_joined':
-                websocket_logger.info(f"WS RECEIVE - Handling user_joined message")
-                await self.handle_user_joined(data)
-            elif message_type == 'user_left':
-                websocket_logger.info(f"WS RECEIVE - Handling user_left message")
-                await self.handle_user_left(data)
-            else:
-                websocket_logger.warning(f"WS RECEIVE - Unknown message type: {message_type}")
-                
-        except json.JSONDecodeError as e:
-            websocket_logger.error(f"WS RECEIVE - Invalid JSON in message: {str(e)}")
+            command.validate(data)
+            message = await getattr(self, command.handler)(data)
+            if command.broadcasts and message:
+                await self.broadcast(message)
+        except CommandError as e:
+            command_errors.inc(type=command.type, reason='invalid')
+            websocket_logger.warning("WS RECEIVE - Invalid %s message: %s", command.type, e)
+            await self.send_message({
+                'type': 'error',
+                'command': command.type,
+                'message': str(e)
+            })
         except Exception as e:
-            websocket_logger.error(f"WS RECEIVE - Error handling message: {str(e)}")
+            command_errors.inc(type=command.type, reason='exception')
+            websocket_logger.error("WS RECEIVE - Error handling message: %s", e)
             raise
+        finally:
+            command_latency.observe(time.perf_counter() - start_time, type=command.type)
 
     async def handle_vote(self, data):
         participant_id = data.get('participant_id')
         story_id = data.get('story_id')
         value = data.get('value')
         
-        websocket_logger.info(f"WS VOTE - Participant {participant_id} voting '{value}' for story {story_id} in room {self.room_code}")
-        websocket_logger.debug(f"WS VOTE - Vote data: {json.dumps(data, default=str)}")
+        websocket_logger.info("WS VOTE - Participant %s voting '%s' for story %s in room %s", participant_id, value, story_id, self.room_code)
 
         try:
-            vote = await self.save_vote(participant_id, story_id, value)
-            websocket_logger.info(f"WS VOTE - Vote saved successfully for participant {participant_id}")
-            
-            room_data = await self.get_room_data()
-
-            # Broadcast vote to room
-            websocket_logger.info(f"WS VOTE - Broadcasting vote_cast to room {self.room_code}")
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'vote_cast',
-                    'participant_id': participant_id,
-                    'has_voted': True,
-                    'room': room_data
-                }
+            version = await self.store.save_vote(participant_id, story_id, value)
+            websocket_logger.info("WS VOTE - Vote saved successfully for participant %s", participant_id)
+            journal.record('vote_cast', self.room_code, story=story_id, participant=participant_id, value=value, version=version)
+
+            # Broadcast vote to room, merged with other votes in the same burst
+            await vote_coalescer.add_vote(
+                self.channel_layer, self.room_group_name, self.room_code,
+                story_id, participant_id, version
             )
-            websocket_logger.info(f"WS VOTE - Vote broadcast completed")
         except Exception as e:
-            websocket_logger.error(f"WS VOTE - Error handling vote: {str(e)}")
+            websocket_logger.error("WS VOTE - Error handling vote: %s", e)
             raise
 
     async def handle_reveal(self, data):
-        websocket_logger.info(f"WS REVEAL - Revealing votes in room {self.room_code}")
+        websocket_logger.info("WS REVEAL - Revealing votes in room %s", self.room_code)
         
         try:
-            calculation_result = await self.reveal_votes()
-            websocket_logger.info(f"WS REVEAL - Votes revealed, calculation result: {calculation_result}")
-            
-            room_data = await self.get_room_data()
+            result = await self.store.reveal_votes()
+            calculation_result = result['calculation']
+            websocket_logger.info("WS REVEAL - Votes revealed, calculation result: %s", calculation_result)
+            journal.record(
+                'votes_revealed', self.room_code, story=result['story'], version=result['version'],
+                votes={str(vote['participant']): vote['value'] for vote in result['votes']},
+                rounded=calculation_result['rounded'] if calculation_result else None,
+            )
 
             # Broadcast reveal to room with average calculation
-            websocket_logger.info(f"WS REVEAL - Broadcasting votes_revealed to room {self.room_code}")
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'votes_revealed',
-                    'room': room_data,
-                    'average': calculation_result['average'] if calculation_result else None,
-                    'rounded': calculation_result['rounded'] if calculation_result else None,
-                    'discussion_message': calculation_result['discussion_message'] if calculation_result else None
-                }
-            )
-            websocket_logger.info(f"WS REVEAL - Reveal broadcast completed")
+            websocket_logger.info("WS REVEAL - Broadcasting votes_revealed to room %s", self.room_code)
+            return {
+                'type': 'votes_revealed',
+                'version': result['version'],
+                'patch': patches.votes_revealed_patch(result['story'], result['votes']),
+                'average': calculation_result['average'] if calculation_result else None,
+                'rounded': calculation_result['rounded'] if calculation_result else None,
+                'discussion_message': calculation_result['discussion_message'] if calculation_result else None
+            }
         except Exception as e:
-            websocket_logger.error(f"WS REVEAL - Error handling reveal: {str(e)}")
+            websocket_logger.error("WS REVEAL - Error handling reveal: %s", e)
             raise
 
     async def handle_reset(self, data):
-        await self.reset_votes()
-        room_data = await self.get_room_data()
+        story_id, version = await self.store.reset_votes()
+        journal.record('votes_reset', self.room_code, story=story_id, version=version)
 
         # Broadcast reset to room
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'room_reset',
-                'room': room_data
-            }
-        )
+        return {
+            'type': 'room_reset',
+            'version': version,
+            'patch': patches.votes_reset_patch(story_id)
+        }
 
     async def handle_confirm_points(self, data):
         points = data.get('points')
-        await self.confirm_story_points(points)
-        room_data = await self.get_room_data()
+        result = await self.store.confirm_story_points(points)
+        journal.record('points_confirmed', self.room_code, story=result['story'], points=result['final_points'], version=result['version'])
 
         # Broadcast confirmation to room
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'points_confirmed',
-                'room': room_data
-            }
-        )
+        return {
+            'type': 'points_confirmed',
+            'version': result['version'],
+            'patch': patches.points_confirmed_patch(result['story'], result['final_points'], result['estimated_at'])
+        }
 
     async def handle_add_story(self, data):
         story_id = data.get('story_id', '')
         title = data.get('title', '')
         
-        websocket_logger.info(f"WS ADD_STORY - Adding story '{story_id}': '{title}' to room {self.room_code}")
-        websocket_logger.debug(f"WS ADD_STORY - Story data: {json.dumps(data, default=str)}")
+        websocket_logger.info("WS ADD_STORY - Adding story '%s': '%s' to room %s", story_id, title, self.room_code)
 
         try:
-            result = await self.add_story(story_id, title)
-            websocket_logger.info(f"WS ADD_STORY - Story creation result: exists={result.get('exists')}")
-            
-            room_data = await self.get_room_data()
+            result = await self.store.add_story(story_id, title)
+            websocket_logger.info("WS ADD_STORY - Story creation result: exists=%s", result.get('exists'))
 
             # If story already exists, ask for confirmation
             if result.get('exists'):
-                websocket_logger.info(f"WS ADD_STORY - Story already exists, sending confirmation request")
-                await self.send(text_data=json.dumps({
+                websocket_logger.info("WS ADD_STORY - Story already exists, sending confirmation request")
+                await self.send_message({
                     'type': 'story_exists',
-                    'story': result['story'],
-                    'room': room_data
-                }))
-            else:
-                # Broadcast new story to room
-                websocket_logger.info(f"WS ADD_STORY - Broadcasting story_added to room {self.room_code}")
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'story_added',
-                        'story': result['story'],
-                        'room': room_data
-                    }
-                )
-                websocket_logger.info(f"WS ADD_STORY - Story broadcast completed")
+                    'story': result['story']
+                })
+                return None
+
+            story = result['story']
+            journal.record(
+                'story_added', self.room_code, story=story['id'], story_id=story['story_id'], title=story['title'],
+                current=True, cleared_story=result['cleared_story'], version=result['version'],
+            )
+
+            # Broadcast new story to room
+            websocket_logger.info("WS ADD_STORY - Broadcasting story_added to room %s", self.room_code)
+            return {
+                'type': 'story_added',
+                'version': result['version'],
+                'patch': patches.story_added_patch(result['story'], result['cleared_story'])
+            }
         except Exception as e:
-            websocket_logger.error(f"WS ADD_STORY - Error adding story: {str(e)}")
+            websocket_logger.error("WS ADD_STORY - Error adding story: %s", e)
             raise
 
     async def handle_change_story(self, data):
         story_id = data.get('story_id')
 
-        await self.change_current_story(story_id)
-        room_data = await self.get_room_data()
+        version = await self.store.change_current_story(story_id)
+        journal.record('story_changed', self.room_code, story=story_id, version=version)
 
         # Broadcast story change to room
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'story_changed',
-                'room': room_data
-            }
-        )
-
-    async def handle_switch_to_existing_story(self, data):
-        story_id = data.get('story_id')
+        return {
+            'type': 'story_changed',
+            'version': version,
+            'patch': patches.current_story_patch(story_id)
+        }
 
-        await self.switch_to_existing_story(story_id)
-        room_data = await self.get_room_data()
-
-        # Broadcast story change to room
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'story_changed',
-                'room': room_data
-            }
-        )
+    handle_switch_to_existing_story = handle_change_story
 
     async def handle_user_joined(self, data):
         username = data.get('username')
         participant_id = data.get('participant_id')
         
+        result = None
+
         # Store participant ID for disconnection handling
         if participant_id:
-            self.participant_id = participant_id
             # Ensure participant is marked as connected
-            await self.mark_user_connected(participant_id)
+            result = await self.store.mark_user_connected(participant_id)
+            self.participant_id = participant_id
         elif username:
             # Fallback: find participant by username if ID not provided
-            participant = await self.get_participant_by_username(username)
+            participant = await self.store.get_participant_by_username(username)
             if participant:
                 self.participant_id = participant['id']
-                await self.mark_user_connected(self.participant_id)
+                result = await self.store.mark_user_connected(self.participant_id)
 
-        room_data = await self.get_room_data()
+        # The joining client catches up on what it missed (or gets a snapshot);
+        # everyone else only sees a presence patch, and only if presence changed
+        await self.send_catch_up(data.get('last_version'))
 
-        # Broadcast user joined to room
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_joined_broadcast',
+        if result:
+            return {
+                'type': 'user_joined',
                 'username': username,
-                'room': room_data
+                'version': result['version'],
+                'patch': patches.presence_patch(result['participant'], connected=True)
             }
-        )
+        return None
 
     async def handle_user_left(self, data):
         participant_id = data.get('participant_id')
 
-        await self.mark_user_disconnected(participant_id)
-        room_data = await self.get_room_data()
+        result = await self.store.mark_user_disconnected(participant_id)
 
         # Broadcast user left to room
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_left_broadcast',
+        if result:
+            return {
+                'type': 'user_left',
                 'participant_id': participant_id,
-                'room': room_data
+                'version': result['version'],
+                'patch': patches.presence_patch(result['participant'], connected=False)
             }
-        )
+        return None
 
-    # Broadcast handlers
-    async def vote_cast(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'vote_cast',
-            'participant_id': event['participant_id'],
-            'has_voted': event['has_voted'],
-            'room': event['room']
-        }))
-
-    async def votes_revealed(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'votes_revealed',
-            'room': event['room'],
-            'average': event.get('average'),
-            'rounded': event.get('rounded'),
-            'discussion_message': event.get('discussion_message')
-        }))
-
-    async def points_confirmed(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'points_confirmed',
-            'room': event['room']
-        }))
+    async def handle_heartbeat(self, data):
+        if not self.participant_id:
+            return None
 
-    async def room_reset(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'room_reset',
-            'room': event['room']
-        }))
-
-    async def story_added(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'story_added',
-            'story': event['story'],
-            'room': event['room']
-        }))
-
-    async def story_changed(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'story_changed',
-            'room': event['room']
-        }))
-
-    async def user_joined_broadcast(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'user_joined',
-            'username': event['username'],
-            'room': event['room']
-        }))
-
-    async def user_left_broadcast(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'user_left',
-            'participant_id': event['participant_id'],
-            'room': event['room']
-        }))
+        if await self.store.refresh_presence(self.participant_id):
+            return None
 
-    # Database operations
-    @database_sync_to_async
-    def save_vote(self, participant_id, story_id, value):
-        from .models import Participant, Story, Vote, Room
+        # Presence had already expired, so the room saw this participant leave
+        websocket_logger.info("WS HEARTBEAT - Participant %s is back in room %s", self.participant_id, self.room_code)
+        result = await self.store.mark_user_connected(self.participant_id)
+        if result:
+            return {
+                'type': 'user_joined',
+                'username': result['participant']['username'],
+                'version': result['version'],
+                'patch': patches.presence_patch(result['participant'], connected=True)
+            }
+        return None
 
-        room = Room.objects.get(code=self.room_code)
-        participant = Participant.objects.get(id=participant_id)
-        story = Story.objects.get(id=story_id)
+    async def handle_sync(self, data):
+        # Client detected a version gap
+        client_version = data.get('version')
+        websocket_logger.info("WS SYNC - Client at version %s requested a sync in room %s", client_version, self.room_code)
+        await self.send_catch_up(client_version)
+
+    async def send_catch_up(self, last_version):
+        """Replay the broadcasts a client missed since last_version, or send a snapshot"""
+        entries = None
+        if last_version is not None:
+            entries = await replay_buffer.asince(self.room_code, last_version)
+
+        # A replay that wouldn't fit in the outbox would only overflow it
+        if entries is None or not self.outbox.has_room(len(entries) + 1):
+            resumes.inc(outcome='snapshot')
+            await self.send_snapshot()
+            return
+
+        resumes.inc(outcome='replay')
+        websocket_logger.info("WS RESUME - Replaying %s frame(s) after version %s in room %s", len(entries), last_version, self.room_code)
+        # The marker tells the client that the frames after it fill its gap
+        self.outbox.put(self.encode({'type': 'replay', 'from_version': last_version, 'count': len(entries)}))
+        for entry in entries:
+            self.outbox.put(binary_frame(entry['text']) if self.binary else entry['text'])
+
+    async def send_snapshot(self):
+        self.outbox.put(await self.snapshot_frame(), snapshot=True)
+
+    async def snapshot_frame(self):
+        room_data = await self.store.get_room_data()
+        return self.encode({
+            'type': 'snapshot',
+            'version': room_data['version'],
+            'room': room_data
+        })
+
+    def encode(self, message):
+        """Encode a message in this client's negotiated wire format"""
+        return encode_binary(message) if self.binary else encode_frame(message)
+
+    async def send_message(self, message):
+        """Send a message to this client only"""
+        self.outbox.put(self.encode(message))
+
+    async def send_frame(self, frame):
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
 
-        vote, created = Vote.objects.update_or_create(
-            participant=participant,
-            story=story,
-            defaults={'value': value, 'room': room}
-        )
+    async def broadcast(self, message):
+        """Encode a room message once and fan the same frame out to every member"""
+        # Pending coalesced votes go out first so events stay in order
+        await vote_coalescer.flush(self.room_code)
+        await send_room_frame(self.channel_layer, self.room_group_name, self.room_code, message)
 
-        return VoteSerializer(vote).data
+    # Broadcast handlers
+    async def room_frame(self, event):
+        self.outbox.put(binary_frame(event['text']) if self.binary else event['text'])
 
-    @database_sync_to_async
+    # Database operations
+    @room_database_write
+    def save_vote(self, participant_id, story_id, value):
+        with transaction.atomic():
+            if not upsert_vote(self.room_code, participant_id, story_id, value):
+                raise CommandError("Participant or story is not in this room")
+            return bump_room_version(self.room_code)
+
+    @room_database_write
     def reveal_votes(self):
         from .models import Room, Vote
 
         room = Room.objects.get(code=self.room_code)
-
-        if room.current_story:
-            votes = Vote.objects.filter(room=room, story=room.current_story)
-            votes.update(revealed=True)
-
-            # Calculate estimate using Planning Poker best practices (excluding ? and coffee)
-            numeric_votes = votes.exclude(value__in=['?', 'coffee']).values_list('value', flat=True)
-            if numeric_votes:
-                vote_values = [int(v) for v in numeric_votes]
-                average = sum(vote_values) / len(vote_values)  # Keep for display
-                rounded = self.calculate_planning_poker_estimate(numeric_votes)
-
-                # Check for discussion suggestion
-                discussion_message = self.get_discussion_suggestion(votes, numeric_votes)
-                
-                # Don't save yet - wait for confirmation
-                # Just mark as revealed
-                return {
-                    'average': average, 
-                    'rounded': rounded,
-                    'discussion_message': discussion_message
-                }
-        return None
-
-    def calculate_planning_poker_estimate(self, votes):
-        """Calculate estimate using Planning Poker best practices"""
-        fibonacci_sequence = [1, 2, 3, 5, 8, 13, 21, 34, 55, 89]
-        
-        if not votes:
-            return None
-            
-        # Convert votes to integers and sort
-        vote_values = sorted([int(v) for v in votes])
-        min_vote = vote_values[0]
-        max_vote = vote_values[-1]
-        
-        # Find positions in Fibonacci sequence
-        min_pos = next((i for i, fib in enumerate(fibonacci_sequence) if fib >= min_vote), 0)
-        max_pos = next((i for i, fib in enumerate(fibonacci_sequence) if fib >= max_vote), len(fibonacci_sequence) - 1)
-        
-        # Check for wide spread (more than 2 Fibonacci steps apart)
-        spread = max_pos - min_pos
-        
-        if spread > 2:
-            # Wide spread - suggest towards higher estimate with median approach
-            # This encourages discussion and tends toward the complexity some see
-            if len(vote_values) == 1:
-                return vote_values[0]
-            
-            # Use 75th percentile approach for wide spreads
-            import statistics
-            percentile_75 = statistics.quantiles(vote_values, n=4)[2]  # 75th percentile
-            
-            # Round up to nearest Fibonacci
-            for fib in fibonacci_sequence:
-                if percentile_75 <= fib:
-                    return fib
-            return fibonacci_sequence[-1]
+        result = {'story': room.current_story_id, 'votes': [], 'calculation': None}
+
+        if room.current_story_id:
+            votes = Vote.objects.filter(room=room, story_id=room.current_story_id)
+            with transaction.atomic():
+                votes.update(revealed=True)
+                result['version'] = bump_room_version(self.room_code)
+                # One query for the votes and their voters, read in the same transaction
+                # as the reveal; the estimate is built from the same rows
+                votes = votes.select_related('participant')
+                result['votes'] = json.loads(json.dumps(VoteSerializer(votes, many=True).data, default=str))
+
+            # Don't save yet - wait for confirmation, just report the estimate
+            result['calculation'] = summarize_votes((v['value'], v['participant_name']) for v in result['votes'])
         else:
-            # Normal spread - use median or standard approach
-            import statistics
-            median = statistics.median(vote_values)
-            
-            # Round to nearest Fibonacci (up)
-            for fib in fibonacci_sequence:
-                if median <= fib:
-                    return fib
-            return fibonacci_sequence[-1]
-
-    def get_discussion_suggestion(self, all_votes, numeric_votes):
-        """Generate discussion suggestion when there are wide spreads in votes"""
-        if not numeric_votes or len(numeric_votes) < 2:
-            return None
-            
-        # Convert to integers and find min/max
-        vote_values = [int(v) for v in numeric_votes]
-        min_vote = min(vote_values)
-        max_vote = max(vote_values)
-        
-        # Find Fibonacci positions
-        fibonacci_sequence = [1, 2, 3, 5, 8, 13, 21, 34, 55, 89]
-        min_pos = next((i for i, fib in enumerate(fibonacci_sequence) if fib >= min_vote), 0)
-        max_pos = next((i for i, fib in enumerate(fibonacci_sequence) if fib >= max_vote), len(fibonacci_sequence) - 1)
-        
-        # Check for wide spread (more than 2 Fibonacci steps apart)
-        spread = max_pos - min_pos
-        
-        if spread > 2:
-            # Find participants with min and max votes
-            min_voters = []
-            max_voters = []
-            
-            for vote in all_votes:
-                if vote.value not in ['?', 'coffee']:
-                    vote_val = int(vote.value)
-                    if vote_val == min_vote:
-                        min_voters.append(vote.participant.username)
-                    elif vote_val == max_vote:
-                        max_voters.append(vote.participant.username)
-            
-            # Create discussion message
-            min_voter = min_voters[0] if min_voters else "someone"
-            max_voter = max_voters[0] if max_voters else "someone"
-            
-            return {
-                "message": f"Wide spread detected! {min_voter} (voted {min_vote}) and {max_voter} (voted {max_vote}) should discuss the story complexity.",
-                "min_vote": min_vote,
-                "max_vote": max_vote,
-                "min_voter": min_voter,
-                "max_voter": max_voter,
-                "spread_level": "high" if spread > 4 else "medium"
-            }
-        
-        return None
+            result['version'] = bump_room_version(self.room_code)
+        return result
 
-    @database_sync_to_async
+    @room_database_write
     def reset_votes(self):
-        from .models import Room, Vote
+        from .models import Room
 
         room = Room.objects.get(code=self.room_code)
 
-        if room.current_story:
-            # Delete all votes for current story
-            Vote.objects.filter(room=room, story=room.current_story).delete()
-            
-            # Reset story estimation - clear final points and timestamp
-            room.current_story.final_points = None
-            room.current_story.estimated_at = None
-            room.current_story.save()
+        with transaction.atomic():
+            if room.current_story_id:
+                # Delete all votes for current story and clear its final points and timestamp
+                clear_votes(room.pk, room.current_story_id, reason='reset')
+                clear_story_estimate(room.current_story_id)
+            version = bump_room_version(self.room_code)
+
+        return room.current_story_id, version
 
-    @database_sync_to_async
+    @room_database_write
     def confirm_story_points(self, points):
         from .models import Room
 
         room = Room.objects.get(code=self.room_code)
+        result = {'story': room.current_story_id, 'final_points': None, 'estimated_at': None}
 
-        if room.current_story:
-            room.current_story.final_points = str(points)
-            room.current_story.estimated_at = timezone.now()
-            room.current_story.save()
+        with transaction.atomic():
+            if room.current_story:
+                room.current_story.final_points = str(points)
+                room.current_story.estimated_at = timezone.now()
+                room.current_story.save()
+                result['final_points'] = room.current_story.final_points
+                result['estimated_at'] = room.current_story.estimated_at
+            result['version'] = bump_room_version(self.room_code)
 
-    @database_sync_to_async
+        return result
+
+    @room_database_write
     def add_story(self, story_id, title):
-        from .models import Room, Story, Vote, generate_funny_story
+        from .models import Room, Story, generate_funny_story
 
         room = Room.objects.get(code=self.room_code)
 
@@ -550,75 +526,87 @@ class RoomConsumer(AsyncWebsocketConsumer):
                 }
 
         max_order = Story.objects.filter(room=room).count()
+        cleared_story = room.current_story_id
+
+        with transaction.atomic():
+            story = Story.objects.create(
+                room=room,
+                story_id=story_id,
+                title=title,
+                order=max_order
+            )
 
-        story = Story.objects.create(
-            room=room,
-            story_id=story_id,
-            title=title,
-            order=max_order
-        )
-
-        # Always set as current story and clear votes for previous story
-        if room.current_story:
-            # Clear votes for previous story
-            Vote.objects.filter(room=room, story=room.current_story).delete()
+            # Always set as current story and clear votes for previous story
+            if room.current_story_id:
+                # Clear votes for previous story
+                clear_votes(room.pk, room.current_story_id, reason='new_story')
 
-        room.current_story = story
-        room.save()
+            room.current_story = story
+            room.save(update_fields=['current_story', 'updated_at'])
+            version = bump_room_version(self.room_code)
 
         from .serializers import StorySerializer
         return {
-            'story': StorySerializer(story).data,
-            'exists': False
+            'story': json.loads(json.dumps(StorySerializer(story).data, default=str)),
+            'exists': False,
+            'cleared_story': cleared_story,
+            'version': version
         }
 
-    @database_sync_to_async
+    @room_database_write
     def change_current_story(self, story_id):
-        from .models import Room, Story, Vote
+        from .models import Story
 
-        room = Room.objects.get(code=self.room_code)
-        story = Story.objects.get(id=story_id)
+        try:
+            story = Story.objects.select_related('room').get(id=story_id, room__code=self.room_code)
+        except (Story.DoesNotExist, ValidationError):
+            raise CommandError("Story is not in this room")
+        room = story.room
 
         # Don't delete votes when switching stories - preserve them!
         # Only switch the current story pointer
-        room.current_story = story
-        room.save()
-
-    @database_sync_to_async
-    def switch_to_existing_story(self, story_id):
-        from .models import Room, Story, Vote
+        with transaction.atomic():
+            room.current_story = story
+            room.save(update_fields=['current_story', 'updated_at'])
+            return bump_room_version(self.room_code)
+
+    def set_presence(self, participant_id, connected):
+        # Presence lives in Redis; the Participant row is updated later in a batch.
+        # Returns None when there is nothing to broadcast.
+        try:
+            participant = Participant.objects.get(id=participant_id, room__code=self.room_code)
+        except (Participant.DoesNotExist, ValidationError):
+            raise CommandError("Participant is not in this room")
 
-        room = Room.objects.get(code=self.room_code)
-        story = Story.objects.get(id=story_id)
+        connected_ids = presence.connected_ids(self.room_code)
+        if connected_ids is not None and (str(participant_id) in connected_ids) == connected:
+            # e.g. a quick reconnect, or user_left followed by the socket closing
+            return None
+        version = bump_room_version(self.room_code)
+        # Redis only changes once the version bump commits, so a write queue
+        # batch that fails to commit leaves presence as it was
+        change = presence.connect if connected else presence.disconnect
+        transaction.on_commit(lambda: change(self.room_code, participant_id))
 
-        # Don't delete votes when switching stories - preserve them!
-        # Only switch the current story pointer
-        room.current_story = story
-        room.save()
+        connected_ids = {str(participant.id)} if connected else set()
+        return {
+            'participant': json.loads(json.dumps(
+                ParticipantSerializer(participant, context={'connected_ids': connected_ids}).data, default=str)),
+            'version': version
+        }
 
-    @database_sync_to_async
+    @room_database_write
     def mark_user_disconnected(self, participant_id):
-        from .models import Participant
+        return self.set_presence(participant_id, connected=False)
 
-        try:
-            participant = Participant.objects.get(id=participant_id)
-            participant.connected = False
-            participant.save()
-        except Participant.DoesNotExist:
-            pass
-
-    @database_sync_to_async
+    @room_database_write
     def mark_user_connected(self, participant_id):
-        from .models import Participant
+        return self.set_presence(participant_id, connected=True)
 
-        try:
-            participant = Participant.objects.get(id=participant_id)
-            participant.connected = True
-            participant.save()
-        except Participant.DoesNotExist:
-            pass
+    async def refresh_presence(self, participant_id):
+        return await sync_to_async(presence.heartbeat, thread_sensitive=False)(self.room_code, participant_id)
 
-    @database_sync_to_async
+    @room_database_sync_to_async
     def get_participant_by_username(self, username):
         from .models import Participant, Room
         from .serializers import ParticipantSerializer
@@ -630,12 +618,9 @@ class RoomConsumer(AsyncWebsocketConsumer):
         except Participant.DoesNotExist:
             return None
 
-    @database_sync_to_async
+    @room_database_sync_to_async
     def get_room_data(self):
         from .models import Room
-        import json
 
         room = Room.objects.get(code=self.room_code)
-        # Convert to JSON and back to ensure all UUIDs are converted to strings
-        serialized_data = RoomSerializer(room).data
-        return json.loads(json.dumps(serialized_data, default=str))
+        return room_snapshot(room)
@@ -0,0 +1,72 @@
+"""
+Room-sharded thread pool for consumer database work
+
+``@database_sync_to_async`` is thread-sensitive, so every consumer's ORM calls
+in a process share one thread and a slow query in one room delays every other
+room. With ``CONSUMER_DB_THREADS`` > 0, consumer DB methods decorated with
+``@room_database_sync_to_async`` run on a pool of that many single-thread
+executors instead:
+
+- a room always maps to the same executor, so its commands still run one at
+  a time and in order (version bumps depend on that)
+- different rooms spread over the executors and run concurrently
+- each executor thread keeps its own Django connection, cleaned up with
+  ``close_old_connections()`` around every call like ``database_sync_to_async``
+
+With 0 the methods fall back to plain ``database_sync_to_async``. SQLite
+still serializes writers, so the gain there is mostly for reads and for
+rooms stuck behind another room's slow command; rooms.write_queue takes
+the writes off these threads altogether.
+"""
+import functools
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import DatabaseSyncToAsync, database_sync_to_async
+from django.conf import settings
+
+
+class RoomExecutorPool:
+    def __init__(self):
+        self.executors = []
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return getattr(settings, 'CONSUMER_DB_THREADS', 0)
+
+    def executor_for(self, room_code):
+        """The executor that runs this room's DB work, or None when the pool is off"""
+        size = self.size
+        if size <= 0:
+            return None
+        if len(self.executors) != size:
+            self._resize(size)
+        return self.executors[zlib.crc32(room_code.encode()) % size]
+
+    def _resize(self, size):
+        with self._lock:
+            if len(self.executors) == size:
+                return
+            old, self.executors = self.executors, [
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'room-db-{i}')
+                for i in range(size)
+            ]
+        for executor in old:
+            executor.shutdown(wait=False)
+
+
+room_executors = RoomExecutorPool()
+
+
+def room_database_sync_to_async(func):
+    """``database_sync_to_async`` for consumer methods, run on the room's executor"""
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        executor = room_executors.executor_for(self.room_code)
+        if executor is None:
+            return await database_sync_to_async(func)(self, *args, **kwargs)
+        return await DatabaseSyncToAsync(func, thread_sensitive=False, executor=executor)(self, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,503 @@
+"""
+In-memory authoritative room engine with write-behind persistence
+
+When ``ROOM_ENGINE_ENABLED`` is on, a live room's state (participants, stories,
+current story and hidden votes) is kept in process memory. WebSocket commands
+are applied to that state and broadcast straight from it; the matching
+``Room``/``Story``/``Vote`` writes are queued and persisted in batches by a
+background task (presence goes through ``rooms.presence``). Idle rooms are
+flushed and evicted, and rebuilt from the database the next time they are used.
+
+The engine is per process, so it is only authoritative when every connection
+for a room lands on the same worker. REST endpoints that mutate a room call
+``room_engine.forget()`` first, which persists the room's queued writes and
+drops it, so their change lands after those writes and the next command
+reloads the room from the database. A batch that keeps failing to persist is
+dropped after ``MAX_FLUSH_ATTEMPTS`` and its rooms are reloaded the same way.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from rest_framework import serializers
+
+from .commands import CommandError
+from .estimation import get_deck, summarize_votes
+from .models import Room, Participant, Story, Vote, clear_votes, generate_funny_story
+from .presence import presence
+from .serializers import RoomSerializer
+from .write_queue import database_write
+
+engine_logger = logging.getLogger('rooms.engine')
+
+_datetime_field = serializers.DateTimeField()
+
+# Failed flushes in a row before the queued writes are dropped
+MAX_FLUSH_ATTEMPTS = 3
+
+
+def _timestamp(value):
+    """Format a datetime the same way the DRF serializers do"""
+    return _datetime_field.to_representation(value) if value else None
+
+
+class LiveRoom:
+    """Authoritative in-memory state for one room"""
+
+    def __init__(self, data, room_pk):
+        self.lock = threading.Lock()
+        self.pk = room_pk
+        self.code = data['code']
+        self.session_name = data['session_name']
+        self.created_at = data['created_at']
+        self.updated_at = data['updated_at']
+        self.version = data['version']
+        self.current_story = data['current_story']
+        self.participants = {p['id']: dict(p) for p in data['participants']}
+        self.stories = {}
+        self.votes = {}
+        for story in data['stories']:
+            story = dict(story)
+            self.votes[story['id']] = {v['participant']: dict(v) for v in story.pop('votes')}
+            story.pop('votes_count', None)
+            self.stories[story['id']] = story
+        self.last_active = time.monotonic()
+
+    @classmethod
+    def load(cls, room_code):
+        """Rebuild a live room from the database"""
+        import json
+
+        room = Room.objects.prefetch_related(*RoomSerializer.PREFETCH).get(code=room_code)
+        data = json.loads(json.dumps(RoomSerializer(room).data, default=str))
+        return cls(data, room.pk)
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def bump(self):
+        self.version += 1
+        self.updated_at = _timestamp(timezone.now())
+        return self.version
+
+    def story_data(self, story_id):
+        story = dict(self.stories[story_id])
+        votes = list(self.votes[story_id].values())
+        story['votes'] = votes
+        story['votes_count'] = len(votes)
+        return story
+
+    def snapshot(self):
+        """Room data in the same shape as RoomSerializer output"""
+        with self.lock:
+            stories = sorted(self.stories, key=lambda sid: (self.stories[sid]['order'], self.stories[sid]['created_at']))
+            participants = sorted(self.participants.values(), key=lambda p: p['joined_at'])
+            return {
+                'code': self.code,
+                'session_name': self.session_name,
+                'created_at': self.created_at,
+                'updated_at': self.updated_at,
+                'current_story': self.current_story,
+                'current_story_data': self.story_data(self.current_story) if self.current_story else None,
+                'participants': [dict(p) for p in participants],
+                'stories': [self.story_data(sid) for sid in stories],
+                'participants_count': sum(1 for p in participants if p['connected']),
+                'deck': list(get_deck().cards),
+                'version': self.version,
+            }
+
+
+def apply_writes(writes):
+    """Persist a batch of queued engine writes in one transaction"""
+    with transaction.atomic():
+        for op, args in writes:
+            if op == 'vote':
+                Vote.objects.update_or_create(
+                    participant_id=args['participant'],
+                    story_id=args['story'],
+                    defaults={'value': args['value'], 'room_id': args['room']},
+                    create_defaults={'id': args['id'], 'value': args['value'], 'room_id': args['room']},
+                )
+            elif op == 'reveal':
+                Vote.objects.filter(story_id=args['story']).update(revealed=True)
+            elif op == 'clear_votes':
+                clear_votes(args['room'], args['story'], reason=args['reason'])
+            elif op == 'create_story':
+                Story.objects.create(
+                    id=args['id'], room_id=args['room'], story_id=args['story_id'],
+                    title=args['title'], order=args['order'],
+                )
+            elif op == 'update_story':
+                fields = {k: v for k, v in args.items() if k != 'id'}
+                Story.objects.filter(id=args['id']).update(**fields)
+            elif op == 'update_room':
+                fields = {k: v for k, v in args.items() if k != 'id'}
+                # Never move the version back past a bump made outside the engine
+                fields['version'] = Greatest(F('version'), Value(fields['version']))
+                Room.objects.filter(id=args['id']).update(updated_at=timezone.now(), **fields)
+
+
+class RoomEngine:
+    """Registry of live rooms for this process plus the write-behind queue"""
+
+    def __init__(self):
+        self.rooms = {}
+        self.connections = {}
+        # (room code, op, args) writes waiting for the next flush
+        self.pending = []
+        self.failed_flushes = 0
+        self._load_locks = {}
+        self._task = None
+        # REST views forget rooms from their own threads: _lock guards
+        # pending, _write_lock is held while queued writes are applied
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'ROOM_ENGINE_ENABLED', False)
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'ROOM_ENGINE_FLUSH_INTERVAL', 0.5)
+
+    @property
+    def idle_timeout(self):
+        return getattr(settings, 'ROOM_ENGINE_IDLE_TIMEOUT', 300)
+
+    def store_for(self, room_code, consumer):
+        """Return the command store a consumer should use for its room"""
+        self.connections[room_code] = self.connections.get(room_code, 0) + 1
+        self._ensure_flusher()
+        return LiveRoomStore(self, room_code, consumer)
+
+    def release(self, room_code):
+        """Drop a consumer's reference; the room becomes eligible for eviction"""
+        count = self.connections.get(room_code, 0) - 1
+        if count > 0:
+            self.connections[room_code] = count
+        else:
+            self.connections.pop(room_code, None)
+
+    async def get(self, room_code):
+        """Return the live room, loading it from the database on first use"""
+        room = self.rooms.get(room_code)
+        if room is None:
+            lock = self._load_locks.setdefault(room_code, asyncio.Lock())
+            async with lock:
+                room = self.rooms.get(room_code)
+                if room is None:
+                    room = await database_sync_to_async(LiveRoom.load)(room_code)
+                    self.rooms[room_code] = room
+                    engine_logger.info("ENGINE LOAD - Room %s loaded at version %s", room_code, room.version)
+            self._load_locks.pop(room_code, None)
+        room.touch()
+        return room
+
+    def peek_snapshot(self, room_code):
+        """Snapshot of a live room, or None if it is not loaded in this process"""
+        room = self.rooms.get(room_code)
+        return room.snapshot() if room else None
+
+    def forget(self, room_code):
+        """Persist a live room's queued writes and discard it so it is rebuilt from the database on next use
+
+        Called from the (synchronous) REST views before they change the room.
+        """
+        try:
+            self.persist_pending(room_code)
+        except Exception as e:
+            dropped = self._take_pending(room_code)
+            engine_logger.error("ENGINE FORGET - Dropped %s queued writes for room %s: %s", len(dropped), room_code, e)
+        if self.rooms.pop(room_code, None):
+            engine_logger.info("ENGINE FORGET - Room %s dropped from memory", room_code)
+
+    def enqueue(self, room_code, op, **args):
+        with self._lock:
+            self.pending.append((room_code, op, args))
+
+    def _take_pending(self, room_code=None):
+        with self._lock:
+            if room_code is None:
+                batch, self.pending = self.pending, []
+            else:
+                batch = [write for write in self.pending if write[0] == room_code]
+                self.pending = [write for write in self.pending if write[0] != room_code]
+        return batch
+
+    def persist_pending(self, room_code=None):
+        """Apply the queued writes (all of them, or one room's) in one transaction; runs on a DB thread"""
+        with self._write_lock:
+            batch = self._take_pending(room_code)
+            if not batch:
+                return 0
+            try:
+                apply_writes([(op, args) for _, op, args in batch])
+            except Exception:
+                with self._lock:
+                    self.pending[:0] = batch
+                raise
+            return len(batch)
+
+    async def flush(self):
+        """Persist every queued write as one batch"""
+        if not self.pending:
+            return
+        try:
+            written = await database_write(self.persist_pending)
+        except Exception as e:
+            self.failed_flushes += 1
+            if self.failed_flushes < MAX_FLUSH_ATTEMPTS:
+                engine_logger.error("ENGINE FLUSH - Failed to persist queued writes (attempt %s of %s): %s",
+                                    self.failed_flushes, MAX_FLUSH_ATTEMPTS, e)
+                raise
+            # Give up on the batch; its rooms no longer match the database, so reload them
+            self.failed_flushes = 0
+            dropped = self._take_pending()
+            rooms = {room_code for room_code, _, _ in dropped}
+            for room_code in rooms:
+                self.rooms.pop(room_code, None)
+            engine_logger.error("ENGINE FLUSH - Dropped %s writes for rooms %s after %s failed attempts: %s",
+                                len(dropped), sorted(rooms), MAX_FLUSH_ATTEMPTS, e)
+            raise
+        self.failed_flushes = 0
+        engine_logger.debug("ENGINE FLUSH - Persisted %s writes", written)
+
+    def evict_idle(self):
+        """Evict rooms with no connections or queued writes that have been idle past the timeout"""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            waiting = {room_code for room_code, _, _ in self.pending}
+        for code, room in list(self.rooms.items()):
+            if code not in self.connections and code not in waiting and room.last_active < cutoff:
+                del self.rooms[code]
+                engine_logger.info("ENGINE EVICT - Room %s evicted after idling", code)
+
+    def _ensure_flusher(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                pass
+            # Rooms whose writes are still queued stay loaded
+            self.evict_idle()
+
+
+class LiveRoomStore:
+    """Engine-backed counterpart of RoomConsumer's database operations.
+
+    Method names and return values match the consumer's own
+    ``@database_sync_to_async`` helpers so handlers can use either.
+    """
+
+    def __init__(self, engine, room_code, consumer):
+        self.engine = engine
+        self.room_code = room_code
+        self.consumer = consumer
+
+    async def _participant(self, room, participant_id):
+        participant_id = str(participant_id)
+        if participant_id not in room.participants:
+            # Joined through the REST API after the room was loaded
+            data = await database_sync_to_async(self._load_participant)(room, participant_id)
+            with room.lock:
+                room.participants[participant_id] = data
+        return room.participants[participant_id]
+
+    @staticmethod
+    def _load_participant(room, participant_id):
+        import json
+        from .serializers import ParticipantSerializer
+
+        participant = Participant.objects.get(id=participant_id, room_id=room.pk)
+        return json.loads(json.dumps(ParticipantSerializer(participant).data, default=str))
+
+    async def save_vote(self, participant_id, story_id, value):
+        room = await self.engine.get(self.room_code)
+        try:
+            participant = await self._participant(room, participant_id)
+        except (Participant.DoesNotExist, ValidationError):
+            participant = None
+        if participant is None or story_id not in room.stories:
+            raise CommandError("Participant or story is not in this room")
+
+        with room.lock:
+            existing = room.votes[story_id].get(participant['id'])
+            vote = {
+                'id': existing['id'] if existing else str(uuid.uuid4()),
+                'participant': participant['id'],
+                'participant_name': participant['username'],
+                'value': value,
+                # Like upsert_vote, changing a vote keeps it revealed
+                'revealed': existing['revealed'] if existing else False,
+                'created_at': existing['created_at'] if existing else _timestamp(timezone.now()),
+            }
+            room.votes[story_id][participant['id']] = vote
+            version = room.bump()
+        self.engine.enqueue(self.room_code, 'vote', id=vote['id'], room=room.pk, participant=participant['id'], story=story_id, value=value)
+        self.engine.enqueue(self.room_code, 'update_room', id=room.pk, version=version)
+        return version
+
+    async def reveal_votes(self):
+        room = await self.engine.get(self.room_code)
+        result = {'story': room.current_story, 'votes': [], 'calculation': None}
+
+        with room.lock:
+            if room.current_story:
+                for vote in room.votes[room.current_story].values():
+                    vote['revealed'] = True
+                result['votes'] = [dict(v) for v in room.votes[room.current_story].values()]
+            result['version'] = room.bump()
+        if room.current_story:
+            self.engine.enqueue(self.room_code, 'reveal', story=room.current_story)
+        self.engine.enqueue(self.room_code, 'update_room', id=room.pk, version=result['version'])
+
+        result['calculation'] = summarize_votes((v['value'], v['participant_name']) for v in result['votes'])
+        return result
+
+    async def reset_votes(self):
+        room = await self.engine.get(self.room_code)
+        story_id = room.current_story
+
+        with room.lock:
+            if story_id:
+                room.votes[story_id] = {}
+                room.stories[story_id].update(final_points=None, estimated_at=None)
+            version = room.bump()
+        if story_id:
+            self.engine.enqueue(self.room_code, 'clear_votes', room=room.pk, story=story_id, reason='reset')
+            self.engine.enqueue(self.room_code, 'update_story', id=story_id, final_points=None, estimated_at=None)
+        self.engine.enqueue(self.room_code, 'update_room', id=room.pk, version=version)
+        return story_id, version
+
+    async def confirm_story_points(self, points):
+        room = await self.engine.get(self.room_code)
+        result = {'story': room.current_story, 'final_points': None, 'estimated_at': None}
+
+        with room.lock:
+            if room.current_story:
+                result['final_points'] = str(points)
+                result['estimated_at'] = timezone.now()
+                room.stories[room.current_story].update(
+                    final_points=result['final_points'],
+                    estimated_at=_timestamp(result['estimated_at']),
+                )
+            result['version'] = room.bump()
+        if room.current_story:
+            self.engine.enqueue(
+                self.room_code, 'update_story', id=room.current_story,
+                final_points=result['final_points'], estimated_at=result['estimated_at'],
+            )
+        self.engine.enqueue(self.room_code, 'update_room', id=room.pk, version=result['version'])
+        return result
+
+    async def add_story(self, story_id, title):
+        room = await self.engine.get(self.room_code)
+
+        # Generate funny story if both ID and title are empty
+        if not story_id and not title:
+            story_id, title = generate_funny_story()
+        elif not story_id:
+            story_id, _ = generate_funny_story()
+        elif not title:
+            _, title = generate_funny_story()
+
+        with room.lock:
+            existing = next((sid for sid, s in room.stories.items() if s['story_id'] == story_id), None)
+            if existing:
+                return {'story': room.story_data(existing), 'exists': True}
+
+            now = _timestamp(timezone.now())
+            story = {
+                'id': str(uuid.uuid4()),
+                'story_id': story_id,
+                'title': title,
+                'final_points': None,
+                'estimated_at': None,
+                'order': len(room.stories),
+                'created_at': now,
+            }
+            cleared_story = room.current_story
+            room.stories[story['id']] = story
+            room.votes[story['id']] = {}
+            if cleared_story:
+                # Clear votes for previous story
+                room.votes[cleared_story] = {}
+            room.current_story = story['id']
+            version = room.bump()
+            story_data = room.story_data(story['id'])
+
+        self.engine.enqueue(self.room_code, 'create_story', id=story['id'], room=room.pk, story_id=story_id, title=title, order=story['order'])
+        if cleared_story:
+            self.engine.enqueue(self.room_code, 'clear_votes', room=room.pk, story=cleared_story, reason='new_story')
+        self.engine.enqueue(self.room_code, 'update_room', id=room.pk, version=version, current_story_id=story['id'])
+        return {'story': story_data, 'exists': False, 'cleared_story': cleared_story, 'version': version}
+
+    async def change_current_story(self, story_id):
+        room = await self.engine.get(self.room_code)
+        if story_id not in room.stories:
+            raise CommandError("Story is not in this room")
+
+        with room.lock:
+            room.current_story = story_id
+            version = room.bump()
+        self.engine.enqueue(self.room_code, 'update_room', id=room.pk, version=version, current_story_id=story_id)
+        return version
+
+    async def _set_connected(self, participant_id, connected):
+        room = await self.engine.get(self.room_code)
+        try:
+            participant = await self._participant(room, participant_id)
+        except (Participant.DoesNotExist, ValidationError):
+            raise CommandError("Participant is not in this room")
+
+        # Presence persists the Participant row itself, in batches
+        update = presence.connect if connected else presence.disconnect
+        if not await sync_to_async(update, thread_sensitive=False)(self.room_code, participant['id']):
+            return None
+
+        with room.lock:
+            participant['connected'] = connected
+            participant['last_seen'] = _timestamp(timezone.now())
+            version = room.bump()
+        self.engine.enqueue(self.room_code, 'update_room', id=room.pk, version=version)
+        return {'participant': dict(participant), 'version': version}
+
+    async def mark_user_connected(self, participant_id):
+        return await self._set_connected(participant_id, True)
+
+    async def mark_user_disconnected(self, participant_id):
+        return await self._set_connected(participant_id, False)
+
+    async def refresh_presence(self, participant_id):
+        return await self.consumer.refresh_presence(participant_id)
+
+    async def get_participant_by_username(self, username):
+        room = await self.engine.get(self.room_code)
+        participant = next((p for p in room.participants.values() if p['username'] == username), None)
+        if participant is None:
+            participant = await self.consumer.get_participant_by_username(username)
+        return participant
+
+    async def get_room_data(self):
+        room = await self.engine.get(self.room_code)
+        return room.snapshot()
+
+
+# Process-wide engine instance
+room_engine = RoomEngine()
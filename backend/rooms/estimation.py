@@ -0,0 +1,197 @@
+"""
+Planning Poker estimation over pluggable card decks
+
+A ``Deck`` lists the cards participants can play and the scale an estimate
+is rounded up to. Everything the estimate needs is precomputed when the deck
+is defined: each card's numeric value and scale step, plus a sorted scale
+for ``bisect``. Estimating a round is then a few dict lookups, one sort and
+one bisect.
+
+Rules (shared by the REST and WebSocket reveal paths):
+
+- ``?`` and coffee cards are ignored
+- votes more than two scale steps apart are a wide spread: the estimate is
+  the upper quartile rounded up to the scale, and the lowest and highest
+  voters are asked to discuss
+- otherwise the estimate is the median rounded up to the scale
+- anything beyond the top of the scale is capped at the top
+
+The active deck is ``ESTIMATION_DECK`` (default ``'fibonacci'``).
+"""
+from bisect import bisect_left
+
+from django.conf import settings
+
+WILDCARDS = ('?', 'coffee')
+
+# Scale steps between the lowest and highest vote beyond which we flag a wide spread
+WIDE_SPREAD_STEPS = 2
+HIGH_SPREAD_STEPS = 4
+
+
+class Deck:
+    def __init__(self, key, name, cards, scale, labels=None, numeric=True):
+        """
+        ``cards`` maps each playable card to its numeric value (None for
+        wildcards), ``scale`` is what estimates are rounded up to, and
+        ``numeric`` decks report estimates as numbers rather than cards.
+        """
+        self.key = key
+        self.name = name
+        self.numeric = numeric
+        self.cards = tuple(cards)
+        self.labels = labels or {}
+        self.values = {card: value for card, value in cards.items() if value is not None}
+        self.scale = tuple(sorted(scale))
+        # Step of every playable card, so spreads never need a search
+        self.steps = {card: self.step(value) for card, value in self.values.items()}
+        self.cards_by_value = {value: card for card, value in self.values.items()}
+
+    @property
+    def choices(self):
+        """(card, label) pairs for model and form choices"""
+        return [(card, self.labels.get(card, card)) for card in self.cards]
+
+    def step(self, value):
+        """Index of the first scale entry >= value, capped at the top of the scale"""
+        return min(bisect_left(self.scale, value), len(self.scale) - 1)
+
+    def round_up(self, value):
+        return self.scale[self.step(value)]
+
+    def display(self, value):
+        """How a numeric value is reported: the number itself, or its card"""
+        if self.numeric:
+            return int(value) if float(value).is_integer() else value
+        return self.cards_by_value.get(value, value)
+
+    def estimate(self, cards):
+        """Recommended estimate for the played cards, or None without numeric votes"""
+        values = sorted(self.values[card] for card in cards if card in self.values)
+        if not values:
+            return None
+
+        if self.spread(values) > WIDE_SPREAD_STEPS:
+            target = upper_quartile(values)
+        else:
+            target = median(values)
+        return self.display(self.round_up(target))
+
+    def spread(self, values):
+        """Scale steps between the lowest and highest of sorted values"""
+        return self.step(values[-1]) - self.step(values[0])
+
+    def discussion(self, votes):
+        """Ask the lowest and highest voters to talk it through when the spread is wide"""
+        numeric = [(self.values[card], username) for card, username in votes if card in self.values]
+        if len(numeric) < 2:
+            return None
+
+        min_vote = min(value for value, _ in numeric)
+        max_vote = max(value for value, _ in numeric)
+        spread = self.step(max_vote) - self.step(min_vote)
+        if spread <= WIDE_SPREAD_STEPS:
+            return None
+
+        min_voter = next((username for value, username in numeric if value == min_vote), "someone")
+        max_voter = next((username for value, username in numeric if value == max_vote), "someone")
+        min_vote = self.display(min_vote)
+        max_vote = self.display(max_vote)
+        return {
+            "message": f"Wide spread detected! {min_voter} (voted {min_vote}) and {max_voter} (voted {max_vote}) should discuss the story complexity.",
+            "min_vote": min_vote,
+            "max_vote": max_vote,
+            "min_voter": min_voter,
+            "max_voter": max_voter,
+            "spread_level": "high" if spread > HIGH_SPREAD_STEPS else "medium"
+        }
+
+    def summarize(self, votes):
+        """Average, estimate and discussion prompt for (card, username) pairs.
+
+        Returns None when no vote has a numeric value.
+        """
+        votes = list(votes)
+        values = [self.values[card] for card, _ in votes if card in self.values]
+        if not values:
+            return None
+        return {
+            'average': sum(values) / len(values),
+            'rounded': self.estimate(card for card, _ in votes),
+            'discussion_message': self.discussion(votes),
+        }
+
+
+def median(values):
+    """Median of sorted values, same as statistics.median"""
+    n = len(values)
+    middle = n // 2
+    if n % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def upper_quartile(values):
+    """75th percentile of sorted values, same as statistics.quantiles(n=4)[2]"""
+    n = len(values)
+    if n < 2:
+        return values[0]
+    # statistics' default 'exclusive' method, with its exact integer math
+    m = n + 1
+    j = min(max(3 * m // 4, 1), n - 1)
+    delta = 3 * m - j * 4
+    return (values[j - 1] * (4 - delta) + values[j] * delta) / 4
+
+
+def _cards(*cards):
+    return {card: (None if card in WILDCARDS else value) for card, value in cards}
+
+
+FIBONACCI = Deck(
+    'fibonacci', 'Fibonacci',
+    _cards(('0', 0), ('1', 1), ('2', 2), ('3', 3), ('5', 5), ('8', 8), ('13', 13), ('21', 21),
+           ('?', None), ('coffee', None)),
+    scale=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+    labels={'coffee': '☕'},
+)
+
+MODIFIED_FIBONACCI = Deck(
+    'modified_fibonacci', 'Modified Fibonacci',
+    _cards(('0', 0), ('½', 0.5), ('1', 1), ('2', 2), ('3', 3), ('5', 5), ('8', 8), ('13', 13),
+           ('20', 20), ('40', 40), ('100', 100), ('?', None), ('coffee', None)),
+    scale=(0.5, 1, 2, 3, 5, 8, 13, 20, 40, 100),
+    labels={'coffee': '☕'},
+)
+
+T_SHIRT = Deck(
+    't_shirt', 'T-shirt sizes',
+    _cards(('XS', 1), ('S', 2), ('M', 3), ('L', 5), ('XL', 8), ('XXL', 13), ('?', None), ('coffee', None)),
+    scale=(1, 2, 3, 5, 8, 13),
+    labels={'coffee': '☕'},
+    numeric=False,
+)
+
+POWERS_OF_TWO = Deck(
+    'powers_of_two', 'Powers of two',
+    _cards(('0', 0), ('1', 1), ('2', 2), ('4', 4), ('8', 8), ('16', 16), ('32', 32), ('64', 64),
+           ('?', None), ('coffee', None)),
+    scale=(1, 2, 4, 8, 16, 32, 64),
+    labels={'coffee': '☕'},
+)
+
+DECKS = {deck.key: deck for deck in [FIBONACCI, MODIFIED_FIBONACCI, T_SHIRT, POWERS_OF_TWO]}
+
+
+def get_deck(key=None):
+    """The deck for ``key``, or the configured ``ESTIMATION_DECK``"""
+    return DECKS[key or getattr(settings, 'ESTIMATION_DECK', 'fibonacci')]
+
+
+def vote_choices():
+    """(card, label) choices of the configured deck, for ``Vote.value``"""
+    return get_deck().choices
+
+
+def summarize_votes(votes, deck=None):
+    """Reveal summary for (card, username) pairs using the active deck"""
+    return (deck or get_deck()).summarize(votes)
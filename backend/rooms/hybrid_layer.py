@@ -0,0 +1,155 @@
+"""
+Channel layer with an in-process fast path for room members on this worker
+
+With a plain Redis layer every ``group_send`` writes one message per member
+channel to Redis and each worker reads them back, even when the sender and
+every member are in the same process. ``HybridChannelLayer`` keeps the
+group membership of its own channels in memory:
+
+- members on this worker get the message through an in-memory queue, with
+  no Redis round trip; ``receive`` waits on that queue and on the Redis
+  receive at once, and a Redis receive that is still pending carries over
+  to the next call rather than being cancelled
+- instead of each local channel, the Redis group holds one relay channel
+  per worker (``specific.<process>!relay``) that has members in it
+- a ``group_send`` reads the group from Redis and sends one message per
+  other worker's relay; that worker's relay task fans it out to its own
+  members. When the room has no members elsewhere nothing is written.
+
+What this saves is the per-member writes and reads, not every Redis round
+trip. Membership isn't cached, since other workers change it without
+telling this one, so each ``group_send`` still costs one ZRANGEBYSCORE on
+the group's node, even for a room whose members are all local. Remote
+relays and channels are then sent one at a time, a ``send`` and a round
+trip each, where ``RedisChannelLayer.group_send`` sends everything on a
+node in one Lua call.
+
+It is opt-in (``CHANNEL_LAYER_BACKEND``), and every worker has to run it: a
+plain Redis layer's ``group_send`` would hand relay channels messages
+without the group they were sent to.
+"""
+import asyncio
+import collections
+import functools
+import logging
+import time
+
+from channels.exceptions import ChannelFull
+from channels_redis.core import BoundedQueue
+
+from .sharded_layer import ShardedRedisChannelLayer
+
+redis_logger = logging.getLogger('rooms.redis')
+
+RELAY_NAME = 'relay'
+GROUP_KEY = '__relay_group__'
+
+
+class HybridChannelLayer(ShardedRedisChannelLayer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # group -> {local channel: time added}
+        self.local_groups = {}
+        # Local messages and still-pending Redis receives per local channel
+        self.local_queues = collections.defaultdict(functools.partial(BoundedQueue, self.capacity))
+        self.remote_receives = {}
+        self.relay_channel = f'specific.{self.client_prefix}!{RELAY_NAME}'
+        self._relay_task = None
+
+    def is_local(self, channel):
+        return '!' in channel and self.non_local_name(channel) == f'specific.{self.client_prefix}!'
+
+    async def receive(self, channel):
+        if not self.is_local(channel):
+            return await super().receive(channel)
+
+        queue = self.local_queues[channel]
+        if not queue.empty():
+            return queue.get_nowait()
+        remote = self.remote_receives.get(channel)
+        if remote is None:
+            remote = self.remote_receives[channel] = asyncio.ensure_future(super().receive(channel))
+        local = asyncio.ensure_future(queue.get())
+        try:
+            done, _ = await asyncio.wait([remote, local], return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            # The consumer is going away
+            local.cancel()
+            remote.cancel()
+            self.remote_receives.pop(channel, None)
+            self.local_queues.pop(channel, None)
+            raise
+        if local in done:
+            return local.result()
+        local.cancel()
+        del self.remote_receives[channel]
+        return remote.result()
+
+    async def group_add(self, group, channel):
+        if not self.is_local(channel):
+            return await super().group_add(group, channel)
+        members = self.local_groups.setdefault(group, {})
+        members[channel] = time.time()
+        self._ensure_relay()
+        # Re-added on every join so the relay's group entry doesn't expire
+        await super().group_add(group, self.relay_channel)
+
+    async def group_discard(self, group, channel):
+        if not self.is_local(channel):
+            return await super().group_discard(group, channel)
+        members = self.local_groups.get(group)
+        if members is None:
+            return
+        members.pop(channel, None)
+        if not members:
+            del self.local_groups[group]
+            await super().group_discard(group, self.relay_channel)
+
+    async def group_send(self, group, message):
+        assert self.valid_group_name(group), "Group name not valid"
+        delivered = self.deliver_local(group, message)
+
+        connection = self.connection(self.consistent_hash(group))
+        remote = [
+            channel.decode('utf8') for channel in await connection.zrangebyscore(
+                self._group_key(group), min=int(time.time()) - self.group_expiry, max='+inf')
+        ]
+        remote = [channel for channel in remote if channel != self.relay_channel]
+        for channel in remote:
+            relayed = dict(message, **{GROUP_KEY: group}) if channel.endswith(f'!{RELAY_NAME}') else message
+            try:
+                await self.send(channel, relayed)
+            except ChannelFull:
+                redis_logger.warning("REDIS HYBRID - Channel %s over capacity in group %s", channel, group)
+        redis_logger.debug("REDIS HYBRID - Group %s: %s local, %s remote sends", group, delivered, len(remote))
+
+    def deliver_local(self, group, message):
+        """Queue the message for this worker's members of the group"""
+        members = self.local_groups.get(group)
+        if not members:
+            return 0
+        # Same expiry as Redis groups, for channels that never discarded themselves
+        cutoff = time.time() - self.group_expiry
+        for channel in [c for c, added in members.items() if added < cutoff]:
+            del members[channel]
+        for channel in members:
+            self.local_queues[channel].put_nowait(dict(message))
+        return len(members)
+
+    def _ensure_relay(self):
+        loop = asyncio.get_running_loop()
+        if self._relay_task is None or self._relay_task.done() or self._relay_task.get_loop() is not loop:
+            self._relay_task = loop.create_task(self._relay())
+
+    async def _relay(self):
+        """Fan group messages relayed from other workers out to local members"""
+        while self.local_groups:
+            try:
+                message = await self.receive(self.relay_channel)
+            except Exception as e:
+                redis_logger.error("REDIS HYBRID - Relay receive failed: %s", e)
+                await asyncio.sleep(1)
+                continue
+            group = message.pop(GROUP_KEY, None)
+            if group is not None:
+                self.deliver_local(group, message)
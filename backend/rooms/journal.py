@@ -0,0 +1,167 @@
+"""
+Append-only journal of room domain events
+
+Votes cast, reveals, resets, stories added, current story changes and points
+confirmed are recorded as one event each, independently of the per-row model signal logging in
+rooms.signals (which ``DB_SIGNAL_LOGGING = False`` turns off). Events are
+MessagePack maps prefixed with their length as a 4-byte big-endian integer:
+
+    [len][{'ts': 1760000000.0, 'event': 'vote_cast', 'room': 'ABC123', ...}]...
+
+``journal.record()`` only queues the event. A writer thread appends whatever
+is queued in one write, flushes it, and fsyncs at most every
+``EVENT_JOURNAL_FSYNC_INTERVAL`` seconds, so a crash loses at most that much
+and can leave a torn last record, which ``read_journal`` stops at.
+``manage.py replay_journal`` prints the events or the room state they add
+up to.
+"""
+import atexit
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+
+import msgpack
+from django.conf import settings
+
+db_logger = logging.getLogger('rooms.database')
+
+LENGTH = struct.Struct('>I')
+
+# Events queued at most per write
+BATCH_SIZE = 512
+
+
+def encode_event(event):
+    payload = msgpack.packb(event, default=str, use_bin_type=True)
+    return LENGTH.pack(len(payload)) + payload
+
+
+def read_journal(path):
+    """Yield the events in a journal file in order, stopping at a torn last record"""
+    with open(path, 'rb') as journal_file:
+        while True:
+            header = journal_file.read(LENGTH.size)
+            if len(header) < LENGTH.size:
+                return
+            (length,) = LENGTH.unpack(header)
+            payload = journal_file.read(length)
+            if len(payload) < length:
+                return
+            yield msgpack.unpackb(payload, raw=False)
+
+
+def replay_events(events):
+    """Fold journal events into each room's stories, votes and points"""
+    rooms = {}
+    for event in events:
+        room = rooms.setdefault(event['room'], {'version': None, 'current_story': None, 'stories': {}})
+        room['version'] = event.get('version', room['version'])
+        kind = event['event']
+        if kind == 'story_added':
+            room['stories'][event['story']] = {
+                'story_id': event['story_id'], 'title': event['title'],
+                'votes': {}, 'revealed': False, 'points': None,
+            }
+            if event['cleared_story'] in room['stories']:
+                room['stories'][event['cleared_story']]['votes'] = {}
+            if event['current']:
+                room['current_story'] = event['story']
+            continue
+        if kind == 'story_changed':
+            room['current_story'] = event['story']
+            continue
+
+        story = room['stories'].setdefault(event.get('story'), {
+            'story_id': None, 'title': None, 'votes': {}, 'revealed': False, 'points': None,
+        })
+        if kind == 'vote_cast':
+            story['votes'][event['participant']] = event['value']
+            story['revealed'] = False
+        elif kind == 'votes_revealed':
+            story['votes'] = dict(event['votes'])
+            story['revealed'] = True
+            if event.get('points'):
+                story['points'] = event['points']
+        elif kind == 'votes_reset':
+            story.update(votes={}, revealed=False, points=None)
+        elif kind == 'points_confirmed':
+            story['points'] = event['points']
+    return rooms
+
+
+class EventJournal:
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return getattr(settings, 'EVENT_JOURNAL_PATH', None)
+
+    @property
+    def fsync_interval(self):
+        return getattr(settings, 'EVENT_JOURNAL_FSYNC_INTERVAL', 1.0)
+
+    def record(self, event, room_code, **fields):
+        """Queue a domain event for the journal; a no-op without EVENT_JOURNAL_PATH"""
+        if not self.path:
+            return
+        fields.update(ts=time.time(), event=event, room=room_code)
+        self.queue.put(fields)
+        self._ensure_writer()
+
+    def _ensure_writer(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                if self._thread is None:
+                    atexit.register(self.stop)
+                self._thread = threading.Thread(target=self._run, args=(self.path,), name='event-journal', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Write out everything queued and stop the writer thread"""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self.queue.put(None)
+            thread.join()
+
+    def _run(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        last_sync = time.monotonic()
+        unsynced = False
+        with open(path, 'ab') as journal_file:
+            while True:
+                try:
+                    batch = [self.queue.get(timeout=self.fsync_interval)]
+                except queue.Empty:
+                    batch = []
+                while batch and batch[-1] is not None and len(batch) < BATCH_SIZE:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stopping = bool(batch) and batch[-1] is None
+                events = [event for event in batch if event is not None]
+                try:
+                    if events:
+                        journal_file.write(b''.join(encode_event(event) for event in events))
+                        journal_file.flush()
+                        unsynced = True
+                    if unsynced and (stopping or time.monotonic() - last_sync >= self.fsync_interval):
+                        os.fsync(journal_file.fileno())
+                        last_sync = time.monotonic()
+                        unsynced = False
+                except (OSError, TypeError, ValueError) as e:
+                    db_logger.error("DB JOURNAL - Failed to write %s events to %s: %s", len(events), path, e)
+                if stopping:
+                    return
+
+
+# Process-wide event journal
+journal = EventJournal()
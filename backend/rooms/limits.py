@@ -0,0 +1,122 @@
+"""
+Abuse limits for incoming WebSocket frames
+
+Checked in ``RoomConsumer.receive`` before a frame costs any real work:
+
+- frames longer than ``WS_MAX_FRAME_BYTES`` bytes (UTF-8 encoded, for text
+  frames) are dropped unread
+- JSON frames nested deeper than ``WS_MAX_JSON_DEPTH`` are dropped before
+  ``json.loads`` runs; a regex pass blanks out strings and counts brackets
+- each command type has token buckets per connection and per room (declared
+  with the command in ``rooms.commands``); a command arriving with its
+  bucket empty is rejected with an error instead of touching the database
+
+Room buckets are per process, so with several workers a room's budget is
+per worker its connections land on.
+"""
+import re
+import time
+from collections import namedtuple
+
+# Sustained commands per second and how many may arrive at once
+Rate = namedtuple('Rate', 'per_second burst')
+
+
+class MessageTooDeep(ValueError):
+    """Raised when a decoded message nests deeper than allowed"""
+
+
+# JSON strings, whose brackets don't count towards nesting
+_STRING_RE = re.compile(r'"(?:[^"\\]|\\.)*"')
+_BRACKET_RE = re.compile(r'[\[\]{}]')
+
+
+def frame_too_large(frame, max_bytes):
+    """Whether a text or binary frame is longer than max_bytes, as UTF-8 on the wire"""
+    if isinstance(frame, str) and len(frame) * 4 > max_bytes:
+        # A character is at most 4 bytes, so only frames that may be too long get encoded
+        return len(frame.encode('utf-8')) > max_bytes
+    return len(frame) > max_bytes
+
+
+def json_too_deep(text, max_depth):
+    """Whether a JSON document nests arrays/objects deeper than max_depth, without parsing it"""
+    depth = 0
+    for match in _BRACKET_RE.finditer(_STRING_RE.sub('""', text)):
+        if match.group() in '[{':
+            depth += 1
+            if depth > max_depth:
+                return True
+        else:
+            depth -= 1
+    return False
+
+
+def value_too_deep(value, max_depth):
+    """Whether decoded lists/dicts nest deeper than max_depth, checked without recursion"""
+    stack = [(value, 1)]
+    while stack:
+        value, depth = stack.pop()
+        if isinstance(value, dict):
+            children = value.values()
+        elif isinstance(value, list):
+            children = value
+        else:
+            continue
+        if depth > max_depth:
+            return True
+        stack.extend((child, depth + 1) for child in children)
+    return False
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'tokens', 'updated')
+
+    def __init__(self, rate, now):
+        self.rate = rate
+        self.tokens = rate.burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.rate.burst, self.tokens + (now - self.updated) * self.rate.per_second)
+        self.updated = now
+
+    def take(self, now):
+        self.refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RateLimiter:
+    """Token buckets keyed by whatever the caller limits on, e.g. (room code, type)"""
+
+    # Seconds between sweeps for buckets that have refilled completely
+    PRUNE_INTERVAL = 60
+
+    def __init__(self):
+        self.buckets = {}
+        self._pruned = time.monotonic()
+
+    def allow(self, key, rate):
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(rate, now)
+        allowed = bucket.take(now)
+        if now - self._pruned > self.PRUNE_INTERVAL:
+            self.prune(now)
+        return allowed
+
+    def prune(self, now):
+        """Forget full buckets; a new one starts full, so nothing changes"""
+        for key, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.rate.burst:
+                del self.buckets[key]
+        self._pruned = now
+
+
+# Process-wide per-room buckets; each connection keeps its own RateLimiter
+room_limiter = RateLimiter()
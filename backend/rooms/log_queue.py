@@ -0,0 +1,88 @@
+"""
+Queue-based logging for the rooms.* loggers
+
+Logging a record used to mean formatting it and writing it to a log file
+and the console right there, inside the event loop. With
+``install_queue_logging()`` (called from ``RoomsConfig.ready``) each
+``rooms.*`` logger's handlers are swapped for one ``DeferredQueueHandler``
+that only puts the record on a queue. A ``LogWriter`` thread takes records
+off the queue and hands them to the logger's original handlers, which is
+where the message is formatted and written.
+
+Log calls pass their arguments lazily, ``logger.info("... %s", value)``, so
+nothing is formatted for disabled levels, and payload dumps go through
+``LazyJson`` so the JSON is built in the writer thread, if at all.
+"""
+import atexit
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+ROOMS_LOGGERS = ('rooms', 'rooms.api', 'rooms.websocket', 'rooms.database', 'rooms.redis')
+
+
+class LazyJson:
+    """Log argument that renders its value as JSON only when the record is formatted"""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return json.dumps(self.value, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Queue records unformatted, tagged with the handlers that should write them"""
+
+    def __init__(self, log_queue, targets):
+        super().__init__(log_queue)
+        self.targets = targets
+
+    def prepare(self, record):
+        # QueueHandler.prepare formats the message here; leave that to the writer
+        return record
+
+    def enqueue(self, record):
+        self.queue.put_nowait((self.targets, record))
+
+
+class LogWriter(QueueListener):
+    """Background thread that writes queued records through their logger's handlers"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue, respect_handler_level=True)
+
+    def handle(self, item):
+        targets, record = item
+        for handler in targets:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+_writer = None
+
+
+def install_queue_logging(logger_names=ROOMS_LOGGERS):
+    """Route the given loggers through one queue and a background writer thread"""
+    global _writer
+    if _writer is not None:
+        return _writer
+
+    log_queue = queue.SimpleQueue()
+    for name in logger_names:
+        logger = logging.getLogger(name)
+        targets = [handler for handler in logger.handlers if not isinstance(handler, DeferredQueueHandler)]
+        if not targets:
+            continue
+        for handler in targets:
+            logger.removeHandler(handler)
+        logger.addHandler(DeferredQueueHandler(log_queue, targets))
+
+    _writer = LogWriter(log_queue)
+    _writer.start()
+    # Drain whatever is still queued when the process exits
+    atexit.register(_writer.stop)
+    return _writer
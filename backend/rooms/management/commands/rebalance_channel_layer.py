@@ -0,0 +1,77 @@
+"""
+Django management command to move channel layer groups after a shard change
+Usage: python manage.py rebalance_channel_layer --from redis://127.0.0.1:6379/0 [--dry-run]
+
+Run it once the workers use the new CHANNEL_LAYERS hosts. Every group stored
+on one of the previous nodes (--from) whose owner on the new ring is another
+node is merged into that node and deleted from the old one. Channel queues
+are not moved; they only hold messages for up to the layer's expiry.
+"""
+import redis
+from channels_redis.utils import decode_hosts
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rooms.sharded_layer import HashRing, host_address
+
+
+class Command(BaseCommand):
+    help = 'Move channel layer group memberships to the nodes that own them on the current hash ring'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='old_hosts', nargs='+', required=True,
+                            help='Redis URLs of the nodes the layer used before the change')
+        parser.add_argument('--layer', default='default', help='CHANNEL_LAYERS alias (default: default)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report which groups would move')
+
+    def handle(self, *args, **options):
+        try:
+            config = settings.CHANNEL_LAYERS[options['layer']].get('CONFIG', {})
+        except KeyError:
+            raise CommandError(f"No channel layer named '{options['layer']}'")
+
+        prefix = config.get('prefix', 'asgi')
+        group_expiry = config.get('group_expiry', 86400)
+        ring = HashRing([host_address(host) for host in decode_hosts(config.get('hosts'))])
+        old_nodes = [host_address(host) for host in decode_hosts(options['old_hosts'])]
+
+        try:
+            moved, kept = self.rebalance(ring, old_nodes, prefix, group_expiry, options['dry_run'])
+        except redis.RedisError as e:
+            raise CommandError(f'Redis error while rebalancing: {str(e)}')
+
+        verb = 'would move' if options['dry_run'] else 'moved'
+        self.stdout.write(self.style.SUCCESS(f'✅ {moved} group(s) {verb}, {kept} already on the right node'))
+
+    def rebalance(self, ring, old_nodes, prefix, group_expiry, dry_run):
+        clients = {}
+
+        def client(address):
+            if address not in clients:
+                clients[address] = redis.Redis.from_url(address)
+            return clients[address]
+
+        group_prefix = f'{prefix}:group:'.encode('utf8')
+        moved = kept = 0
+        for node in old_nodes:
+            self.stdout.write(f'Scanning {node}...')
+            for key in client(node).scan_iter(match=group_prefix + b'*', count=500):
+                group = key[len(group_prefix):].decode('utf8')
+                target = ring.node_for(group)
+                if target == node:
+                    kept += 1
+                    continue
+
+                moved += 1
+                self.stdout.write(f'  {group}: {node} -> {target}')
+                if dry_run:
+                    continue
+                members = client(node).zrange(key, 0, -1, withscores=True)
+                if members:
+                    pipe = client(target).pipeline()
+                    # Merge, so memberships added on the new node since the switch survive
+                    pipe.zadd(key, dict(members))
+                    pipe.expire(key, group_expiry)
+                    pipe.execute()
+                client(node).delete(key)
+        return moved, kept
@@ -0,0 +1,67 @@
+"""
+Django management command to read the room event journal
+Usage: python manage.py replay_journal [path] [--room CODE] [--event vote_cast ...] [--since ISO] [--json | --state]
+
+Prints the journaled domain events in order, one line each (or as JSON
+lines), or with --state replays them into each room's stories, votes and
+points. The path defaults to EVENT_JOURNAL_PATH.
+"""
+import json
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rooms.journal import read_journal, replay_events
+
+ENVELOPE = ('ts', 'event', 'room')
+
+
+class Command(BaseCommand):
+    help = 'Print or replay the room event journal'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='Journal file (default: EVENT_JOURNAL_PATH)')
+        parser.add_argument('--room', help='Only events for this room code')
+        parser.add_argument('--event', nargs='+', help='Only these event types')
+        parser.add_argument('--since', help='Only events at or after this ISO 8601 time')
+        output = parser.add_mutually_exclusive_group()
+        output.add_argument('--json', action='store_true', help='One JSON object per event')
+        output.add_argument('--state', action='store_true', help='Print the room state the events add up to')
+
+    def handle(self, *args, **options):
+        path = options['path'] or getattr(settings, 'EVENT_JOURNAL_PATH', None)
+        if not path:
+            raise CommandError('No journal path given and EVENT_JOURNAL_PATH is not set')
+
+        since = None
+        if options['since']:
+            try:
+                since = datetime.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f"Invalid --since time: {options['since']}")
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            since = since.timestamp()
+
+        try:
+            events = [
+                event for event in read_journal(path)
+                if (not options['room'] or event['room'] == options['room'])
+                and (not options['event'] or event['event'] in options['event'])
+                and (since is None or event['ts'] >= since)
+            ]
+        except OSError as e:
+            raise CommandError(f'Could not read journal {path}: {str(e)}')
+
+        if options['state']:
+            self.stdout.write(json.dumps(replay_events(events), indent=2, default=str))
+            return
+
+        for event in events:
+            if options['json']:
+                self.stdout.write(json.dumps(event, default=str))
+                continue
+            when = datetime.fromtimestamp(event['ts'], tz=timezone.utc).isoformat(timespec='milliseconds')
+            fields = ' '.join(f'{key}={value}' for key, value in event.items() if key not in ENVELOPE)
+            self.stdout.write(f"{when} {event['room']} {event['event']} {fields}")
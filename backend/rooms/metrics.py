@@ -0,0 +1,289 @@
+"""
+In-process metrics: counters and latency histograms
+
+Metrics live in a process-wide registry and are labelled like Prometheus
+series, e.g. ``command_latency.observe(0.004, type='vote')``. Each worker's
+registry is published as a snapshot (see rooms.worker_metrics) and ``/metrics``
+renders the merged snapshots in the Prometheus text format.
+"""
+import bisect
+import threading
+
+# Upper bounds (seconds) for latency histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Upper bounds (frames) for queue depth histograms
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Counter:
+    """Monotonically increasing count per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(_label_key(labels), 0)
+
+    def copy(self):
+        """Copy of the values per label set, safe to iterate while others update them"""
+        with self._lock:
+            return dict(self.values)
+
+    def snapshot(self):
+        with self._lock:
+            series = [[list(map(list, key)), value] for key, value in self.values.items()]
+        return {'kind': self.kind, 'help': self.help, 'series': series}
+
+
+class Gauge(Counter):
+    """Current value per label set that can go up and down"""
+
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    """Bucketed distribution of observed values per label set"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def quantile(self, q, **labels):
+        """Estimate a quantile as the upper bound of the bucket that contains it"""
+        with self._lock:
+            series = self.series.get(_label_key(labels))
+            counts = list(series['counts']) if series else []
+        return self.quantile_of(counts, q)
+
+    def quantile_of(self, counts, q):
+        """``quantile`` over bucket counts taken from a copy of a series"""
+        total = sum(counts)
+        if not total:
+            return None
+        target = q * total
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+    def copy(self):
+        """Copy of every series, safe to read while others observe new values"""
+        with self._lock:
+            return {key: dict(value, counts=list(value['counts'])) for key, value in self.series.items()}
+
+    def snapshot(self):
+        with self._lock:
+            series = [[list(map(list, key)), dict(value, counts=list(value['counts']))] for key, value in self.series.items()]
+        return {'kind': self.kind, 'help': self.help, 'buckets': list(self.buckets), 'series': series}
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def snapshot(self):
+        """JSON-serializable copy of every metric's current series"""
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def gauge(self, name, help_text):
+        return self.register(Gauge(name, help_text))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+
+registry = Registry()
+
+# WebSocket command metrics
+command_latency = registry.histogram(
+    'ws_command_duration_seconds', 'Time spent handling a WebSocket command, by message type')
+command_errors = registry.counter(
+    'ws_command_errors_total', 'WebSocket commands that failed validation or raised, by message type')
+
+# Per-connection send queue metrics
+outbox_frames = registry.gauge(
+    'ws_outbox_frames', 'Frames currently waiting in per-connection send queues')
+outbox_depth = registry.histogram(
+    'ws_outbox_depth', 'Send queue depth seen when a frame is queued', buckets=DEPTH_BUCKETS)
+outbox_dropped = registry.counter(
+    'ws_outbox_dropped_frames_total', 'Frames dropped from send queues, by reason')
+outbox_disconnects = registry.counter(
+    'ws_outbox_disconnects_total', 'Connections closed for falling too far behind their send queue')
+
+# Incoming frames dropped by rooms.limits
+rejected_messages = registry.counter(
+    'ws_rejected_messages_total', 'WebSocket messages rejected for size, nesting or rate limits, by message type and reason')
+
+# Reconnect resume
+resumes = registry.counter(
+    'ws_resumes_total', 'Reconnects and syncs served from the replay buffer or with a snapshot, by outcome')
+
+
+# Channel layer operations (rooms.redis_logger)
+channel_layer_latency = registry.histogram(
+    'channel_layer_operation_duration_seconds', 'Time spent in Redis channel layer operations, by operation')
+channel_layer_errors = registry.counter(
+    'channel_layer_errors_total', 'Redis channel layer operations that raised, by operation')
+
+# WebSocket connections and incoming messages
+ws_connections = registry.gauge(
+    'ws_connections', 'Open WebSocket connections')
+ws_connections_opened = registry.counter(
+    'ws_connections_opened_total', 'WebSocket connections accepted')
+ws_messages = registry.counter(
+    'ws_messages_received_total', 'WebSocket messages received, by message type')
+
+# REST requests (rooms.middleware.RequestMetricsMiddleware)
+http_latency = registry.histogram(
+    'http_request_duration_seconds', 'Time spent handling HTTP requests, by method, route and status')
+db_queries = registry.counter(
+    'db_queries_total', 'Database queries executed, by connection alias')
+db_query_latency = registry.histogram(
+    'db_query_duration_seconds', 'Time spent executing database queries, by connection alias')
+
+
+def merge_snapshots(snapshots, per_worker=False):
+    """
+    Combine registry snapshots from several workers into one
+
+    ``snapshots`` maps a worker id to its ``registry.snapshot()``. Series with
+    the same labels are summed across workers, or kept apart under a
+    ``worker`` label with ``per_worker``.
+    """
+    merged = {}
+    for worker, snapshot in sorted(snapshots.items()):
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, dict(metric, series={}))
+            for labels, value in metric['series']:
+                key = tuple(map(tuple, labels))
+                if per_worker:
+                    key = tuple(sorted(key + (('worker', worker),)))
+                if metric['kind'] != 'histogram':
+                    target['series'][key] = target['series'].get(key, 0) + value
+                    continue
+                series = target['series'].get(key)
+                if series is None:
+                    target['series'][key] = dict(value, counts=list(value['counts']))
+                elif len(series['counts']) == len(value['counts']):
+                    series['counts'] = [a + b for a, b in zip(series['counts'], value['counts'])]
+                    series['sum'] += value['sum']
+                    series['count'] += value['count']
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(merged):
+    """Merged snapshots in the Prometheus text exposition format"""
+    lines = []
+    for name, metric in sorted(merged.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for key, value in sorted(metric['series'].items(), key=lambda item: str(item[0])):
+            if metric['kind'] != 'histogram':
+                lines.append(f'{name}{_labels(key)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric['buckets'] + [float('inf')], value['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(key, [("le", _number(bound))])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(key)} {_number(value["sum"])}')
+            lines.append(f'{name}_count{_labels(key)} {value["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def command_summary():
+    """Per message type totals, sorted by total server time"""
+    errors = {}
+    for key, value in command_errors.copy().items():
+        command_type = dict(key).get('type')
+        errors[command_type] = errors.get(command_type, 0) + value
+    rows = []
+    for key, series in command_latency.copy().items():
+        labels = dict(key)
+        rows.append({
+            'type': labels.get('type'),
+            'count': series['count'],
+            'total_seconds': round(series['sum'], 6),
+            'mean_seconds': round(series['sum'] / series['count'], 6) if series['count'] else None,
+            'p50_seconds': command_latency.quantile_of(series['counts'], 0.5),
+            'p95_seconds': command_latency.quantile_of(series['counts'], 0.95),
+            'errors': errors.get(labels.get('type'), 0),
+        })
+    return sorted(rows, key=lambda row: row['total_seconds'], reverse=True)
+
+
+def outbox_summary():
+    """Send queue depth and drop totals for this process"""
+    depth = outbox_depth.copy().get(()) or {'counts': [], 'count': 0, 'sum': 0.0}
+    return {
+        'queued_frames': outbox_frames.value(),
+        'mean_depth': round(depth['sum'] / depth['count'], 3) if depth['count'] else None,
+        'p95_depth': outbox_depth.quantile_of(depth['counts'], 0.95),
+        'dropped': {dict(key).get('reason'): value for key, value in outbox_dropped.copy().items()},
+        'disconnects': outbox_disconnects.value(),
+    }
+
+
+def rejection_summary():
+    """Rejected message totals per message type and reason"""
+    rows = [dict(key, count=count) for key, count in rejected_messages.copy().items()]
+    return sorted(rows, key=lambda row: row['count'], reverse=True)
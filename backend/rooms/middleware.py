@@ -0,0 +1,43 @@
+"""
+Request and database query metrics
+
+``RequestMetricsMiddleware`` times every HTTP request into
+``http_request_duration_seconds``, labelled by the matched URL route rather
+than the path so room codes don't each become a series. ``time_query`` is
+installed as an execute wrapper on every database connection (by the
+``connection_created`` receiver in rooms.signals) and counts and times each
+query.
+"""
+import time
+
+from django.utils.deprecation import MiddlewareMixin
+
+from .metrics import db_queries, db_query_latency, http_latency
+
+
+class RequestMetricsMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        request.metrics_start_time = time.perf_counter()
+
+    def process_response(self, request, response):
+        start_time = getattr(request, 'metrics_start_time', None)
+        if start_time is not None:
+            match = request.resolver_match
+            http_latency.observe(
+                time.perf_counter() - start_time,
+                method=request.method,
+                route=match.route if match else 'unmatched',
+                status=response.status_code,
+            )
+        return response
+
+
+def time_query(execute, sql, params, many, context):
+    start_time = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        alias = context['connection'].alias
+        db_query_latency.observe(time.perf_counter() - start_time, alias=alias)
+        db_queries.inc(alias=alias)
+
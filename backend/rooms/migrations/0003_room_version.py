@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-17 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0002_room_session_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.0.1 on 2026-10-17 07:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0003_room_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='participant',
+            name='room',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='participants', to='rooms.room'),
+        ),
+        migrations.AlterField(
+            model_name='story',
+            name='room',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stories', to='rooms.room'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='participant',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='rooms.participant'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='room',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='rooms.room'),
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['room', 'connected'], name='participant_room_conn_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=models.Index(fields=['room', 'story_id'], name='story_room_story_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=models.Index(fields=['room', 'order', 'created_at'], name='story_room_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['room', 'story'], name='vote_room_story_idx'),
+        ),
+    ]
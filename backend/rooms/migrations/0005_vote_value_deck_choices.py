@@ -0,0 +1,19 @@
+# Generated by Django 5.0.1 on 2026-10-17 08:33
+
+import rooms.estimation
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0004_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='vote',
+            name='value',
+            field=models.CharField(choices=rooms.estimation.vote_choices, max_length=10),
+        ),
+    ]
@@ -3,9 +3,13 @@ import secrets
 import string
 import random
 from datetime import datetime
-from django.db import models
+from django.db import models, transaction, connection
+from django.db.models import F
+from django.dispatch import Signal
 from django.utils import timezone
 
+from .estimation import vote_choices
+
 
 def generate_room_code():
     """Generate a random 6-character room code"""
@@ -91,6 +95,7 @@ class Room(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     current_story = models.ForeignKey('Story', on_delete=models.SET_NULL, null=True, blank=True, related_name='active_in_room')
+    version = models.PositiveBigIntegerField(default=0)
 
     class Meta:
         ordering = ['-created_at']
@@ -99,9 +104,21 @@ class Room(models.Model):
         return f"Room {self.code}"
 
 
+def bump_room_version(room_code):
+    """Increment the room's state version and return the new value.
+
+    Must be called inside the same transaction as the mutation it versions so
+    the row lock keeps concurrent bumps from reading each other's value.
+    """
+    with transaction.atomic(savepoint=False):
+        Room.objects.filter(code=room_code).update(version=F('version') + 1)
+        return Room.objects.filter(code=room_code).values_list('version', flat=True).get()
+
+
 class Participant(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='participants')
+    # Indexed as the leading column of unique_together and participant_room_conn_idx
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='participants', db_index=False)
     username = models.CharField(max_length=50)
     session_id = models.CharField(max_length=100, unique=True)
     connected = models.BooleanField(default=True)
@@ -111,6 +128,10 @@ class Participant(models.Model):
     class Meta:
         ordering = ['joined_at']
         unique_together = [['room', 'username']]
+        indexes = [
+            # participants_count without presence
+            models.Index(fields=['room', 'connected'], name='participant_room_conn_idx'),
+        ]
 
     def __str__(self):
         return f"{self.username} in {self.room.code}"
@@ -118,7 +139,8 @@ class Participant(models.Model):
 
 class Story(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='stories')
+    # Indexed as the leading column of the indexes below
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='stories', db_index=False)
     story_id = models.CharField(max_length=100, blank=True, null=True)
     title = models.CharField(max_length=255, blank=True, null=True)
     final_points = models.CharField(max_length=10, blank=True, null=True)
@@ -129,6 +151,12 @@ class Story(models.Model):
     class Meta:
         ordering = ['order', 'created_at']
         verbose_name_plural = 'Stories'
+        indexes = [
+            # Duplicate check when adding a story
+            models.Index(fields=['room', 'story_id'], name='story_room_story_id_idx'),
+            # A room's stories in display order, with no sort step
+            models.Index(fields=['room', 'order', 'created_at'], name='story_room_order_idx'),
+        ]
 
     def __str__(self):
         display = self.story_id or self.title or 'Untitled'
@@ -136,24 +164,14 @@ class Story(models.Model):
 
 
 class Vote(models.Model):
-    VOTE_CHOICES = [
-        ('0', '0'),
-        ('1', '1'),
-        ('2', '2'),
-        ('3', '3'),
-        ('5', '5'),
-        ('8', '8'),
-        ('13', '13'),
-        ('21', '21'),
-        ('?', '?'),
-        ('coffee', '☕'),
-    ]
-
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='votes')
-    participant = models.ForeignKey(Participant, on_delete=models.CASCADE, related_name='votes')
+    # Indexed as the leading column of vote_room_story_idx
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='votes', db_index=False)
+    # Indexed as the leading column of unique_together
+    participant = models.ForeignKey(Participant, on_delete=models.CASCADE, related_name='votes', db_index=False)
     story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='votes')
-    value = models.CharField(max_length=10, choices=VOTE_CHOICES)
+    # Resolved per use, so the model and the vote command always accept the same deck
+    value = models.CharField(max_length=10, choices=vote_choices)
     revealed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -161,6 +179,68 @@ class Vote(models.Model):
     class Meta:
         ordering = ['created_at']
         unique_together = [['participant', 'story']]
+        indexes = [
+            # Reveal and reset of the current story's votes
+            models.Index(fields=['room', 'story'], name='vote_room_story_idx'),
+        ]
 
     def __str__(self):
         return f"{self.participant.username} voted {self.value} for {self.story}"
+
+
+# Sent once per bulk vote deletion with room_id, story_id, count and reason
+# ('reset' or 'new_story'), in place of per-row delete signals
+votes_cleared = Signal()
+
+
+def clear_votes(room_id, story_id, reason):
+    """Delete every vote on a story in a single DELETE statement.
+
+    Vote deliberately has no pre_delete/post_delete receivers, so Django
+    deletes the rows without loading them; auditing goes through one
+    ``votes_cleared`` signal for the whole set. Returns the number deleted.
+    """
+    count, _ = Vote.objects.filter(room_id=room_id, story_id=story_id).delete()
+    votes_cleared.send(sender=Vote, room_id=room_id, story_id=story_id, count=count, reason=reason)
+    return count
+
+
+def clear_story_estimate(story_id):
+    """Clear a story's final points and estimation time in a single UPDATE"""
+    Story.objects.filter(id=story_id).update(final_points=None, estimated_at=None)
+
+
+def upsert_vote(room_code, participant_id, story_id, value):
+    """Insert or update a participant's vote on a story in a single statement.
+
+    The vote row is selected from a join of the room, participant and story,
+    so nothing is written unless both belong to the room. Returns False in
+    that case (or for malformed ids), True once the vote is stored.
+    """
+    try:
+        participant_id = uuid.UUID(str(participant_id))
+        story_id = uuid.UUID(str(story_id))
+    except ValueError:
+        return False
+
+    def db_uuid(value):
+        return Vote._meta.pk.get_db_prep_value(value, connection)
+
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    sql = f"""
+        INSERT INTO {Vote._meta.db_table}
+            (id, room_id, participant_id, story_id, value, revealed, created_at, updated_at)
+        SELECT %s, r.id, p.id, s.id, %s, %s, %s, %s
+        FROM {Room._meta.db_table} r
+        JOIN {Participant._meta.db_table} p ON p.room_id = r.id AND p.id = %s
+        JOIN {Story._meta.db_table} s ON s.room_id = r.id AND s.id = %s
+        WHERE r.code = %s
+        ON CONFLICT (participant_id, story_id)
+        DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [
+            db_uuid(uuid.uuid4()), value, False, now, now,
+            db_uuid(participant_id), db_uuid(story_id), room_code,
+        ])
+        return cursor.rowcount > 0
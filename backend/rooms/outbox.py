@@ -0,0 +1,120 @@
+"""
+Bounded per-connection send queues
+
+Every ``RoomConsumer`` queues its outbound frames in an ``Outbox`` that a
+writer task drains into the socket, so a slow client only ever holds a
+bounded number of frames:
+
+- queueing a snapshot drops every frame still waiting before it, since the
+  snapshot already contains their changes
+- when the queue is full, everything waiting is dropped and replaced by a
+  single marker that sends a fresh snapshot once the writer reaches it
+- if the queue fills up again before that snapshot has gone out, the client
+  is hopelessly behind and the connection is closed with ``RESYNC_CLOSE_CODE``
+  so it reconnects and starts over from a snapshot
+- if the writer itself fails (the snapshot can't be built, say), the
+  connection is closed the same way rather than left open and silent
+"""
+import asyncio
+import logging
+from collections import deque
+
+from .metrics import outbox_frames, outbox_depth, outbox_dropped, outbox_disconnects
+
+websocket_logger = logging.getLogger('rooms.websocket')
+
+# Application close code telling the client to reconnect and resync
+RESYNC_CLOSE_CODE = 4009
+
+# Queued in place of dropped frames: send the latest snapshot instead
+RESYNC = object()
+
+
+class Outbox:
+    def __init__(self, send_frame, snapshot_frame, close, max_frames):
+        self.send_frame = send_frame
+        self.snapshot_frame = snapshot_frame
+        self.close = close
+        self.max_frames = max_frames
+        self.frames = deque()
+        self.resync_pending = False
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self.closed = True
+        self._clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def put(self, frame, snapshot=False):
+        """Queue an encoded frame for this client without waiting for the socket"""
+        if self.closed:
+            return
+
+        if snapshot:
+            # Everything still waiting is already part of the snapshot
+            outbox_dropped.inc(self._clear(), reason='superseded')
+        elif len(self.frames) >= self.max_frames:
+            if self.resync_pending:
+                self._give_up()
+                return
+            websocket_logger.warning("WS OUTBOX - Send queue full (%s frames), replacing it with a snapshot", len(self.frames))
+            outbox_dropped.inc(self._clear() + 1, reason='overflow')
+            frame = RESYNC
+
+        outbox_depth.observe(len(self.frames))
+        self.frames.append(frame)
+        outbox_frames.inc()
+        if frame is RESYNC:
+            self.resync_pending = True
+        self._ready.set()
+
+    def has_room(self, count):
+        """Whether ``count`` more frames fit without overflowing the queue"""
+        return len(self.frames) + count <= self.max_frames
+
+    def _clear(self):
+        dropped = len(self.frames)
+        self.frames.clear()
+        self.resync_pending = False
+        outbox_frames.dec(dropped)
+        return dropped
+
+    def _give_up(self):
+        websocket_logger.warning("WS OUTBOX - Client is too far behind, closing with code %s", RESYNC_CLOSE_CODE)
+        outbox_dropped.inc(self._clear() + 1, reason='disconnect')
+        outbox_disconnects.inc()
+        self.closed = True
+        asyncio.ensure_future(self.close(code=RESYNC_CLOSE_CODE))
+
+    async def _run(self):
+        try:
+            while True:
+                while not self.frames:
+                    self._ready.clear()
+                    await self._ready.wait()
+
+                frame = self.frames.popleft()
+                outbox_frames.dec()
+                if frame is RESYNC:
+                    frame = await self.snapshot_frame()
+                    self.resync_pending = False
+                await self.send_frame(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            websocket_logger.error("WS OUTBOX - Writer stopped, closing with code %s: %s", RESYNC_CLOSE_CODE, e)
+            self.closed = True
+            outbox_dropped.inc(self._clear(), reason='disconnect')
+            outbox_disconnects.inc()
+            await self.close(code=RESYNC_CLOSE_CODE)
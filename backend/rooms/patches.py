@@ -0,0 +1,83 @@
+"""
+Room state patches for WebSocket broadcasts
+
+Every room mutation bumps ``Room.version`` and is broadcast as a small typed
+patch instead of the full ``RoomSerializer`` output. Clients apply patches in
+version order and ask for a full snapshot (``sync``) when they detect a gap.
+"""
+
+# Patch operation names
+VOTES = 'votes'
+PRESENCE = 'presence'
+CURRENT_STORY = 'current_story'
+STORY_ADDED = 'story_added'
+VOTES_REVEALED = 'votes_revealed'
+VOTES_RESET = 'votes_reset'
+POINTS_CONFIRMED = 'points_confirmed'
+
+
+def votes_patch(story_id, participant_ids):
+    """Participants' vote flags were set for a story (the values stay hidden)"""
+    return {
+        'op': VOTES,
+        'story': str(story_id),
+        'participants': [str(pid) for pid in participant_ids],
+    }
+
+
+def presence_patch(participant_data, connected):
+    """A participant connected or disconnected"""
+    return {
+        'op': PRESENCE,
+        'participant': participant_data,
+        'connected': connected,
+    }
+
+
+def current_story_patch(story_id):
+    """The room's current story pointer moved"""
+    return {
+        'op': CURRENT_STORY,
+        'story': str(story_id) if story_id else None,
+    }
+
+
+def story_added_patch(story_data, cleared_story_id=None, current=True):
+    """A story was appended (and made current, clearing the previous story's votes)"""
+    return {
+        'op': STORY_ADDED,
+        'story': story_data,
+        'cleared_story': str(cleared_story_id) if cleared_story_id else None,
+        'current': current,
+    }
+
+
+def votes_revealed_patch(story_id, votes_data, final_points=None, estimated_at=None):
+    """Votes for a story were revealed; carries the now-visible votes and any saved estimate"""
+    patch = {
+        'op': VOTES_REVEALED,
+        'story': str(story_id) if story_id else None,
+        'votes': votes_data,
+    }
+    if final_points is not None:
+        patch['final_points'] = final_points
+        patch['estimated_at'] = estimated_at.isoformat() if estimated_at else None
+    return patch
+
+
+def votes_reset_patch(story_id):
+    """Votes and estimation for a story were cleared"""
+    return {
+        'op': VOTES_RESET,
+        'story': str(story_id) if story_id else None,
+    }
+
+
+def points_confirmed_patch(story_id, final_points, estimated_at):
+    """Final points were confirmed for a story"""
+    return {
+        'op': POINTS_CONFIRMED,
+        'story': str(story_id) if story_id else None,
+        'final_points': final_points,
+        'estimated_at': estimated_at.isoformat() if estimated_at else None,
+    }
@@ -0,0 +1,205 @@
+"""
+Participant presence tracked in Redis with heartbeat TTLs
+
+Each room has a sorted set ``presence:<room code>`` whose members are the
+connected participant ids, scored by the time their presence expires.
+Connecting and every client heartbeat push that expiry ``PRESENCE_TTL``
+seconds ahead, disconnecting removes the member, and readers only count
+members whose expiry is still in the future, so a client that vanishes
+without a disconnect drops out on its own.
+
+``Participant.connected``/``last_seen`` are no longer written per event;
+changes are collected here and written in one batch every
+``PRESENCE_FLUSH_INTERVAL`` seconds. They remain the fallback whenever
+Redis can't be reached.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+import redis
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Participant
+from .redis_client import get_client, use_local_state
+from .write_queue import database_write
+
+redis_logger = logging.getLogger('rooms.redis')
+
+
+def _key(room_code):
+    return f'presence:{room_code}'
+
+
+class RedisPresenceBackend:
+    def add(self, room_code, participant_id, expires_at, ttl, only_existing=False):
+        pipe = get_client().pipeline()
+        # Expired members must not count as present for the zadd below
+        pipe.zremrangebyscore(_key(room_code), '-inf', time.time())
+        # With XX+CH the reply counts refreshed members instead of new ones
+        pipe.zadd(_key(room_code), {participant_id: expires_at}, xx=only_existing, ch=only_existing)
+        # The whole set goes away once nobody has heartbeated for a while
+        pipe.expire(_key(room_code), ttl * 2)
+        _, changed, _ = pipe.execute()
+        return bool(changed)
+
+    def remove(self, room_code, participant_id):
+        return bool(get_client().zrem(_key(room_code), participant_id))
+
+    def members(self, room_code, now):
+        pipe = get_client().pipeline()
+        pipe.zremrangebyscore(_key(room_code), '-inf', now)
+        pipe.zrange(_key(room_code), 0, -1)
+        _, members = pipe.execute()
+        return {member.decode() for member in members}
+
+    def members_by_room(self, room_codes, now):
+        pipe = get_client().pipeline()
+        for room_code in room_codes:
+            pipe.zremrangebyscore(_key(room_code), '-inf', now)
+            pipe.zrange(_key(room_code), 0, -1)
+        replies = pipe.execute()
+        return {room_code: {member.decode() for member in members} for room_code, members in zip(room_codes, replies[1::2])}
+
+
+class LocalPresenceBackend:
+    def __init__(self):
+        self.rooms = {}
+        self._lock = threading.Lock()
+
+    def add(self, room_code, participant_id, expires_at, ttl, only_existing=False):
+        with self._lock:
+            members = self.rooms.setdefault(room_code, {})
+            present = members.get(participant_id, 0) > time.time()
+            if present or not only_existing:
+                members[participant_id] = expires_at
+        return present if only_existing else not present
+
+    def remove(self, room_code, participant_id):
+        with self._lock:
+            return self.rooms.get(room_code, {}).pop(participant_id, None) is not None
+
+    def members(self, room_code, now):
+        with self._lock:
+            members = self.rooms.get(room_code, {})
+            for participant_id in [p for p, expires_at in members.items() if expires_at <= now]:
+                del members[participant_id]
+            return set(members)
+
+    def members_by_room(self, room_codes, now):
+        return {room_code: self.members(room_code, now) for room_code in room_codes}
+
+
+class Presence:
+    """Connected participants per room plus the pending ``Participant`` row updates"""
+
+    def __init__(self):
+        self.pending = {}
+        self._backend = None
+        self._lock = threading.Lock()
+        self._task = None
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'PRESENCE_TTL', 60)
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 30)
+
+    @property
+    def backend(self):
+        local = use_local_state()
+        if self._backend is None or isinstance(self._backend, LocalPresenceBackend) != local:
+            self._backend = LocalPresenceBackend() if local else RedisPresenceBackend()
+        return self._backend
+
+    def connect(self, room_code, participant_id):
+        """Mark a participant present; True if it wasn't present already"""
+        participant_id = str(participant_id)
+        self._mark(participant_id, True)
+        try:
+            return self.backend.add(room_code, participant_id, time.time() + self.ttl, self.ttl)
+        except redis.RedisError as e:
+            redis_logger.error("REDIS PRESENCE - Failed to mark %s present in room %s: %s", participant_id, room_code, e)
+            return True
+
+    def heartbeat(self, room_code, participant_id):
+        """Refresh a present participant's TTL; False if its presence already expired"""
+        participant_id = str(participant_id)
+        try:
+            present = self.backend.add(room_code, participant_id, time.time() + self.ttl, self.ttl, only_existing=True)
+        except redis.RedisError as e:
+            redis_logger.error("REDIS PRESENCE - Failed to refresh %s in room %s: %s", participant_id, room_code, e)
+            return True
+        if present:
+            self._mark(participant_id, True)
+        return present
+
+    def disconnect(self, room_code, participant_id):
+        """Mark a participant gone; True if it was present"""
+        participant_id = str(participant_id)
+        self._mark(participant_id, False)
+        try:
+            return self.backend.remove(room_code, participant_id)
+        except redis.RedisError as e:
+            redis_logger.error("REDIS PRESENCE - Failed to remove %s from room %s: %s", participant_id, room_code, e)
+            return True
+
+    def connected_ids(self, room_code):
+        """Ids of the room's present participants, or None if presence is unavailable"""
+        try:
+            return self.backend.members(room_code, time.time())
+        except redis.RedisError as e:
+            redis_logger.error("REDIS PRESENCE - Failed to read presence for room %s: %s", room_code, e)
+            return None
+
+    def connected_ids_by_room(self, room_codes):
+        """``connected_ids`` for several rooms in one Redis round trip; None per room if unavailable"""
+        room_codes = list(room_codes)
+        try:
+            return self.backend.members_by_room(room_codes, time.time())
+        except redis.RedisError as e:
+            redis_logger.error("REDIS PRESENCE - Failed to read presence for rooms %s: %s", room_codes, e)
+            return dict.fromkeys(room_codes)
+
+    def _mark(self, participant_id, connected):
+        with self._lock:
+            self.pending[participant_id] = connected
+
+    def flush(self):
+        """Write pending connected/last_seen changes to the Participant rows"""
+        with self._lock:
+            batch, self.pending = self.pending, {}
+        if not batch:
+            return
+        now = timezone.now()
+        try:
+            for connected in (True, False):
+                ids = [participant_id for participant_id, value in batch.items() if value is connected]
+                if ids:
+                    Participant.objects.filter(id__in=ids).update(connected=connected, last_seen=now)
+        except Exception:
+            # Keep the batch for the next flush unless a newer change replaced it
+            with self._lock:
+                for participant_id, connected in batch.items():
+                    self.pending.setdefault(participant_id, connected)
+            raise
+
+    def ensure_flusher(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await database_write(self.flush)
+            except Exception as e:
+                redis_logger.error("REDIS PRESENCE - Failed to persist presence: %s", e)
+
+
+# Process-wide presence tracker
+presence = Presence()
@@ -0,0 +1,31 @@
+"""
+Redis connection for room state kept outside the database
+
+Participant presence, the event replay buffer and cached room snapshots
+live in Redis so every worker sees the same state. ``ROOM_STATE_BACKEND = 'local'`` keeps them in
+process memory instead, which is only correct with a single worker (and is
+what the tests use).
+"""
+import threading
+
+import redis
+from django.conf import settings
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def use_local_state():
+    return getattr(settings, 'ROOM_STATE_BACKEND', 'redis') == 'local'
+
+
+def get_client():
+    """Shared client for ``ROOM_STATE_REDIS_URL``"""
+    url = getattr(settings, 'ROOM_STATE_REDIS_URL', 'redis://127.0.0.1:6379/1')
+    client = _clients.get(url)
+    if client is None:
+        with _lock:
+            client = _clients.get(url)
+            if client is None:
+                client = _clients[url] = redis.Redis.from_url(url, socket_connect_timeout=1, socket_timeout=1)
+    return client
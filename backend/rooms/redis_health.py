@@ -1,12 +1,22 @@
 """
 Redis Health Check and Connection Monitoring
+
+Nothing here touches Redis at import time or app startup. The monitor is
+built on first use. ``redis_probe`` runs the connection check on a
+background thread, started with the server from config.asgi/config.wsgi,
+and keeps the latest result for ``/readyz`` to serve without a Redis round
+trip.
 """
 import logging
+import threading
+import time
+
 import redis
-import asyncio
 from django.conf import settings
-from django.core.cache import cache
 from channels.layers import get_channel_layer
+from channels_redis.utils import decode_hosts
+
+from .sharded_layer import host_address
 
 # Set up Redis logger
 redis_logger = logging.getLogger('rooms.redis')
@@ -25,20 +35,19 @@ class RedisHealthMonitor:
         try:
             # Get Redis connection details from channel layers config
             config = settings.CHANNEL_LAYERS['default']['CONFIG']
-            host, port = config['hosts'][0]
+            address = host_address(decode_hosts(config['hosts'])[0])
             
-            self.redis_client = redis.Redis(
-                host=host,
-                port=port,
+            self.redis_client = redis.Redis.from_url(
+                address,
                 decode_responses=True,
                 socket_connect_timeout=5,
                 socket_timeout=5,
                 retry_on_timeout=False
             )
             
-            redis_logger.info(f"REDIS HEALTH - Redis client initialized: {host}:{port}")
+            redis_logger.info("REDIS HEALTH - Redis client initialized: %s", address)
         except Exception as e:
-            redis_logger.error(f"REDIS HEALTH - Failed to initialize Redis client: {str(e)}")
+            redis_logger.error("REDIS HEALTH - Failed to initialize Redis client: %s", e)
     
     def check_redis_connection(self):
         """Check Redis connection health"""
@@ -49,38 +58,38 @@ class RedisHealthMonitor:
                 test_value = "test_value"
                 
                 # Test SET
-                start_time = asyncio.get_event_loop().time() if asyncio.get_event_loop().is_running() else 0
+                start_time = time.perf_counter()
                 self.redis_client.set(test_key, test_value, ex=5)  # 5 second expiry
                 
                 # Test GET
                 result = self.redis_client.get(test_key)
-                duration = (asyncio.get_event_loop().time() - start_time) * 1000 if start_time else 0
+                duration = (time.perf_counter() - start_time) * 1000
                 
                 if result == test_value:
-                    redis_logger.info(f"REDIS HEALTH - Connection healthy, latency: {duration:.2f}ms")
+                    redis_logger.info("REDIS HEALTH - Connection healthy, latency: %.2fms", duration)
                     
                     # Get Redis info
                     info = self.redis_client.info()
-                    redis_logger.debug(f"REDIS HEALTH - Connected clients: {info.get('connected_clients', 'N/A')}")
-                    redis_logger.debug(f"REDIS HEALTH - Memory usage: {info.get('used_memory_human', 'N/A')}")
-                    redis_logger.debug(f"REDIS HEALTH - Keyspace hits: {info.get('keyspace_hits', 'N/A')}")
+                    redis_logger.debug("REDIS HEALTH - Connected clients: %s", info.get('connected_clients', 'N/A'))
+                    redis_logger.debug("REDIS HEALTH - Memory usage: %s", info.get('used_memory_human', 'N/A'))
+                    redis_logger.debug("REDIS HEALTH - Keyspace hits: %s", info.get('keyspace_hits', 'N/A'))
                     
                     return True
                 else:
-                    redis_logger.error(f"REDIS HEALTH - Data integrity check failed")
+                    redis_logger.error("REDIS HEALTH - Data integrity check failed")
                     return False
             else:
                 redis_logger.error("REDIS HEALTH - Redis client not initialized")
                 return False
                 
         except redis.ConnectionError as e:
-            redis_logger.error(f"REDIS HEALTH - Connection error: {str(e)}")
+            redis_logger.error("REDIS HEALTH - Connection error: %s", e)
             return False
         except redis.TimeoutError as e:
-            redis_logger.error(f"REDIS HEALTH - Timeout error: {str(e)}")
+            redis_logger.error("REDIS HEALTH - Timeout error: %s", e)
             return False
         except Exception as e:
-            redis_logger.error(f"REDIS HEALTH - Unexpected error: {str(e)}")
+            redis_logger.error("REDIS HEALTH - Unexpected error: %s", e)
             return False
     
     def get_redis_stats(self):
@@ -98,14 +107,14 @@ class RedisHealthMonitor:
                     'uptime_in_seconds': info.get('uptime_in_seconds', 0)
                 }
                 
-                redis_logger.info(f"REDIS STATS - {stats}")
+                redis_logger.info("REDIS STATS - %s", stats)
                 return stats
             else:
                 redis_logger.error("REDIS STATS - Redis client not available")
                 return None
                 
         except Exception as e:
-            redis_logger.error(f"REDIS STATS - Error getting stats: {str(e)}")
+            redis_logger.error("REDIS STATS - Error getting stats: %s", e)
             return None
     
     def check_channels_layer_health(self):
@@ -119,17 +128,25 @@ class RedisHealthMonitor:
                 redis_logger.error("REDIS HEALTH - Channels layer not available")
                 return False
         except Exception as e:
-            redis_logger.error(f"REDIS HEALTH - Channels layer error: {str(e)}")
+            redis_logger.error("REDIS HEALTH - Channels layer error: %s", e)
             return False
 
 
-# Create singleton instance
-redis_health = RedisHealthMonitor()
+_monitor = None
+
+
+def get_redis_health():
+    """Process-wide monitor, created on first use"""
+    global _monitor
+    if _monitor is None:
+        _monitor = RedisHealthMonitor()
+    return _monitor
 
 
 def log_redis_health():
     """Convenience function to log Redis health status"""
     redis_logger.info("REDIS HEALTH CHECK - Starting health check")
+    redis_health = get_redis_health()
     
     # Check basic Redis connection
     connection_healthy = redis_health.check_redis_connection()
@@ -141,11 +158,56 @@ def log_redis_health():
     stats = redis_health.get_redis_stats()
     
     overall_health = connection_healthy and channels_healthy
-    redis_logger.info(f"REDIS HEALTH CHECK - Overall status: {'HEALTHY' if overall_health else 'UNHEALTHY'}")
+    redis_logger.info("REDIS HEALTH CHECK - Overall status: %s", 'HEALTHY' if overall_health else 'UNHEALTHY')
     
     return {
         'connection_healthy': connection_healthy,
         'channels_healthy': channels_healthy,
         'overall_healthy': overall_health,
         'stats': stats
-    }
\ No newline at end of file
+    }
+
+
+class RedisHealthProbe:
+    """Latest Redis health result, refreshed every ``REDIS_HEALTH_INTERVAL`` seconds by a background thread"""
+
+    def __init__(self):
+        self.result = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def interval(self):
+        return getattr(settings, 'REDIS_HEALTH_INTERVAL', 30)
+
+    def ensure_started(self):
+        """Start this process's background probe thread once"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='redis-health', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(self.interval)
+
+    def refresh(self):
+        start_time = time.perf_counter()
+        healthy = get_redis_health().check_redis_connection()
+        self.result = {
+            'healthy': healthy,
+            'checked_at': time.time(),
+            'duration_ms': round((time.perf_counter() - start_time) * 1000, 2),
+        }
+        return self.result
+
+    def ready(self):
+        """Whether the latest result is healthy and no older than a few intervals"""
+        result = self.result
+        return bool(result and result['healthy'] and time.time() - result['checked_at'] <= 3 * self.interval)
+
+
+# Process-wide background probe
+redis_probe = RedisHealthProbe()
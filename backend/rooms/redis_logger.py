@@ -1,123 +1,83 @@
 """
-Custom Redis channel layer with comprehensive logging
-Wraps the default Redis channel layer to log all Redis operations
+Custom Redis channel layer with logging and operation metrics
+Wraps the default Redis channel layer to time every Redis operation into the
+``channel_layer_operation_duration_seconds`` histogram (see ``/metrics``) and
+log failures
 """
 import logging
-import json
-import asyncio
+import time
+from contextlib import contextmanager
+
 from channels_redis.core import RedisChannelLayer
-from asgiref.sync import sync_to_async
+
+from .log_queue import LazyJson
+from .metrics import channel_layer_errors, channel_layer_latency
 
 # Set up Redis logger
 redis_logger = logging.getLogger('rooms.redis')
 
 
+@contextmanager
+def timed(operation, target, *args):
+    """Observe the duration of a channel layer operation, logging it if it fails"""
+    start_time = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        channel_layer_errors.inc(operation=operation)
+        redis_logger.error("REDIS %s ERROR - %s, Error: %s, Duration: %.2fms",
+                           operation.upper(), target % args, e, (time.perf_counter() - start_time) * 1000)
+        raise
+    finally:
+        channel_layer_latency.observe(time.perf_counter() - start_time, operation=operation)
+
+
 class LoggingRedisChannelLayer(RedisChannelLayer):
     """
-    Custom Redis channel layer that logs all operations
+    Custom Redis channel layer that times and logs all operations
     """
-    
+
     async def send(self, channel, message):
-        """Log channel sends"""
-        redis_logger.info(f"REDIS SEND - Channel: {channel}")
-        redis_logger.debug(f"REDIS SEND - Message: {json.dumps(message, default=str)}")
-        
-        start_time = asyncio.get_event_loop().time()
-        try:
-            result = await super().send(channel, message)
-            duration = (asyncio.get_event_loop().time() - start_time) * 1000
-            redis_logger.info(f"REDIS SEND SUCCESS - Channel: {channel}, Duration: {duration:.2f}ms")
-            return result
-        except Exception as e:
-            duration = (asyncio.get_event_loop().time() - start_time) * 1000
-            redis_logger.error(f"REDIS SEND ERROR - Channel: {channel}, Error: {str(e)}, Duration: {duration:.2f}ms")
-            raise
+        """Time channel sends"""
+        redis_logger.debug("REDIS SEND - Channel: %s, Message: %s", channel, LazyJson(message))
+        with timed('send', 'Channel: %s', channel):
+            return await super().send(channel, message)
 
     async def receive(self, channels):
-        """Log channel receives"""
-        redis_logger.debug(f"REDIS RECEIVE - Waiting on channels: {channels}")
-        
-        start_time = asyncio.get_event_loop().time()
-        try:
+        """Time channel receives"""
+        redis_logger.debug("REDIS RECEIVE - Waiting on channels: %s", channels)
+        with timed('receive', 'Channels: %s', channels):
             result = await super().receive(channels)
-            duration = (asyncio.get_event_loop().time() - start_time) * 1000
-            
-            if result:
-                channel, message = result
-                redis_logger.info(f"REDIS RECEIVE SUCCESS - Channel: {channel}, Duration: {duration:.2f}ms")
-                redis_logger.debug(f"REDIS RECEIVE - Message: {json.dumps(message, default=str)}")
-            else:
-                redis_logger.debug(f"REDIS RECEIVE TIMEOUT - Duration: {duration:.2f}ms")
-                
-            return result
-        except Exception as e:
-            duration = (asyncio.get_event_loop().time() - start_time) * 1000
-            redis_logger.error(f"REDIS RECEIVE ERROR - Channels: {channels}, Error: {str(e)}, Duration: {duration:.2f}ms")
-            raise
+        if result:
+            redis_logger.debug("REDIS RECEIVE - Message: %s", LazyJson(result))
+        return result
 
     async def group_add(self, group, channel):
-        """Log group additions"""
-        redis_logger.info(f"REDIS GROUP_ADD - Group: {group}, Channel: {channel}")
-        
-        start_time = asyncio.get_event_loop().time()
-        try:
-            result = await super().group_add(group, channel)
-            duration = (asyncio.get_event_loop().time() - start_time) * 1000
-            redis_logger.info(f"REDIS GROUP_ADD SUCCESS - Group: {group}, Channel: {channel}, Duration: {duration:.2f}ms")
-            return result
-        except Exception as e:
-            duration = (asyncio.get_event_loop().time() - start_time) * 1000
-            redis_logger.error(f"REDIS GROUP_ADD ERROR - Group: {group}, Channel: {channel}, Error: {str(e)}, Duration: {duration:.2f}ms")
-            raise
+        """Time group additions"""
+        redis_logger.debug("REDIS GROUP_ADD - Group: %s, Channel: %s", group, channel)
+        with timed('group_add', 'Group: %s, Channel: %s', group, channel):
+            return await super().group_add(group, channel)
 
     async def group_discard(self, group, channel):
-        """Log group removals"""
-        redis_logger.info(f"REDIS GROUP_DISCARD - Group: {group}, Channel: {channel}")
-        
-        start_time = asyncio.get_event_loop().time()
-        try:
-            result = await super().group_discard(group, channel)
-            duration = (asyncio.get_event_loop().time() - start_time) * 1000
-            redis_logger.info(f"REDIS GROUP_DISCARD SUCCESS - Group: {group}, Channel: {channel}, Duration: {duration:.2f}ms")
-            return result
-        except Exception as e:
-            duration = (asyncio.get_event_loop().time() - start_time) * 1000
-            redis_logger.error(f"REDIS GROUP_DISCARD ERROR - Group: {group}, Channel: {channel}, Error: {str(e)}, Duration: {duration:.2f}ms")
-            raise
+        """Time group removals"""
+        redis_logger.debug("REDIS GROUP_DISCARD - Group: %s, Channel: %s", group, channel)
+        with timed('group_discard', 'Group: %s, Channel: %s', group, channel):
+            return await super().group_discard(group, channel)
 
     async def group_send(self, group, message):
-        """Log group sends"""
-        redis_logger.info(f"REDIS GROUP_SEND - Group: {group}")
-        redis_logger.debug(f"REDIS GROUP_SEND - Message: {json.dumps(message, default=str)}")
-        
-        start_time = asyncio.get_event_loop().time()
-        try:
-            result = await super().group_send(group, message)
-            duration = (asyncio.get_event_loop().time() - start_time) * 1000
-            redis_logger.info(f"REDIS GROUP_SEND SUCCESS - Group: {group}, Duration: {duration:.2f}ms")
-            return result
-        except Exception as e:
-            duration = (asyncio.get_event_loop().time() - start_time) * 1000
-            redis_logger.error(f"REDIS GROUP_SEND ERROR - Group: {group}, Error: {str(e)}, Duration: {duration:.2f}ms")
-            raise
+        """Time group sends"""
+        redis_logger.debug("REDIS GROUP_SEND - Group: %s, Message: %s", group, LazyJson(message))
+        with timed('group_send', 'Group: %s', group):
+            return await super().group_send(group, message)
 
     async def new_channel(self, prefix="specific"):
         """Log new channel creation"""
         result = await super().new_channel(prefix)
-        redis_logger.info(f"REDIS NEW_CHANNEL - Channel: {result}, Prefix: {prefix}")
+        redis_logger.info("REDIS NEW_CHANNEL - Channel: %s, Prefix: %s", result, prefix)
         return result
 
     async def flush(self):
         """Log Redis flush operations"""
         redis_logger.warning("REDIS FLUSH - Clearing all Redis data")
-        
-        start_time = asyncio.get_event_loop().time()
-        try:
-            result = await super().flush()
-            duration = (asyncio.get_event_loop().time() - start_time) * 1000
-            redis_logger.warning(f"REDIS FLUSH SUCCESS - Duration: {duration:.2f}ms")
-            return result
-        except Exception as e:
-            duration = (asyncio.get_event_loop().time() - start_time) * 1000
-            redis_logger.error(f"REDIS FLUSH ERROR - Error: {str(e)}, Duration: {duration:.2f}ms")
-            raise
\ No newline at end of file
+        with timed('flush', 'All channels'):
+            return await super().flush()
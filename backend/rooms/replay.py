@@ -0,0 +1,134 @@
+"""
+Per-room replay buffer of recent broadcasts
+
+Every versioned room broadcast is recorded here, as its encoded text frame,
+before it is sent to the group. The buffer keeps the last ``REPLAY_BUFFER_SIZE``
+frames per room, so a client that reconnects (or detects a version gap) can
+send the last version it saw and get just the frames it missed. When the
+buffer no longer reaches back that far the client gets a snapshot instead.
+
+Frames are replayed in room version order; a coalesced ``vote_cast`` covers
+``base_version``..``version``. A client only gets a replay when the buffer
+holds every version after the one it saw, otherwise it gets a snapshot; so
+does a client reporting a version ahead of the buffer's newest.
+"""
+import logging
+import threading
+from collections import deque
+
+import msgpack
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .redis_client import get_client, use_local_state
+
+redis_logger = logging.getLogger('rooms.redis')
+
+
+def _key(room_code):
+    return f'replay:{room_code}'
+
+
+class RedisReplayBackend:
+    def append(self, room_code, entry, size, ttl):
+        pipe = get_client().pipeline()
+        pipe.rpush(_key(room_code), msgpack.packb(entry, use_bin_type=True))
+        pipe.ltrim(_key(room_code), -size, -1)
+        pipe.expire(_key(room_code), ttl)
+        pipe.execute()
+
+    def entries(self, room_code):
+        return [msgpack.unpackb(raw, raw=False) for raw in get_client().lrange(_key(room_code), 0, -1)]
+
+
+class LocalReplayBackend:
+    def __init__(self):
+        self.rooms = {}
+        self._lock = threading.Lock()
+
+    def append(self, room_code, entry, size, ttl):
+        with self._lock:
+            frames = self.rooms.get(room_code)
+            if frames is None or frames.maxlen != size:
+                frames = self.rooms[room_code] = deque(frames or (), maxlen=size)
+            frames.append(entry)
+
+    def entries(self, room_code):
+        with self._lock:
+            return list(self.rooms.get(room_code, ()))
+
+
+class ReplayBuffer:
+    def __init__(self):
+        self._backend = None
+
+    @property
+    def size(self):
+        return getattr(settings, 'REPLAY_BUFFER_SIZE', 256)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'REPLAY_BUFFER_TTL', 3600)
+
+    @property
+    def backend(self):
+        local = use_local_state()
+        if self._backend is None or isinstance(self._backend, LocalReplayBackend) != local:
+            self._backend = LocalReplayBackend() if local else RedisReplayBackend()
+        return self._backend
+
+    def record(self, room_code, message, event):
+        """Remember a broadcast's encoded text frame under its room version"""
+        version = message.get('version')
+        if version is None:
+            return
+        entry = {
+            'base_version': message.get('base_version', version),
+            'version': version,
+            'text': event['text'],
+        }
+        try:
+            self.backend.append(room_code, entry, self.size, self.ttl)
+        except redis.RedisError as e:
+            redis_logger.error("REDIS REPLAY - Failed to record version %s for room %s: %s", version, room_code, e)
+
+    def since(self, room_code, last_version):
+        """Entries a client at ``last_version`` missed, or None if the buffer doesn't cover the gap"""
+        try:
+            entries = self.backend.entries(room_code)
+        except redis.RedisError as e:
+            redis_logger.error("REDIS REPLAY - Failed to read replay buffer for room %s: %s", room_code, e)
+            return None
+
+        if not entries:
+            return None
+        # Concurrent broadcasts can be recorded out of order
+        entries.sort(key=lambda entry: entry['version'])
+        if last_version == entries[-1]['version']:
+            return []
+        if last_version > entries[-1]['version']:
+            # Ahead of the server, e.g. after a reset or a lost buffer: resync
+            return None
+
+        # The replay must run without a gap from last_version + 1 up to the head
+        missed = []
+        expected = last_version + 1
+        for entry in entries:
+            if entry['version'] < expected:
+                continue
+            if entry['base_version'] > expected:
+                return None
+            missed.append(entry)
+            expected = entry['version'] + 1
+        return missed
+
+    async def arecord(self, room_code, message, event):
+        await sync_to_async(self.record, thread_sensitive=False)(room_code, message, event)
+
+    async def asince(self, room_code, last_version):
+        return await sync_to_async(self.since, thread_sensitive=False)(room_code, last_version)
+
+
+# Process-wide replay buffer
+replay_buffer = ReplayBuffer()
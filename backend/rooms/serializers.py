@@ -1,13 +1,26 @@
+from django.db.models import Count, Prefetch, prefetch_related_objects
+from django.db.models.manager import BaseManager
 from rest_framework import serializers
+from .estimation import get_deck
 from .models import Room, Participant, Story, Vote
+from .presence import presence
 
 
 class ParticipantSerializer(serializers.ModelSerializer):
+    # Read from presence when the context carries the room's connected ids
+    connected = serializers.SerializerMethodField()
+
     class Meta:
         model = Participant
         fields = ['id', 'username', 'connected', 'joined_at', 'last_seen']
         read_only_fields = ['id', 'joined_at', 'last_seen']
 
+    def get_connected(self, obj):
+        connected_ids = self.context.get('connected_ids')
+        if connected_ids is None:
+            return obj.connected
+        return str(obj.id) in connected_ids
+
 
 class VoteSerializer(serializers.ModelSerializer):
     participant_name = serializers.CharField(source='participant.username', read_only=True)
@@ -28,23 +41,84 @@ class StorySerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
 
     def get_votes_count(self, obj):
+        # Annotated when loaded through RoomSerializer.prefetch
+        if hasattr(obj, 'votes_total'):
+            return obj.votes_total
         return obj.votes.count()
 
 
+class RoomListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        rooms = list(data.all() if isinstance(data, BaseManager) else data)
+        # Presence for every listed room in one lookup instead of one per room
+        self.context['connected_ids_by_room'] = presence.connected_ids_by_room(room.code for room in rooms)
+        return super().to_representation(rooms)
+
+
 class RoomSerializer(serializers.ModelSerializer):
     participants = ParticipantSerializer(many=True, read_only=True)
     stories = StorySerializer(many=True, read_only=True)
-    current_story_data = StorySerializer(source='current_story', read_only=True)
+    current_story_data = serializers.SerializerMethodField()
     participants_count = serializers.SerializerMethodField()
+    # Cards of the configured ESTIMATION_DECK; the only ones a vote may use
+    deck = serializers.SerializerMethodField()
 
     class Meta:
         model = Room
-        fields = ['code', 'session_name', 'created_at', 'updated_at', 'current_story', 'current_story_data', 'participants', 'stories', 'participants_count']
-        read_only_fields = ['code', 'created_at', 'updated_at']
+        fields = ['code', 'session_name', 'created_at', 'updated_at', 'current_story', 'current_story_data', 'participants', 'stories', 'participants_count', 'deck', 'version']
+        read_only_fields = ['code', 'created_at', 'updated_at', 'version']
+        list_serializer_class = RoomListSerializer
+
+    # Everything the nested serializers read, one query per lookup however big the room
+    PREFETCH = (
+        'participants',
+        # Meta.ordering doesn't apply to aggregating querysets, so it's repeated here
+        Prefetch('stories', queryset=Story.objects.annotate(votes_total=Count('votes')).order_by('order', 'created_at')),
+        Prefetch('stories__votes', queryset=Vote.objects.select_related('participant')),
+    )
+
+    @classmethod
+    def prefetch(cls, rooms):
+        """Load what serializing ``rooms`` needs up front, in a constant number of queries"""
+        prefetch_related_objects(rooms, *cls.PREFETCH)
+        return rooms
+
+    def to_representation(self, instance):
+        # One presence lookup per room, shared with the nested participants;
+        # RoomListSerializer has already looked up every listed room
+        connected_ids_by_room = self.context.get('connected_ids_by_room')
+        if connected_ids_by_room is not None:
+            self.context['connected_ids'] = connected_ids_by_room.get(instance.code)
+        else:
+            self.context['connected_ids'] = presence.connected_ids(instance.code)
+        return super().to_representation(instance)
+
+    def get_current_story_data(self, obj):
+        if obj.current_story_id is None:
+            return None
+        story = None
+        if _is_prefetched(obj, 'stories'):
+            # The same story among the prefetched ones, votes and all
+            story = next((s for s in obj.stories.all() if s.id == obj.current_story_id), None)
+        if story is None:
+            story = obj.current_story
+        return StorySerializer(story, context=self.context).data
 
     def get_participants_count(self, obj):
+        connected_ids = self.context.get('connected_ids')
+        if connected_ids is not None:
+            return len(connected_ids)
+        if _is_prefetched(obj, 'participants'):
+            return sum(1 for participant in obj.participants.all() if participant.connected)
         return obj.participants.filter(connected=True).count()
 
+    def get_deck(self, obj):
+        return list(get_deck().cards)
+
+
+def _is_prefetched(instance, relation):
+    return relation in getattr(instance, '_prefetched_objects_cache', {})
+
 
 class CreateRoomSerializer(serializers.Serializer):
     story_id = serializers.CharField(required=False, allow_blank=True)
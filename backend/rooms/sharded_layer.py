@@ -0,0 +1,85 @@
+"""
+Channel layer sharded over several Redis nodes with a consistent hash ring
+
+``RedisChannelLayer`` already spreads keys over its ``hosts``, but with
+``crc32 % len(hosts)``-style buckets: adding or removing a node moves almost
+every room's group to another node. This layer places keys on a ketama ring
+instead (``HashRing``), so a node change only moves the rooms that land on
+the arcs it gained or lost:
+
+- a room group (``room_<code>``) lives on the node its name hashes to, so
+  every group_add/group_discard/group_send for a room hits one Redis
+- a specific channel's queue lives on the node its process prefix hashes to,
+  because each process receives on a single node for all of its channels;
+  a room's members on one worker therefore share one queue node
+
+Nodes are identified by their address rather than their position in
+``hosts``, so reordering the list moves nothing. After changing the hosts,
+``manage.py rebalance_channel_layer`` moves existing group memberships onto
+their new nodes.
+"""
+import bisect
+import hashlib
+
+from .redis_logger import LoggingRedisChannelLayer
+
+# Points per node on the ring; ketama's usual 40 md5 digests x 4 points
+RING_POINTS_PER_NODE = 160
+
+
+def host_address(host):
+    """Stable name of a decoded channels_redis host, used to place it on the ring"""
+    if 'address' in host:
+        return host['address']
+    return f"redis://{host.get('host', 'localhost')}:{host.get('port', 6379)}/{host.get('db', 0)}"
+
+
+def _ring_hash(value):
+    if isinstance(value, str):
+        value = value.encode('utf8')
+    return int.from_bytes(hashlib.md5(value).digest()[:4], 'little')
+
+
+class HashRing:
+    """Ketama-style consistent hash ring mapping keys to node indexes"""
+
+    def __init__(self, nodes, points_per_node=RING_POINTS_PER_NODE):
+        self.nodes = list(nodes)
+        points = []
+        for index, node in enumerate(self.nodes):
+            for replica in range(points_per_node // 4):
+                digest = hashlib.md5(f'{node}-{replica}'.encode('utf8')).digest()
+                for offset in range(0, 16, 4):
+                    points.append((int.from_bytes(digest[offset:offset + 4], 'little'), index))
+        points.sort()
+        self._hashes = [point for point, _ in points]
+        self._indexes = [index for _, index in points]
+
+    def index_for(self, key):
+        """Index in ``nodes`` of the node that owns ``key``"""
+        if len(self.nodes) == 1:
+            return 0
+        position = bisect.bisect(self._hashes, _ring_hash(key))
+        return self._indexes[position % len(self._indexes)]
+
+    def node_for(self, key):
+        return self.nodes[self.index_for(key)]
+
+
+class ShardedRedisChannelLayer(LoggingRedisChannelLayer):
+    """``LoggingRedisChannelLayer`` whose hosts are placed on a consistent hash ring"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ring = HashRing([host_address(host) for host in self.hosts])
+
+    def consistent_hash(self, value):
+        # A process receives all of its channels from one node, so specific
+        # channels are placed by their process prefix ("specific.<id>!")
+        if '!' in value:
+            value = self.non_local_name(value)
+        return self.ring.index_for(value)
+
+    def group_node(self, group):
+        """Address of the node that stores ``group``'s membership"""
+        return self.ring.node_for(group)
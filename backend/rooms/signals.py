@@ -1,153 +1,194 @@
 import logging
-import json
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.signals import connection_created
 from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
 from django.dispatch import receiver
-from .models import Room, Participant, Story, Vote
+from .middleware import time_query
+from .models import Room, Participant, Story, Vote, votes_cleared
 
 # Set up logger
 db_logger = logging.getLogger('rooms.database')
 
 
-@receiver(pre_save, sender=Room)
+def log_receiver(signal, **kwargs):
+    """``@receiver`` for the per-row text logging below, a no-op when DB_SIGNAL_LOGGING is off
+
+    Domain events are kept in the event journal (rooms.journal) either way.
+    """
+    if getattr(settings, 'DB_SIGNAL_LOGGING', True):
+        return receiver(signal, **kwargs)
+    return lambda func: func
+
+
+def _related(instance, field, attr):
+    """``attr`` of an already loaded related object, else its id, so logging never queries"""
+    related_field = instance._meta.get_field(field)
+    if related_field.is_cached(instance):
+        related = getattr(instance, field)
+        return getattr(related, attr) if related else "Unknown"
+    return getattr(instance, related_field.attname) or "Unknown"
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    """Count and time every query run on the new connection"""
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+SQLITE_SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply SQLITE_WAL (so reads don't wait for the writer) and SQLITE_SYNCHRONOUS to SQLite connections"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        if getattr(settings, 'SQLITE_WAL', False):
+            cursor.execute('PRAGMA journal_mode=WAL')
+        synchronous = getattr(settings, 'SQLITE_SYNCHRONOUS', None)
+        if synchronous:
+            if synchronous.upper() not in SQLITE_SYNCHRONOUS_MODES:
+                raise ImproperlyConfigured(f"SQLITE_SYNCHRONOUS must be one of {', '.join(SQLITE_SYNCHRONOUS_MODES)}")
+            cursor.execute(f'PRAGMA synchronous={synchronous.upper()}')
+
+
+@log_receiver(pre_save, sender=Room)
 def room_pre_save(sender, instance, **kwargs):
     """Log before room is saved"""
     if instance.pk:
-        db_logger.info(f"DB PRE_SAVE - Updating Room {instance.code}")
+        db_logger.info("DB PRE_SAVE - Updating Room %s", instance.code)
     else:
-        db_logger.info(f"DB PRE_SAVE - Creating new Room")
+        db_logger.info("DB PRE_SAVE - Creating new Room")
 
 
-@receiver(post_save, sender=Room)
+@log_receiver(post_save, sender=Room)
 def room_post_save(sender, instance, created, **kwargs):
     """Log after room is saved"""
     if created:
-        db_logger.info(f"DB POST_SAVE - Room created: {instance.code} (ID: {instance.id})")
-        db_logger.debug(f"DB POST_SAVE - Room data: code={instance.code}, created_at={instance.created_at}")
+        db_logger.info("DB POST_SAVE - Room created: %s (ID: %s)", instance.code, instance.id)
+        db_logger.debug("DB POST_SAVE - Room data: code=%s, created_at=%s", instance.code, instance.created_at)
     else:
-        db_logger.info(f"DB POST_SAVE - Room updated: {instance.code} (ID: {instance.id})")
-        db_logger.debug(f"DB POST_SAVE - Room data: current_story={instance.current_story}")
+        db_logger.info("DB POST_SAVE - Room updated: %s (ID: %s)", instance.code, instance.id)
+        db_logger.debug("DB POST_SAVE - Room data: current_story=%s", instance.current_story_id)
 
 
-@receiver(pre_delete, sender=Room)
+@log_receiver(pre_delete, sender=Room)
 def room_pre_delete(sender, instance, **kwargs):
     """Log before room is deleted"""
-    db_logger.info(f"DB PRE_DELETE - Deleting Room {instance.code} (ID: {instance.id})")
+    db_logger.info("DB PRE_DELETE - Deleting Room %s (ID: %s)", instance.code, instance.id)
 
 
-@receiver(post_delete, sender=Room)
+@log_receiver(post_delete, sender=Room)
 def room_post_delete(sender, instance, **kwargs):
     """Log after room is deleted"""
-    db_logger.info(f"DB POST_DELETE - Room deleted: {instance.code}")
+    db_logger.info("DB POST_DELETE - Room deleted: %s", instance.code)
 
 
-@receiver(pre_save, sender=Participant)
+@log_receiver(pre_save, sender=Participant)
 def participant_pre_save(sender, instance, **kwargs):
     """Log before participant is saved"""
-    room_code = instance.room.code if instance.room else "Unknown"
+    room_code = _related(instance, 'room', 'code')
     if instance.pk:
-        db_logger.info(f"DB PRE_SAVE - Updating Participant {instance.username} in room {room_code}")
+        db_logger.info("DB PRE_SAVE - Updating Participant %s in room %s", instance.username, room_code)
     else:
-        db_logger.info(f"DB PRE_SAVE - Creating new Participant {instance.username} in room {room_code}")
+        db_logger.info("DB PRE_SAVE - Creating new Participant %s in room %s", instance.username, room_code)
 
 
-@receiver(post_save, sender=Participant)
+@log_receiver(post_save, sender=Participant)
 def participant_post_save(sender, instance, created, **kwargs):
     """Log after participant is saved"""
-    room_code = instance.room.code if instance.room else "Unknown"
+    room_code = _related(instance, 'room', 'code')
     if created:
-        db_logger.info(f"DB POST_SAVE - Participant created: {instance.username} in room {room_code} (ID: {instance.id})")
-        db_logger.debug(f"DB POST_SAVE - Participant data: username={instance.username}, connected={instance.connected}, session_id={instance.session_id}")
+        db_logger.info("DB POST_SAVE - Participant created: %s in room %s (ID: %s)", instance.username, room_code, instance.id)
+        db_logger.debug("DB POST_SAVE - Participant data: username=%s, connected=%s, session_id=%s", instance.username, instance.connected, instance.session_id)
     else:
-        db_logger.info(f"DB POST_SAVE - Participant updated: {instance.username} in room {room_code} (ID: {instance.id})")
-        db_logger.debug(f"DB POST_SAVE - Participant data: connected={instance.connected}, joined_at={instance.joined_at}")
+        db_logger.info("DB POST_SAVE - Participant updated: %s in room %s (ID: %s)", instance.username, room_code, instance.id)
+        db_logger.debug("DB POST_SAVE - Participant data: connected=%s, joined_at=%s", instance.connected, instance.joined_at)
 
 
-@receiver(pre_delete, sender=Participant)
+@log_receiver(pre_delete, sender=Participant)
 def participant_pre_delete(sender, instance, **kwargs):
     """Log before participant is deleted"""
-    room_code = instance.room.code if instance.room else "Unknown"
-    db_logger.info(f"DB PRE_DELETE - Deleting Participant {instance.username} from room {room_code} (ID: {instance.id})")
+    room_code = _related(instance, 'room', 'code')
+    db_logger.info("DB PRE_DELETE - Deleting Participant %s from room %s (ID: %s)", instance.username, room_code, instance.id)
 
 
-@receiver(post_delete, sender=Participant)
+@log_receiver(post_delete, sender=Participant)
 def participant_post_delete(sender, instance, **kwargs):
     """Log after participant is deleted"""
-    db_logger.info(f"DB POST_DELETE - Participant deleted: {instance.username}")
+    db_logger.info("DB POST_DELETE - Participant deleted: %s", instance.username)
 
 
-@receiver(pre_save, sender=Story)
+@log_receiver(pre_save, sender=Story)
 def story_pre_save(sender, instance, **kwargs):
     """Log before story is saved"""
-    room_code = instance.room.code if instance.room else "Unknown"
+    room_code = _related(instance, 'room', 'code')
     if instance.pk:
-        db_logger.info(f"DB PRE_SAVE - Updating Story {instance.story_id} in room {room_code}")
+        db_logger.info("DB PRE_SAVE - Updating Story %s in room %s", instance.story_id, room_code)
     else:
-        db_logger.info(f"DB PRE_SAVE - Creating new Story {instance.story_id} in room {room_code}")
+        db_logger.info("DB PRE_SAVE - Creating new Story %s in room %s", instance.story_id, room_code)
 
 
-@receiver(post_save, sender=Story)
+@log_receiver(post_save, sender=Story)
 def story_post_save(sender, instance, created, **kwargs):
     """Log after story is saved"""
-    room_code = instance.room.code if instance.room else "Unknown"
+    room_code = _related(instance, 'room', 'code')
     if created:
-        db_logger.info(f"DB POST_SAVE - Story created: '{instance.story_id}' in room {room_code} (ID: {instance.id})")
-        db_logger.debug(f"DB POST_SAVE - Story data: story_id={instance.story_id}, title={instance.title}, order={instance.order}")
+        db_logger.info("DB POST_SAVE - Story created: '%s' in room %s (ID: %s)", instance.story_id, room_code, instance.id)
+        db_logger.debug("DB POST_SAVE - Story data: story_id=%s, title=%s, order=%s", instance.story_id, instance.title, instance.order)
     else:
-        db_logger.info(f"DB POST_SAVE - Story updated: '{instance.story_id}' in room {room_code} (ID: {instance.id})")
-        db_logger.debug(f"DB POST_SAVE - Story data: final_points={instance.final_points}, estimated_at={instance.estimated_at}")
+        db_logger.info("DB POST_SAVE - Story updated: '%s' in room %s (ID: %s)", instance.story_id, room_code, instance.id)
+        db_logger.debug("DB POST_SAVE - Story data: final_points=%s, estimated_at=%s", instance.final_points, instance.estimated_at)
 
 
-@receiver(pre_delete, sender=Story)
+@log_receiver(pre_delete, sender=Story)
 def story_pre_delete(sender, instance, **kwargs):
     """Log before story is deleted"""
-    room_code = instance.room.code if instance.room else "Unknown"
-    db_logger.info(f"DB PRE_DELETE - Deleting Story '{instance.story_id}' from room {room_code} (ID: {instance.id})")
+    room_code = _related(instance, 'room', 'code')
+    db_logger.info("DB PRE_DELETE - Deleting Story '%s' from room %s (ID: %s)", instance.story_id, room_code, instance.id)
 
 
-@receiver(post_delete, sender=Story)
+@log_receiver(post_delete, sender=Story)
 def story_post_delete(sender, instance, **kwargs):
     """Log after story is deleted"""
-    db_logger.info(f"DB POST_DELETE - Story deleted: '{instance.story_id}'")
+    db_logger.info("DB POST_DELETE - Story deleted: '%s'", instance.story_id)
 
 
-@receiver(pre_save, sender=Vote)
+@log_receiver(pre_save, sender=Vote)
 def vote_pre_save(sender, instance, **kwargs):
     """Log before vote is saved"""
-    room_code = instance.room.code if instance.room else "Unknown"
-    participant_name = instance.participant.username if instance.participant else "Unknown"
-    story_id = instance.story.story_id if instance.story else "Unknown"
+    room_code = _related(instance, 'room', 'code')
+    participant_name = _related(instance, 'participant', 'username')
+    story_id = _related(instance, 'story', 'story_id')
     
     if instance.pk:
-        db_logger.info(f"DB PRE_SAVE - Updating Vote by {participant_name} for story '{story_id}' in room {room_code}")
+        db_logger.info("DB PRE_SAVE - Updating Vote by %s for story '%s' in room %s", participant_name, story_id, room_code)
     else:
-        db_logger.info(f"DB PRE_SAVE - Creating new Vote by {participant_name} for story '{story_id}' in room {room_code}")
+        db_logger.info("DB PRE_SAVE - Creating new Vote by %s for story '%s' in room %s", participant_name, story_id, room_code)
 
 
-@receiver(post_save, sender=Vote)
+@log_receiver(post_save, sender=Vote)
 def vote_post_save(sender, instance, created, **kwargs):
     """Log after vote is saved"""
-    room_code = instance.room.code if instance.room else "Unknown"
-    participant_name = instance.participant.username if instance.participant else "Unknown"
-    story_id = instance.story.story_id if instance.story else "Unknown"
+    room_code = _related(instance, 'room', 'code')
+    participant_name = _related(instance, 'participant', 'username')
+    story_id = _related(instance, 'story', 'story_id')
     
     if created:
-        db_logger.info(f"DB POST_SAVE - Vote created: {participant_name} voted '{instance.value}' for story '{story_id}' in room {room_code} (ID: {instance.id})")
-        db_logger.debug(f"DB POST_SAVE - Vote data: value={instance.value}, revealed={instance.revealed}, created_at={instance.created_at}")
+        db_logger.info("DB POST_SAVE - Vote created: %s voted '%s' for story '%s' in room %s (ID: %s)", participant_name, instance.value, story_id, room_code, instance.id)
+        db_logger.debug("DB POST_SAVE - Vote data: value=%s, revealed=%s, created_at=%s", instance.value, instance.revealed, instance.created_at)
     else:
-        db_logger.info(f"DB POST_SAVE - Vote updated: {participant_name}'s vote for story '{story_id}' in room {room_code} (ID: {instance.id})")
-        db_logger.debug(f"DB POST_SAVE - Vote data: value={instance.value}, revealed={instance.revealed}")
-
-
-@receiver(pre_delete, sender=Vote)
-def vote_pre_delete(sender, instance, **kwargs):
-    """Log before vote is deleted"""
-    room_code = instance.room.code if instance.room else "Unknown"
-    participant_name = instance.participant.username if instance.participant else "Unknown"
-    story_id = instance.story.story_id if instance.story else "Unknown"
-    db_logger.info(f"DB PRE_DELETE - Deleting Vote by {participant_name} for story '{story_id}' in room {room_code} (ID: {instance.id})")
+        db_logger.info("DB POST_SAVE - Vote updated: %s's vote for story '%s' in room %s (ID: %s)", participant_name, story_id, room_code, instance.id)
+        db_logger.debug("DB POST_SAVE - Vote data: value=%s, revealed=%s", instance.value, instance.revealed)
 
 
-@receiver(post_delete, sender=Vote)
-def vote_post_delete(sender, instance, **kwargs):
-    """Log after vote is deleted"""
-    db_logger.info(f"DB POST_DELETE - Vote deleted: ID {instance.pk}")
\ No newline at end of file
+# Vote has no pre_delete/post_delete receivers on purpose: any receiver makes
+# Django load and signal every row of a bulk delete. Bulk deletions are
+# logged once per set through votes_cleared instead.
+@receiver(votes_cleared)
+def votes_cleared_log(sender, room_id, story_id, count, reason, **kwargs):
+    """Log a bulk vote deletion"""
+    db_logger.info("DB BULK_DELETE - %s votes cleared for story %s in room %s (%s)", count, story_id, room_id, reason)
@@ -0,0 +1,107 @@
+"""
+Shared cache of serialized room snapshots keyed by room version
+
+Every mutation of a room bumps ``Room.version`` (WebSocket commands and the
+REST actions alike), so a snapshot serialized at a given version stays valid
+until the next bump. Snapshots are cached in Redis under
+``snapshot:<room code>:<version>`` for ``ROOM_SNAPSHOT_CACHE_TTL`` seconds:
+the first reader after a change serializes the room, and every other
+consumer, worker and REST request at that version gets the cached copy.
+
+Presence expiring without a disconnect doesn't bump the version, so the TTL
+also bounds how long a cached snapshot can show a vanished participant.
+"""
+import json
+import logging
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+from .redis_client import get_client, use_local_state
+from .serializers import RoomSerializer
+
+redis_logger = logging.getLogger('rooms.redis')
+
+
+def _key(room_code, version):
+    return f'snapshot:{room_code}:{version}'
+
+
+class RedisSnapshotBackend:
+    def get(self, room_code, version):
+        return get_client().get(_key(room_code, version))
+
+    def set(self, room_code, version, raw, ttl):
+        get_client().set(_key(room_code, version), raw, ex=ttl)
+
+
+class LocalSnapshotBackend:
+    def __init__(self):
+        # Only the newest version of a room is ever read again
+        self.rooms = {}
+        self._lock = threading.Lock()
+
+    def get(self, room_code, version):
+        with self._lock:
+            cached = self.rooms.get(room_code)
+        if cached and cached[0] == version and cached[1] > time.monotonic():
+            return cached[2]
+        return None
+
+    def set(self, room_code, version, raw, ttl):
+        with self._lock:
+            cached = self.rooms.get(room_code)
+            if cached is None or cached[0] <= version:
+                self.rooms[room_code] = (version, time.monotonic() + ttl, raw)
+
+
+class SnapshotCache:
+    def __init__(self):
+        self._backend = None
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'ROOM_SNAPSHOT_CACHE_TTL', 30)
+
+    @property
+    def backend(self):
+        local = use_local_state()
+        if self._backend is None or isinstance(self._backend, LocalSnapshotBackend) != local:
+            self._backend = LocalSnapshotBackend() if local else RedisSnapshotBackend()
+        return self._backend
+
+    def get(self, room_code, version):
+        """The cached snapshot of a room at ``version``, or None"""
+        if self.ttl <= 0:
+            return None
+        try:
+            raw = self.backend.get(room_code, version)
+        except redis.RedisError as e:
+            redis_logger.error("REDIS SNAPSHOT - Failed to read snapshot %s of room %s: %s", version, room_code, e)
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, room_code, data):
+        if self.ttl <= 0:
+            return
+        try:
+            self.backend.set(room_code, data['version'], json.dumps(data), self.ttl)
+        except redis.RedisError as e:
+            redis_logger.error("REDIS SNAPSHOT - Failed to cache snapshot %s of room %s: %s", data['version'], room_code, e)
+
+
+# Process-wide snapshot cache
+snapshot_cache = SnapshotCache()
+
+
+def room_snapshot(room):
+    """Serialized room data, from the cache when this version was already serialized"""
+    data = snapshot_cache.get(room.code, room.version)
+    if data is None:
+        RoomSerializer.prefetch([room])
+        # Round trip through JSON so UUIDs and datetimes are plain strings
+        data = json.loads(json.dumps(RoomSerializer(room).data, default=str))
+        snapshot_cache.set(room.code, data)
+    return data
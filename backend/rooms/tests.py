@@ -1,3 +1,1573 @@
-from django.test import TestCase
+import asyncio
+import json
+import logging
+import os
+import queue
+import random
+import statistics
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import DatabaseError, connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import broadcast
+from .coalescing import VoteCoalescer
+from .commands import COMMANDS, CommandError, Field, compile_schema
+from .consumers import RoomConsumer
+from .db_executor import RoomExecutorPool, room_database_sync_to_async
+from .engine import MAX_FLUSH_ATTEMPTS, LiveRoom, LiveRoomStore, room_engine
+from .estimation import DECKS, FIBONACCI, T_SHIRT, median, summarize_votes, upper_quartile
+from .hybrid_layer import GROUP_KEY, HybridChannelLayer
+from .journal import EventJournal, read_journal, replay_events
+from .log_queue import DeferredQueueHandler, LazyJson, LogWriter
+from .limits import Rate, RateLimiter, frame_too_large, json_too_deep, value_too_deep
+from .metrics import Registry, command_errors, command_latency, command_summary, merge_snapshots, render_prometheus
+from .models import Room, Participant, Story, Vote, votes_cleared
+from .outbox import RESYNC_CLOSE_CODE, Outbox
+from .presence import Presence, presence
+from .redis_health import redis_probe
+from .redis_logger import LoggingRedisChannelLayer
+from .replay import ReplayBuffer, replay_buffer
+from .routing import websocket_urlpatterns
+from .serializers import RoomSerializer
+from .sharded_layer import HashRing, ShardedRedisChannelLayer
+from .snapshots import room_snapshot
+from .wire import SUBPROTOCOL_MSGPACK, decode_binary, encode_binary
+from .write_queue import WriteQueue
+
+
+# WebSocket tests run the consumers for real, against in-process state and an
+# in-memory channel layer instead of Redis
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    ROOM_STATE_BACKEND='local', CONSUMER_DB_THREADS=0, VOTE_COALESCE_WINDOW_MS=0, ROOM_SNAPSHOT_CACHE_TTL=0,
+)
+class RoomSocketTestCase(TransactionTestCase):
+    def setUp(self):
+        self.room = Room.objects.create()
+        self.story = Story.objects.create(room=self.room, story_id='A-1', title='Login page')
+        self.room.current_story = self.story
+        self.room.save()
+        self.alice = Participant.objects.create(room=self.room, username='alice', session_id='alice')
+        self.bob = Participant.objects.create(room=self.room, username='bob', session_id='bob')
+
+    async def open(self, subprotocols=None):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/room/{self.room.code}/', subprotocols=subprotocols)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def join(self, participant, **fields):
+        """Open a socket as ``participant`` and read up to its catch-up frame"""
+        communicator = await self.open()
+        await self.send(communicator, type='user_joined', username=participant.username,
+                        participant_id=str(participant.id), **fields)
+        catch_up = await self.receive(communicator)
+        return communicator, catch_up
+
+    async def send(self, communicator, **message):
+        await communicator.send_to(text_data=json.dumps(message))
+
+    async def receive(self, communicator):
+        return json.loads(await communicator.receive_from(timeout=3))
+
+    async def vote(self, communicator, participant, value):
+        await self.send(communicator, type='vote', participant_id=str(participant.id), story_id=str(self.story.id), value=value)
+
+
+class VersionedPatchTests(RoomSocketTestCase):
+    async def test_every_mutation_broadcasts_the_next_version(self):
+        alice, snapshot = await self.join(self.alice)
+        self.assertEqual(snapshot['type'], 'snapshot')
+        self.assertEqual((await self.receive(alice))['version'], snapshot['version'])
+
+        await self.vote(alice, self.alice, '5')
+        await self.send(alice, type='reveal')
+        await self.send(alice, type='confirm_points', points='5')
+        await self.send(alice, type='reset')
+        await self.send(alice, type='add_story', story_id='A-2', title='Logout')
+        frames = [await self.receive(alice) for _ in range(5)]
+
+        self.assertEqual([frame['version'] for frame in frames], list(range(snapshot['version'] + 1, snapshot['version'] + 6)))
+        self.assertEqual([frame['patch']['op'] for frame in frames],
+                         ['votes', 'votes_revealed', 'points_confirmed', 'votes_reset', 'story_added'])
+        await alice.disconnect()
+
+    async def test_other_members_get_the_same_patches(self):
+        alice, _ = await self.join(self.alice)
+        await self.receive(alice)
+        bob, _ = await self.join(self.bob)
+        await self.receive(bob)
+        await self.receive(alice)
+
+        await self.vote(bob, self.bob, '8')
+        for communicator in (alice, bob):
+            frame = await self.receive(communicator)
+            self.assertEqual(frame['patch'], {'op': 'votes', 'story': str(self.story.id), 'participants': [str(self.bob.id)]})
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_values_stay_hidden_until_reveal(self):
+        alice, _ = await self.join(self.alice)
+        await self.receive(alice)
+
+        await self.vote(alice, self.alice, '13')
+        cast = await self.receive(alice)
+        self.assertEqual(cast['patch'], {'op': 'votes', 'story': str(self.story.id), 'participants': [str(self.alice.id)]})
+        await self.send(alice, type='reveal')
+        revealed = await self.receive(alice)
+        self.assertEqual([vote['value'] for vote in revealed['patch']['votes']], ['13'])
+        await alice.disconnect()
+
+
+class BroadcastFanOutTests(RoomSocketTestCase):
+    async def test_broadcast_is_encoded_once_for_every_member(self):
+        alice, _ = await self.join(self.alice)
+        await self.receive(alice)
+        bob, _ = await self.join(self.bob)
+        await self.receive(bob)
+        await self.receive(alice)
+
+        with mock.patch.object(broadcast, 'encode_frame', wraps=broadcast.encode_frame) as encode_frame:
+            await self.send(alice, type='reveal')
+            frames = [await alice.receive_from(timeout=3), await bob.receive_from(timeout=3)]
+
+        self.assertEqual(encode_frame.call_count, 1)
+        self.assertEqual(frames[0], frames[1])
+        self.assertEqual(json.loads(frames[0])['type'], 'votes_revealed')
+        await alice.disconnect()
+        await bob.disconnect()
+
+
+@override_settings(VOTE_COALESCE_WINDOW_MS=1000)
+class VoteCoalescingTests(TestCase):
+    def setUp(self):
+        self.coalescer = VoteCoalescer()
+        self.sent = []
+        patcher = mock.patch('rooms.coalescing.send_room_frame', side_effect=self.send_room_frame)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def send_room_frame(self, channel_layer, group, room_code, message):
+        self.sent.append(message)
+
+    def votes(self, *votes):
+        async def cast():
+            for story_id, participant_id, version in votes:
+                await self.coalescer.add_vote(None, 'room_ROOM1', 'ROOM1', story_id, participant_id, version)
+            await self.coalescer.flush('ROOM1')
+        async_to_sync(cast)()
+        return [(m['base_version'], m['version'], m['patch']['participants']) for m in self.sent]
+
+    def test_burst_goes_out_as_one_frame(self):
+        frames = self.votes(('s1', 'p1', 3), ('s1', 'p2', 4), ('s1', 'p1', 5))
+        self.assertEqual(frames, [(3, 5, ['p1', 'p2'])])
+
+    def test_version_made_elsewhere_splits_the_window(self):
+        # Version 5 came from another worker, so it can't be claimed by this window
+        frames = self.votes(('s1', 'p1', 3), ('s1', 'p2', 4), ('s1', 'p3', 6))
+        self.assertEqual(frames, [(3, 4, ['p1', 'p2']), (6, 6, ['p3'])])
+
+    def test_vote_for_another_story_splits_the_window(self):
+        frames = self.votes(('s1', 'p1', 3), ('s2', 'p1', 4))
+        self.assertEqual(frames, [(3, 3, ['p1']), (4, 4, ['p1'])])
+
+
+class CommandSchemaTests(TestCase):
+    validate = staticmethod(compile_schema({
+        'story_id': Field(str, required=True, max_length=5),
+        'points': Field((str, int)),
+        'value': Field(str, choices=['1', '2']),
+    }))
+
+    def assertInvalid(self, data, message):
+        with self.assertRaisesMessage(CommandError, message):
+            self.validate(data)
+
+    def test_valid_payloads_pass(self):
+        self.validate({'story_id': 'A-1'})
+        self.validate({'story_id': 'A-1', 'points': 5, 'value': '2', 'extra': [1]})
+
+    def test_invalid_payloads_are_rejected(self):
+        self.assertInvalid({}, "'story_id' is required")
+        self.assertInvalid({'story_id': 5}, "'story_id' has the wrong type")
+        self.assertInvalid({'story_id': 'A-1', 'points': True}, "'points' has the wrong type")
+        self.assertInvalid({'story_id': 'A-12345'}, "'story_id' is longer than 5 characters")
+        self.assertInvalid({'story_id': 'A-1', 'value': '3'}, "'value' is not an allowed value")
+
+    @override_settings(ESTIMATION_DECK='t_shirt')
+    def test_vote_command_and_model_accept_the_configured_deck(self):
+        validate = COMMANDS['vote'].validate
+        vote = {'participant_id': 'p1', 'story_id': 's1'}
+        validate({**vote, 'value': 'XL'})
+        with self.assertRaises(CommandError):
+            validate({**vote, 'value': '13'})
+
+        value = Vote._meta.get_field('value')
+        self.assertEqual([card for card, _ in value.choices], list(DECKS['t_shirt'].cards))
+        value.clean('XL', None)
+        with self.assertRaises(ValidationError):
+            value.clean('13', None)
+
+    def test_every_command_has_a_consumer_handler(self):
+        for command in COMMANDS.values():
+            with self.subTest(command=command.type):
+                self.assertTrue(callable(getattr(RoomConsumer, command.handler, None)))
+
+
+class CommandDispatchTests(RoomSocketTestCase):
+    async def test_invalid_command_gets_an_error_and_touches_nothing(self):
+        alice, _ = await self.join(self.alice)
+        await self.receive(alice)
+        errors = command_errors.value(type='vote', reason='invalid')
+
+        await self.send(alice, type='vote', participant_id=str(self.alice.id), story_id=str(self.story.id), value='4')
+
+        self.assertEqual(await self.receive(alice), {'type': 'error', 'command': 'vote', 'message': "'value' is not an allowed value"})
+        self.assertEqual(command_errors.value(type='vote', reason='invalid'), errors + 1)
+        self.assertFalse(await Vote.objects.aexists())
+        await alice.disconnect()
+
+    async def test_unknown_type_is_ignored(self):
+        alice, _ = await self.join(self.alice)
+        await self.receive(alice)
+
+        await self.send(alice, type='drop_tables')
+        self.assertTrue(await alice.receive_nothing(timeout=0.2))
+        await alice.disconnect()
+
+    async def test_handled_commands_are_timed(self):
+        alice, _ = await self.join(self.alice)
+        await self.receive(alice)
+        series = command_latency.series.get((('type', 'reset'),))
+        before = series['count'] if series else 0
+
+        await self.send(alice, type='reset')
+        await self.receive(alice)
+
+        self.assertEqual(command_latency.series[(('type', 'reset'),)]['count'], before + 1)
+        await alice.disconnect()
+
+    async def test_participant_from_another_room_is_rejected(self):
+        stranger = await Participant.objects.acreate(room=await Room.objects.acreate(), username='eve', session_id='eve')
+        alice, _ = await self.join(self.alice)
+        await self.receive(alice)
+
+        await self.send(alice, type='user_left', participant_id=str(stranger.id))
+        self.assertEqual(await self.receive(alice), {'type': 'error', 'command': 'user_left', 'message': 'Participant is not in this room'})
+
+        eve = await self.open()
+        await self.send(eve, type='user_joined', username='eve', participant_id=str(stranger.id))
+        self.assertEqual((await self.receive(eve))['type'], 'error')
+        await eve.disconnect()
+        self.assertTrue(await alice.receive_nothing(timeout=0.2))
+        await alice.disconnect()
+
+    async def test_story_from_another_room_is_rejected(self):
+        alice, _ = await self.join(self.alice)
+        await self.receive(alice)
+        other = await Story.objects.acreate(room=await Room.objects.acreate(), story_id='B-1')
+
+        for command, story_id in (('change_story', str(other.id)), ('switch_to_existing_story', 'not-a-uuid')):
+            await self.send(alice, type=command, story_id=story_id)
+            self.assertEqual(await self.receive(alice), {'type': 'error', 'command': command, 'message': 'Story is not in this room'})
+
+        await self.room.arefresh_from_db()
+        self.assertEqual(self.room.current_story_id, self.story.id)
+        await alice.disconnect()
+
+
+class WireProtocolTests(TestCase):
+    def test_ids_and_timestamps_are_packed_by_key(self):
+        story_id = str(uuid.uuid4())
+        message = {'type': 'points_confirmed', 'version': 3, 'patch': {
+            'op': 'points_confirmed', 'story': story_id, 'final_points': '5', 'estimated_at': '2024-01-01T10:00:00.123456Z',
+        }}
+
+        frame = encode_binary(message)
+        packed = msgpack.unpackb(frame, raw=False)['p']
+
+        self.assertEqual(packed['s'], uuid.UUID(story_id).bytes)
+        self.assertIsInstance(packed['ea'], msgpack.ExtType)
+        self.assertEqual(decode_binary(frame), message)
+
+    def test_user_text_that_looks_like_an_id_or_timestamp_is_untouched(self):
+        lookalikes = ['2024-01-01T10:00:00.000Z', '2024-01-01T10:00:00+02:00', str(uuid.uuid4())]
+        for text in lookalikes:
+            with self.subTest(text=text):
+                message = {'type': 'story_added', 'patch': {'op': 'story_added', 'story': {
+                    'id': str(uuid.uuid4()), 'story_id': text, 'title': text, 'created_at': '2024-01-01T10:00:00Z',
+                }}, 'username': text}
+                self.assertEqual(decode_binary(encode_binary(message)), message)
+
+
+class BinaryBroadcastTests(RoomSocketTestCase):
+    async def test_binary_frame_is_only_encoded_for_msgpack_members(self):
+        alice, _ = await self.join(self.alice)
+        await self.receive(alice)
+
+        with mock.patch.object(broadcast, 'encode_binary', wraps=broadcast.encode_binary) as encode_binary:
+            await self.send(alice, type='reveal')
+            await self.receive(alice)
+            self.assertEqual(encode_binary.call_count, 0)
+
+            bob = await self.open(subprotocols=[SUBPROTOCOL_MSGPACK])
+            await self.send(alice, type='reset')
+            text = await alice.receive_from(timeout=3)
+            frame = (await bob.receive_output(timeout=3))['bytes']
+
+        self.assertEqual(encode_binary.call_count, 1)
+        self.assertEqual(decode_binary(frame), json.loads(text))
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_malformed_frames_are_dropped(self):
+        alice = await self.open(subprotocols=[SUBPROTOCOL_MSGPACK])
+        frames = [
+            msgpack.packb({'type': 'reset'}) + b'\x01',  # extra data
+            b'\xc1',  # reserved format byte
+            b'\x91' * 2000 + b'\x01',  # deeper than the unpacker's stack
+            msgpack.packb({'ca': msgpack.ExtType(1, b'\x00')}),  # short timestamp
+            msgpack.packb({'ca': msgpack.ExtType(1, struct.pack('>q', 2 ** 62))}),  # timestamp out of range
+        ]
+        for frame in frames:
+            with self.subTest(frame=frame[:8]):
+                await alice.send_to(bytes_data=frame)
+                self.assertTrue(await alice.receive_nothing(timeout=0.1))
+
+        # The socket is still usable
+        await alice.send_to(bytes_data=encode_binary({'type': 'reset'}))
+        self.assertEqual(decode_binary((await alice.receive_output(timeout=3))['bytes'])['type'], 'room_reset')
+        await alice.disconnect()
+
+
+class RestBroadcastTests(RoomSocketTestCase):
+    """REST actions reach connected clients like the socket commands do"""
+
+    async def post(self, action, **data):
+        response = await self.async_client.post(f'/api/rooms/{self.room.code}/{action}/', data)
+        self.assertLess(response.status_code, 300)
+        return response
+
+    async def test_rest_actions_are_broadcast_in_version_order(self):
+        alice, _ = await self.join(self.alice)
+        await self.receive(alice)
+        await self.vote(alice, self.alice, '5')
+        version = (await self.receive(alice))['version']
+
+        await self.post('reveal')
+        revealed = await self.receive(alice)
+        self.assertEqual(revealed['type'], 'votes_revealed')
+        self.assertEqual([vote['value'] for vote in revealed['patch']['votes']], ['5'])
+        self.assertEqual(revealed['patch']['final_points'], '5')
+
+        await self.post('confirm_points', points='8')
+        confirmed = await self.receive(alice)
+        self.assertEqual((confirmed['type'], confirmed['patch']['final_points']), ('points_confirmed', '8'))
+
+        await self.post('reset')
+        reset = await self.receive(alice)
+        self.assertEqual(reset['patch'], {'op': 'votes_reset', 'story': str(self.story.id)})
+
+        self.assertEqual([frame['version'] for frame in (revealed, confirmed, reset)], [version + 1, version + 2, version + 3])
+        await alice.disconnect()
+
+    async def test_rest_story_and_join_patches_match_the_snapshot(self):
+        alice, _ = await self.join(self.alice)
+        await self.receive(alice)
+
+        await self.post('add_story', story_id='A-2', title='Logout')
+        added = await self.receive(alice)
+        self.assertEqual(added['patch']['story']['story_id'], 'A-2')
+        self.assertFalse(added['patch']['current'])
+
+        await self.post('join', username='carol', session_id='carol')
+        joined = await self.receive(alice)
+        self.assertEqual(joined['type'], 'user_joined')
+        self.assertEqual(joined['patch']['participant']['username'], 'carol')
+        # Not connected until carol's socket joins
+        self.assertFalse(joined['patch']['connected'])
+        await alice.disconnect()
+
+    async def test_rest_broadcasts_are_recorded_for_replay(self):
+        alice, _ = await self.join(self.alice)
+        version = (await self.receive(alice))['version']
+
+        await self.post('reset')
+        text = await alice.receive_from(timeout=3)
+        entries = replay_buffer.since(self.room.code, version)
+        self.assertEqual([entry['text'] for entry in entries], [text])
+        await alice.disconnect()
+
+
+class LimitTests(TestCase):
+    def test_json_depth_ignores_brackets_inside_strings(self):
+        self.assertFalse(json_too_deep('{"a": [1, {"b": "[[[{{{"}]}', 3))
+        self.assertTrue(json_too_deep('{"a": [1, {"b": [2]}]}', 3))
+        self.assertFalse(json_too_deep('{"a": "\\"[[[["}', 1))
+
+    def test_frame_size_counts_utf8_bytes(self):
+        self.assertFalse(frame_too_large('x' * 16, 16))
+        self.assertTrue(frame_too_large('é' * 9, 16))
+        self.assertTrue(frame_too_large(b'x' * 17, 16))
+
+    def test_value_depth(self):
+        self.assertFalse(value_too_deep({'a': [1, {'b': 'c'}]}, 3))
+        self.assertTrue(value_too_deep({'a': [1, {'b': [2]}]}, 3))
+
+    def test_bucket_allows_a_burst_then_refills_at_the_rate(self):
+        rate = Rate(per_second=2, burst=3)
+        with mock.patch('rooms.limits.time.monotonic', return_value=100.0) as clock:
+            limiter = RateLimiter()
+            self.assertEqual([limiter.allow('k', rate) for _ in range(4)], [True, True, True, False])
+            clock.return_value = 100.5
+            self.assertEqual([limiter.allow('k', rate) for _ in range(2)], [True, False])
+            # Refilled buckets are pruned; a new one starts full, so nothing changes
+            clock.return_value = 200.0
+            limiter.allow('other', rate)
+            self.assertEqual(set(limiter.buckets), {'other'})
+
+
+@override_settings(WS_MAX_FRAME_BYTES=256, WS_MAX_JSON_DEPTH=3)
+class AbuseLimitTests(RoomSocketTestCase):
+    async def assertRejected(self, communicator, message):
+        error = await self.receive(communicator)
+        self.assertEqual(error['type'], 'error')
+        self.assertIn(message, error['message'])
+
+    async def test_oversized_and_deep_frames_are_rejected_unparsed(self):
+        communicator = await self.open()
+        await self.send(communicator, type='sync', padding='x' * 300)
+        await self.assertRejected(communicator, 'larger than 256 bytes')
+        await self.send(communicator, type='sync', nested=[[[1]]])
+        await self.assertRejected(communicator, 'deeper than 3 levels')
+        await communicator.disconnect()
+
+    async def test_deep_msgpack_frames_are_rejected(self):
+        communicator = await self.open(subprotocols=[SUBPROTOCOL_MSGPACK])
+        await communicator.send_to(bytes_data=msgpack.packb({'type': 'sync', 'nested': [[[1]]]}))
+        error = decode_binary((await communicator.receive_output(timeout=3))['bytes'])
+        self.assertEqual(error['type'], 'error')
+        await communicator.disconnect()
+
+    async def test_commands_beyond_the_connection_burst_are_rejected(self):
+        communicator = await self.open()
+        # Heartbeats burst to 3 per connection; without a participant they send nothing
+        for _ in range(4):
+            await self.send(communicator, type='heartbeat')
+        error = await self.receive(communicator)
+        self.assertEqual((error['command'], error['message']), ('heartbeat', 'Too many requests, slow down'))
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+
+class ShardedLayerTests(TestCase):
+    NODES = [f'redis://redis-{i}:6379/0' for i in range(4)]
+    ROOMS = [f'room_{i:06}' for i in range(2000)]
+
+    def placement(self, nodes):
+        ring = HashRing(nodes)
+        return {room: ring.node_for(room) for room in self.ROOMS}
+
+    def test_rooms_spread_over_every_node(self):
+        counts = {node: 0 for node in self.NODES}
+        for node in self.placement(self.NODES).values():
+            counts[node] += 1
+        self.assertTrue(all(count > len(self.ROOMS) / 8 for count in counts.values()), counts)
+
+    def test_node_order_does_not_move_rooms(self):
+        self.assertEqual(self.placement(self.NODES), self.placement(list(reversed(self.NODES))))
+
+    def test_adding_a_node_only_moves_rooms_onto_it(self):
+        before = self.placement(self.NODES)
+        after = self.placement(self.NODES + ['redis://redis-4:6379/0'])
+        moved = [room for room in self.ROOMS if before[room] != after[room]]
+        self.assertTrue(all(after[room] == 'redis://redis-4:6379/0' for room in moved))
+        # About a fifth of the rooms, nowhere near crc32 % n's four fifths
+        self.assertLess(len(moved), len(self.ROOMS) / 3)
+
+    def test_a_process_channels_share_one_node(self):
+        layer = ShardedRedisChannelLayer(hosts=self.NODES)
+        prefixes = [f'specific.{uuid.uuid4().hex}!' for _ in range(20)]
+        for prefix in prefixes:
+            self.assertEqual(layer.consistent_hash(prefix + 'a'), layer.consistent_hash(prefix + 'b'))
+        self.assertGreater(len({layer.consistent_hash(prefix) for prefix in prefixes}), 1)
+        self.assertEqual(layer.group_node('room_ABC123'), self.NODES[layer.consistent_hash('room_ABC123')])
+
+
+class HybridLayerTests(TestCase):
+    """Group fan-out of the hybrid layer, with Redis replaced by mocks"""
+
+    def run_layer(self, scenario, remote_members=()):
+        layer = HybridChannelLayer(hosts=['redis://redis-0:6379/0'])
+        connection = mock.Mock(zrangebyscore=mock.AsyncMock(return_value=[m.encode() for m in remote_members]))
+        with mock.patch('channels_redis.core.RedisChannelLayer.group_add', mock.AsyncMock()), \
+                mock.patch('channels_redis.core.RedisChannelLayer.group_discard', mock.AsyncMock()), \
+                mock.patch.object(layer, 'connection', return_value=connection), \
+                mock.patch.object(layer, 'send', mock.AsyncMock()) as send:
+            async def run():
+                result = await scenario(layer)
+                if layer._relay_task:
+                    layer._relay_task.cancel()
+                return result
+
+            return async_to_sync(run)(), send
+
+    def test_local_members_get_the_message_in_memory(self):
+        async def scenario(layer):
+            alice, bob = await layer.new_channel(), await layer.new_channel()
+            await layer.group_add('room_ABC123', alice)
+            await layer.group_add('room_ABC123', bob)
+            await layer.group_send('room_ABC123', {'type': 'room.frame', 'text': '{}'})
+            return [await layer.receive(alice), await layer.receive(bob)]
+
+        received, send = self.run_layer(scenario)
+        self.assertEqual(received, [{'type': 'room.frame', 'text': '{}'}] * 2)
+        send.assert_not_called()
+
+    def test_other_workers_get_one_relayed_message_each(self):
+        async def scenario(layer):
+            alice = await layer.new_channel()
+            await layer.group_add('room_ABC123', alice)
+            await layer.group_send('room_ABC123', {'type': 'room.frame', 'text': '{}'})
+            await layer.group_discard('room_ABC123', alice)
+            return layer.local_groups
+
+        remote = ['specific.other!relay', 'specific.plain!abc']
+        local_groups, send = self.run_layer(scenario, remote_members=remote)
+        self.assertEqual(send.await_args_list, [
+            mock.call('specific.other!relay', {'type': 'room.frame', 'text': '{}', GROUP_KEY: 'room_ABC123'}),
+            mock.call('specific.plain!abc', {'type': 'room.frame', 'text': '{}'}),
+        ])
+        self.assertEqual(local_groups, {})
+
+
+class QueueLoggingTests(TestCase):
+    class Capture(logging.Handler):
+        def __init__(self, level=logging.NOTSET):
+            super().__init__(level)
+            self.messages = []
+
+        def emit(self, record):
+            self.messages.append(self.format(record))
+
+    def setUp(self):
+        self.queue = queue.SimpleQueue()
+        self.info, self.errors = self.Capture(), self.Capture(logging.ERROR)
+        self.logger = logging.getLogger(f'rooms.tests.{uuid.uuid4().hex}')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(DeferredQueueHandler(self.queue, [self.info, self.errors]))
+
+    def test_records_are_queued_unformatted(self):
+        payload = mock.Mock(__str__=mock.Mock(return_value='payload'))
+        self.logger.info("sent %s", payload)
+        targets, record = self.queue.get_nowait()
+        self.assertEqual(targets, [self.info, self.errors])
+        self.assertIs(record.args[0], payload)
+        payload.__str__.assert_not_called()
+        self.assertEqual(self.info.messages, [])
+
+    def test_writer_formats_records_for_each_handler_level(self):
+        writer = LogWriter(self.queue)
+        writer.start()
+        self.logger.debug("payload %s", LazyJson({'id': uuid.UUID(int=1)}))
+        self.logger.error("failed after %.1fms", 2.5)
+        writer.stop()
+        self.assertEqual(self.info.messages, [
+            'payload {"id": "00000000-0000-0000-0000-000000000001"}', 'failed after 2.5ms'])
+        self.assertEqual(self.errors.messages, ['failed after 2.5ms'])
+
+
+class ChannelLayerLoggingTests(TestCase):
+    def test_failed_operation_is_logged_with_its_target(self):
+        layer = LoggingRedisChannelLayer(hosts=['redis://redis-0:6379/0'])
+        failure = mock.AsyncMock(side_effect=ConnectionError('refused'))
+        with mock.patch('channels_redis.core.RedisChannelLayer.group_add', failure), \
+                self.assertLogs('rooms.redis', 'ERROR') as logs, self.assertRaises(ConnectionError):
+            async_to_sync(layer.group_add)('room_ABC123', 'specific.abc!1')
+        self.assertRegex(logs.records[0].getMessage(),
+                         r'^REDIS GROUP_ADD ERROR - Group: room_ABC123, Channel: specific\.abc!1, Error: refused, Duration: [\d.]+ms$')
+
+
+class OutboxTests(TestCase):
+    """Outbox behaviour with a socket that only sends when the test lets it"""
+
+    def run_outbox(self, scenario, fail_snapshot=False):
+        sent, closed = [], []
+
+        async def run():
+            can_send = asyncio.Event()
+
+            async def send_frame(frame):
+                await can_send.wait()
+                sent.append(frame)
+
+            async def snapshot_frame():
+                if fail_snapshot:
+                    raise ValueError('room is gone')
+                return 'snapshot'
+
+            async def close(code):
+                closed.append(code)
+
+            outbox = Outbox(send_frame, snapshot_frame, close, max_frames=2)
+            outbox.start()
+            await scenario(outbox, can_send)
+            for _ in range(5):
+                await asyncio.sleep(0)
+            await outbox.stop()
+
+        async_to_sync(run)()
+        return sent, closed
+
+    def test_frames_go_out_in_order(self):
+        async def scenario(outbox, can_send):
+            outbox.put('a')
+            outbox.put('b')
+            can_send.set()
+
+        self.assertEqual(self.run_outbox(scenario), (['a', 'b'], []))
+
+    def test_overflow_replaces_the_queue_with_a_snapshot(self):
+        async def scenario(outbox, can_send):
+            outbox.put('a')
+            await asyncio.sleep(0)
+            # 'a' is stuck in the socket; 'b' and 'c' fill the queue
+            for frame in 'bcd':
+                outbox.put(frame)
+            can_send.set()
+
+        self.assertEqual(self.run_outbox(scenario), (['a', 'snapshot'], []))
+
+    def test_overflow_while_resyncing_closes_the_connection(self):
+        async def scenario(outbox, can_send):
+            outbox.put('a')
+            await asyncio.sleep(0)
+            for frame in 'bcdef':
+                outbox.put(frame)
+
+        sent, closed = self.run_outbox(scenario)
+        self.assertEqual(closed, [RESYNC_CLOSE_CODE])
+
+    def test_writer_failure_closes_the_connection(self):
+        async def scenario(outbox, can_send):
+            can_send.set()
+            for frame in 'abc':
+                outbox.put(frame)
+            await asyncio.sleep(0)
+            outbox.put('d')
+            await asyncio.sleep(0)
+            self.assertTrue(outbox.closed)
+            outbox.put('e')
+
+        sent, closed = self.run_outbox(scenario, fail_snapshot=True)
+        self.assertEqual(closed, [RESYNC_CLOSE_CODE])
+        self.assertNotIn('e', sent)
+
+
+class CatchUpTests(TestCase):
+    """Replay or snapshot for a client that missed frames, into a three frame outbox"""
+
+    def catch_up(self, missed):
+        consumer = RoomConsumer()
+        consumer.room_code = 'ROOM'
+        consumer.binary = False
+        consumer.outbox = Outbox(None, None, None, max_frames=3)
+        entries = [{'text': f'v{version}'} for version in range(1, missed + 1)]
+        with mock.patch('rooms.consumers.replay_buffer.asince', mock.AsyncMock(return_value=entries)), \
+                mock.patch.object(consumer, 'send_snapshot', mock.AsyncMock()) as send_snapshot:
+            async_to_sync(consumer.send_catch_up)(0)
+        return list(consumer.outbox.frames)[1:], send_snapshot.await_count
+
+    def test_replay_that_fills_the_outbox_is_sent(self):
+        self.assertEqual(self.catch_up(2), (['v1', 'v2'], 0))
+
+    def test_replay_too_long_for_the_outbox_becomes_a_snapshot(self):
+        self.assertEqual(self.catch_up(3), ([], 1))
+
+
+@override_settings(ROOM_STATE_BACKEND='local', PRESENCE_TTL=60)
+class PresenceTests(TestCase):
+    def setUp(self):
+        self.presence = Presence()
+        self.now = 1000.0
+        clock = mock.patch('rooms.presence.time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def test_connect_reports_only_new_presence(self):
+        self.assertTrue(self.presence.connect('ROOM', 'alice'))
+        self.assertFalse(self.presence.connect('ROOM', 'alice'))
+        self.assertEqual(self.presence.connected_ids('ROOM'), {'alice'})
+
+    def test_presence_expires_without_a_heartbeat(self):
+        self.presence.connect('ROOM', 'alice')
+        self.presence.connect('ROOM', 'bob')
+        self.now += 45
+        self.assertTrue(self.presence.heartbeat('ROOM', 'alice'))
+        self.now += 30
+        self.assertEqual(self.presence.connected_ids('ROOM'), {'alice'})
+        self.assertFalse(self.presence.heartbeat('ROOM', 'bob'))
+
+    def test_disconnect_reports_whether_the_participant_was_present(self):
+        self.presence.connect('ROOM', 'alice')
+        self.assertTrue(self.presence.disconnect('ROOM', 'alice'))
+        self.assertFalse(self.presence.disconnect('ROOM', 'alice'))
+        self.assertEqual(self.presence.connected_ids('ROOM'), set())
+
+    def test_flush_writes_the_latest_change_per_participant(self):
+        room = Room.objects.create()
+        alice = Participant.objects.create(room=room, username='alice', session_id='alice', connected=False)
+        bob = Participant.objects.create(room=room, username='bob', session_id='bob', connected=True)
+        self.presence.connect(room.code, alice.id)
+        self.presence.connect(room.code, bob.id)
+        self.presence.disconnect(room.code, bob.id)
+
+        with self.assertNumQueries(2):
+            self.presence.flush()
+        alice.refresh_from_db()
+        bob.refresh_from_db()
+        self.assertTrue(alice.connected)
+        self.assertFalse(bob.connected)
+        self.assertEqual(self.presence.pending, {})
+
+
+class FakeSortedSets:
+    """Just enough of a Redis client (and its pipelines) for the presence sorted sets"""
+
+    def __init__(self):
+        self.sets = {}
+        self.replies = []
+
+    def pipeline(self):
+        self.replies = []
+        return self
+
+    def execute(self):
+        return self.replies
+
+    def zremrangebyscore(self, key, low, high):
+        members = self.sets.get(key, {})
+        expired = [member for member, score in members.items() if score <= high]
+        for member in expired:
+            del members[member]
+        self.replies.append(len(expired))
+
+    def zadd(self, key, mapping, xx=False, ch=False):
+        members = self.sets.setdefault(key, {})
+        changed = 0
+        for member, score in mapping.items():
+            if member in members:
+                changed += ch and members[member] != score
+            elif not xx:
+                changed += 1
+            if member in members or not xx:
+                members[member] = score
+        self.replies.append(changed)
+
+    def expire(self, key, seconds):
+        self.replies.append(True)
+
+    def zrange(self, key, start, end):
+        self.replies.append([member.encode() for member in self.sets.get(key, {})])
+
+
+@override_settings(ROOM_STATE_BACKEND='redis', PRESENCE_TTL=60)
+class RedisPresenceTests(TestCase):
+    def setUp(self):
+        self.presence = Presence()
+        self.now = 1000.0
+        for patcher in (
+            mock.patch('rooms.presence.time.time', side_effect=lambda: self.now),
+            mock.patch('rooms.presence.get_client', return_value=FakeSortedSets()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_reconnect_after_expiry_counts_as_new_presence(self):
+        self.assertTrue(self.presence.connect('ROOM', 'alice'))
+        self.now += 61
+        self.assertTrue(self.presence.connect('ROOM', 'alice'))
+        self.now += 61
+        self.assertFalse(self.presence.heartbeat('ROOM', 'alice'))
+        self.presence.connect('ROOM', 'alice')
+        self.now += 1
+        self.assertTrue(self.presence.heartbeat('ROOM', 'alice'))
+        self.assertEqual(self.presence.connected_ids('ROOM'), {'alice'})
+
+
+@override_settings(ROOM_STATE_BACKEND='local', REPLAY_BUFFER_SIZE=8)
+class ReplayBufferTests(TestCase):
+    def setUp(self):
+        self.buffer = ReplayBuffer()
+
+    def record(self, version, base_version=None):
+        message = {'version': version, 'base_version': base_version or version}
+        self.buffer.record('ROOM', message, {'text': f'v{version}'})
+
+    def replayed(self, last_version):
+        entries = self.buffer.since('ROOM', last_version)
+        return None if entries is None else [entry['text'] for entry in entries]
+
+    def test_replays_the_missed_versions(self):
+        for version in range(1, 5):
+            self.record(version)
+        self.assertEqual(self.replayed(2), ['v3', 'v4'])
+        self.assertEqual(self.replayed(4), [])
+
+    def test_client_ahead_of_the_buffer_gets_a_snapshot(self):
+        for version in range(1, 5):
+            self.record(version)
+        self.assertIsNone(self.replayed(7))
+
+    def test_coalesced_entry_covers_its_versions(self):
+        self.record(1)
+        self.record(4, base_version=2)
+        self.assertEqual(self.replayed(1), ['v4'])
+
+    def test_out_of_order_entries_replay_in_version_order(self):
+        for version in (1, 3, 2, 4):
+            self.record(version)
+        self.assertEqual(self.replayed(1), ['v2', 'v3', 'v4'])
+
+    def test_gap_falls_back_to_a_snapshot(self):
+        for version in (1, 2, 4, 5):
+            self.record(version)
+        self.assertIsNone(self.replayed(1))
+        self.assertEqual(self.replayed(3), ['v4', 'v5'])
+
+    def test_trimmed_buffer_falls_back_to_a_snapshot(self):
+        for version in range(1, 11):
+            self.record(version)
+        self.assertIsNone(self.replayed(1))
+        self.assertEqual(self.replayed(2), [f'v{version}' for version in range(3, 11)])
+        self.assertIsNone(ReplayBuffer().since('EMPTY', 0))
+
+
+class RoomExecutorPoolTests(TestCase):
+    def setUp(self):
+        self.pool = RoomExecutorPool()
+        self.addCleanup(lambda: [executor.shutdown() for executor in self.pool.executors])
+
+    @override_settings(CONSUMER_DB_THREADS=0)
+    def test_disabled_pool_has_no_executor(self):
+        self.assertIsNone(self.pool.executor_for('ROOM01'))
+
+    @override_settings(CONSUMER_DB_THREADS=4)
+    def test_a_room_always_maps_to_the_same_executor(self):
+        codes = [f'ROOM{i:02}' for i in range(40)]
+        executors = [self.pool.executor_for(code) for code in codes]
+        self.assertEqual(executors, [self.pool.executor_for(code) for code in codes])
+        self.assertEqual(len(set(executors)), 4)
+
+    def test_resizing_replaces_the_executors(self):
+        with self.settings(CONSUMER_DB_THREADS=2):
+            self.pool.executor_for('ROOM01')
+            old = list(self.pool.executors)
+        with self.settings(CONSUMER_DB_THREADS=3):
+            self.pool.executor_for('ROOM01')
+        self.assertEqual(len(self.pool.executors), 3)
+        self.assertTrue(all(executor._shutdown for executor in old))
+
+    @override_settings(CONSUMER_DB_THREADS=4)
+    def test_room_work_runs_in_order_on_the_room_thread(self):
+        class Consumer:
+            def __init__(self, room_code):
+                self.room_code = room_code
+                self.calls = []
+
+            @room_database_sync_to_async
+            def work(self, n):
+                time.sleep(random.random() / 100)
+                self.calls.append((n, threading.current_thread().name))
+
+        consumer = Consumer('ROOM01')
+
+        async def run():
+            await asyncio.gather(*(consumer.work(n) for n in range(10)))
+
+        async_to_sync(run)()
+        self.assertEqual([n for n, _ in consumer.calls], list(range(10)))
+        self.assertEqual({name for _, name in consumer.calls}, {consumer.calls[0][1]})
+        self.assertTrue(consumer.calls[0][1].startswith('room-db-'))
+
+
+# Consumer DB work must run on the test's thread to see its transaction
+class RoomFixtureMixin:
+    """A room with a current story, and a consumer bound to it for calling its store methods"""
+
+    def setUp(self):
+        super().setUp()
+        self.room = Room.objects.create()
+        self.story = Story.objects.create(room=self.room, story_id='A-1', title='Login page')
+        self.room.current_story = self.story
+        self.room.save()
+        self.consumer = RoomConsumer()
+        self.consumer.room_code = self.room.code
+
+    def add_votes(self, values):
+        """Have a new participant cast each of ``values`` on the current story"""
+        participants = []
+        for i, value in enumerate(values, start=Participant.objects.count()):
+            participant = Participant.objects.create(room=self.room, username=f'user{i}', session_id=f'user{i}')
+            Vote.objects.create(room=self.room, participant=participant, story=self.story, value=value)
+            participants.append(participant)
+        return participants
+
+
+@override_settings(CONSUMER_DB_THREADS=0)
+class VotePersistenceTests(RoomFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.participant = Participant.objects.create(room=self.room, username='alice', session_id='alice')
+
+    def save_vote(self, participant_id, story_id, value):
+        return async_to_sync(self.consumer.save_vote)(participant_id, story_id, value)
+
+    def test_first_vote_is_one_upsert_plus_version_bump(self):
+        # Upsert, then UPDATE + SELECT for the version; the test transaction
+        # turns the atomic block into SAVEPOINT/RELEASE
+        with self.assertNumQueries(5):
+            version = self.save_vote(self.participant.id, self.story.id, '5')
+
+        vote = Vote.objects.get()
+        self.assertEqual((vote.participant_id, vote.story_id, vote.room_id), (self.participant.id, self.story.id, self.room.id))
+        self.assertEqual(vote.value, '5')
+        self.assertEqual(version, 1)
+
+    def test_changing_a_vote_updates_the_same_row(self):
+        self.save_vote(self.participant.id, self.story.id, '5')
+        vote_id = Vote.objects.get().id
+
+        with self.assertNumQueries(5):
+            version = self.save_vote(self.participant.id, self.story.id, '8')
+
+        vote = Vote.objects.get()
+        self.assertEqual((vote.id, vote.value), (vote_id, '8'))
+        self.assertEqual(version, 2)
+
+    def test_changing_a_revealed_vote_keeps_it_revealed(self):
+        self.save_vote(self.participant.id, self.story.id, '5')
+        async_to_sync(self.consumer.reveal_votes)()
+        self.save_vote(self.participant.id, self.story.id, '8')
+
+        vote = Vote.objects.get()
+        self.assertEqual((vote.value, vote.revealed), ('8', True))
+
+    def test_participant_from_another_room_is_rejected(self):
+        other_room = Room.objects.create()
+        outsider = Participant.objects.create(room=other_room, username='mallory', session_id='mallory')
+
+        with self.assertRaises(CommandError):
+            self.save_vote(outsider.id, self.story.id, '5')
+
+        self.assertFalse(Vote.objects.exists())
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.version, 0)
+
+    def test_story_from_another_room_is_rejected(self):
+        other_story = Story.objects.create(room=Room.objects.create(), story_id='B-1')
+
+        with self.assertRaises(CommandError):
+            self.save_vote(self.participant.id, other_story.id, '5')
+        self.assertFalse(Vote.objects.exists())
+
+    def test_malformed_ids_are_rejected(self):
+        with self.assertRaises(CommandError):
+            self.save_vote('not-a-uuid', self.story.id, '5')
+
+
+@override_settings(CONSUMER_DB_THREADS=0)
+class RevealQueryTests(RoomFixtureMixin, TestCase):
+    def reveal(self):
+        return async_to_sync(self.consumer.reveal_votes)()
+
+    def test_query_count_does_not_grow_with_voters(self):
+        # Room, UPDATE revealed, version bump (UPDATE + SELECT) inside a
+        # savepoint, then one joined SELECT for the votes and voters
+        self.add_votes(['1', '2', '21'])
+        with self.assertNumQueries(7):
+            self.reveal()
+
+        self.add_votes(['1', '3', '5', '8', '13', '21', '?', 'coffee', '2', '1', '13', '8'])
+        with self.assertNumQueries(7):
+            self.reveal()
+
+    def test_wide_spread_summary_comes_from_the_revealed_votes(self):
+        self.add_votes(['1', '2', '21', '?'])
+
+        result = self.reveal()
+
+        self.assertEqual(len(result['votes']), 4)
+        self.assertTrue(all(vote['revealed'] for vote in result['votes']))
+        calculation = result['calculation']
+        self.assertEqual(calculation['average'], 8)
+        self.assertEqual(calculation['rounded'], 21)
+        discussion = calculation['discussion_message']
+        self.assertEqual((discussion['min_voter'], discussion['max_voter']), ('user0', 'user2'))
+        self.assertEqual(discussion['spread_level'], 'high')
+
+    def test_rest_reveal_reads_the_votes_once(self):
+        self.add_votes(['1', '2', '21', '?'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'/api/rooms/{self.room.code}/reveal/')
+
+        # The snapshot in the response reads the room's votes separately, by story
+        vote_reads = [q['sql'] for q in queries if q['sql'].startswith('SELECT') and 'FROM "rooms_vote"' in q['sql']
+                      and '"rooms_vote"."room_id" =' in q['sql']]
+        self.assertEqual(len(vote_reads), 1, vote_reads)
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.final_points, '21')
+        story = next(s for s in response.data['stories'] if s['id'] == str(self.story.id))
+        self.assertTrue(all(vote['revealed'] for vote in story['votes']))
+
+
+@override_settings(CONSUMER_DB_THREADS=0)
+class ResetQueryTests(RoomFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.story.final_points = '8'
+        self.story.save()
+
+    def reset(self):
+        return async_to_sync(self.consumer.reset_votes)()
+
+    def test_query_count_does_not_grow_with_voters(self):
+        # Room, then one DELETE, one UPDATE of the story and the version bump
+        # (UPDATE + SELECT), each write inside savepoints
+        self.add_votes(['1', '2', '21'])
+        with self.assertNumQueries(7):
+            self.reset()
+
+        self.add_votes(['1', '3', '5', '8', '13', '21', '?', 'coffee', '2', '1', '13', '8'])
+        with self.assertNumQueries(7):
+            self.reset()
+
+    def test_one_votes_cleared_event_per_reset(self):
+        self.add_votes(['1', '2', '21'])
+        events = []
+        votes_cleared.connect(lambda **kwargs: events.append(kwargs), weak=False, dispatch_uid='test-reset')
+        try:
+            self.reset()
+        finally:
+            votes_cleared.disconnect(dispatch_uid='test-reset')
+
+        self.assertEqual([(e['story_id'], e['count'], e['reason']) for e in events], [(self.story.id, 3, 'reset')])
+        self.assertFalse(Vote.objects.filter(story=self.story).exists())
+        self.story.refresh_from_db()
+        self.assertIsNone(self.story.final_points)
+
+
+@override_settings(CONSUMER_DB_THREADS=0, ROOM_STATE_BACKEND='local', ROOM_SNAPSHOT_CACHE_TTL=0)
+class RoomEngineTests(RoomFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.participant = Participant.objects.create(room=self.room, username='alice', session_id='alice')
+        self.store = LiveRoomStore(room_engine, self.room.code, consumer=None)
+
+    def tearDown(self):
+        room_engine.rooms.clear()
+        room_engine.pending.clear()
+        room_engine.failed_flushes = 0
+
+    def vote(self, value):
+        return async_to_sync(self.store.save_vote)(str(self.participant.id), str(self.story.id), value)
+
+    def flush(self):
+        async_to_sync(room_engine.flush)()
+
+    def test_writes_are_persisted_on_flush(self):
+        version = self.vote('5')
+        self.assertFalse(Vote.objects.exists())
+
+        self.flush()
+
+        self.assertEqual(Vote.objects.get().value, '5')
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.version, version)
+        self.assertEqual(room_engine.pending, [])
+
+    def test_changing_a_revealed_vote_keeps_it_revealed(self):
+        self.vote('5')
+        async_to_sync(self.store.reveal_votes)()
+        self.vote('8')
+        live = room_engine.rooms[self.room.code].votes[str(self.story.id)].values()
+        self.assertEqual([vote['revealed'] for vote in live], [True])
+
+        self.flush()
+
+        vote = Vote.objects.get()
+        self.assertEqual((vote.value, vote.revealed), ('8', True))
+
+    def test_rest_change_lands_after_the_queued_writes(self):
+        self.vote('5')
+
+        self.client.post(f'/api/rooms/{self.room.code}/reset/')
+        self.flush()
+
+        # The engine's vote was written before the reset cleared it, not after
+        self.assertFalse(Vote.objects.exists())
+        self.assertNotIn(self.room.code, room_engine.rooms)
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.version, 2)
+
+    def test_story_from_another_room_is_rejected(self):
+        other = Story.objects.create(room=Room.objects.create(), story_id='B-1')
+        with self.assertRaisesMessage(CommandError, 'Story is not in this room'):
+            async_to_sync(self.store.change_current_story)(str(other.id))
+        self.assertEqual(room_engine.pending, [])
+
+    def test_unknown_participant_cannot_change_presence(self):
+        for participant_id in ('not-a-uuid', str(uuid.uuid4())):
+            with self.subTest(participant_id=participant_id):
+                with self.assertRaisesMessage(CommandError, 'Participant is not in this room'):
+                    async_to_sync(self.store.mark_user_connected)(participant_id)
+        self.assertEqual(room_engine.pending, [])
+
+    def test_version_never_moves_back(self):
+        self.vote('5')
+        Room.objects.filter(pk=self.room.pk).update(version=10)
+
+        self.flush()
+
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.version, 10)
+
+    def test_failing_batch_is_dropped_after_max_attempts(self):
+        self.vote('5')
+
+        with mock.patch('rooms.engine.apply_writes', side_effect=DatabaseError('disk I/O error')):
+            for attempt in range(MAX_FLUSH_ATTEMPTS):
+                with self.assertRaises(DatabaseError):
+                    self.flush()
+                if attempt < MAX_FLUSH_ATTEMPTS - 1:
+                    self.assertEqual(len(room_engine.pending), 2)
+
+        self.assertEqual(room_engine.pending, [])
+        self.assertNotIn(self.room.code, room_engine.rooms)
+        self.assertFalse(Vote.objects.exists())
+
+    @override_settings(ROOM_ENGINE_IDLE_TIMEOUT=0)
+    def test_idle_room_is_evicted_only_once_its_writes_are_persisted(self):
+        self.vote('5')
+
+        room_engine.evict_idle()
+        self.assertIn(self.room.code, room_engine.rooms)
+
+        self.flush()
+        room_engine.evict_idle()
+        self.assertNotIn(self.room.code, room_engine.rooms)
+
+
+@override_settings(CONSUMER_DB_THREADS=0, ROOM_SNAPSHOT_CACHE_TTL=0)
+class QueryPlanTests(RoomFixtureMixin, TestCase):
+    """Every statement on the hot paths must find its rows through an index, never a table scan"""
+
+    def setUp(self):
+        super().setUp()
+        self.participants = self.add_votes(['5', '5', '5'])
+
+    def assertNoTableScans(self, func, *args):
+        with CaptureQueriesContext(connection) as queries:
+            func(*args)
+        statements = [q['sql'] for q in queries.captured_queries if q['sql'].split(' ', 1)[0] in ('SELECT', 'UPDATE', 'DELETE', 'INSERT')]
+        self.assertTrue(statements)
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = [row[-1] for row in cursor.fetchall()]
+                with self.subTest(sql=sql):
+                    scans = [step for step in plan if step.startswith('SCAN ')]
+                    self.assertEqual(scans, [], plan)
+
+    def test_vote(self):
+        self.assertNoTableScans(
+            async_to_sync(self.consumer.save_vote), str(self.participants[0].id), str(self.story.id), '8')
+
+    def test_reveal(self):
+        self.assertNoTableScans(async_to_sync(self.consumer.reveal_votes))
+
+    def test_reset(self):
+        self.assertNoTableScans(async_to_sync(self.consumer.reset_votes))
+
+    def test_add_story(self):
+        self.assertNoTableScans(async_to_sync(self.consumer.add_story), 'A-1', 'Duplicate')
+        self.assertNoTableScans(async_to_sync(self.consumer.add_story), 'A-2', 'Logout')
+
+    def test_participant_by_username(self):
+        self.assertNoTableScans(async_to_sync(self.consumer.get_participant_by_username), 'user1')
+
+    def test_room_snapshot(self):
+        # Presence is unavailable here, so participants_count falls back to (room, connected)
+        self.assertNoTableScans(async_to_sync(self.consumer.get_room_data))
+
+    def test_rest_reveal_and_reset(self):
+        self.assertNoTableScans(self.client.post, f'/api/rooms/{self.room.code}/reveal/')
+        self.assertNoTableScans(self.client.post, f'/api/rooms/{self.room.code}/reset/')
+
+
+@override_settings(ROOM_SNAPSHOT_CACHE_TTL=0)
+class SnapshotQueryTests(TestCase):
+    def room_with_stories(self, stories):
+        room = Room.objects.create()
+        people = Participant.objects.bulk_create([
+            Participant(room=room, username=f'user{i}', session_id=f'{room.code}-{i}', connected=i % 2 == 0)
+            for i in range(4)
+        ])
+        created = Story.objects.bulk_create([
+            Story(room=room, story_id=f'A-{i}', title=f'Story {i}', order=i) for i in range(stories)
+        ])
+        Vote.objects.bulk_create([Vote(room=room, participant=p, story=s, value='5') for s in created for p in people])
+        room.current_story = created[-1]
+        room.save()
+        return Room.objects.get(pk=room.pk)
+
+    def test_query_count_does_not_grow_with_stories(self):
+        # Participants, stories with their vote counts, and votes with their participants
+        for stories in (5, 500):
+            room = self.room_with_stories(stories)
+            with self.assertNumQueries(3):
+                data = room_snapshot(room)
+            self.assertEqual(len(data['stories']), stories)
+
+    def test_prefetched_snapshot_matches_lazy_serialization(self):
+        room = self.room_with_stories(5)
+        lazy = RoomSerializer(Room.objects.get(pk=room.pk)).data
+        prefetched = RoomSerializer(RoomSerializer.prefetch([room])[0]).data
+        self.assertEqual(prefetched, lazy)
+        self.assertEqual(prefetched['current_story_data'], prefetched['stories'][-1])
+        self.assertEqual(prefetched['stories'][0]['votes_count'], 4)
+        self.assertEqual(prefetched['participants_count'], 2)
+
+    @override_settings(ROOM_STATE_BACKEND='local')
+    def test_room_list_reads_presence_once(self):
+        rooms = [self.room_with_stories(1) for _ in range(3)]
+        participant_id = rooms[0].participants.first().id
+        presence.connect(rooms[0].code, participant_id)
+        self.addCleanup(presence.disconnect, rooms[0].code, participant_id)
+        with mock.patch.object(presence, 'connected_ids') as per_room, \
+                mock.patch.object(presence, 'connected_ids_by_room', wraps=presence.connected_ids_by_room) as by_room:
+            response = self.client.get('/api/rooms/')
+
+        per_room.assert_not_called()
+        by_room.assert_called_once()
+        counts = {room['code']: room['participants_count'] for room in response.data}
+        self.assertEqual([counts[room.code] for room in rooms], [1, 0, 0])
+
+    @override_settings(ESTIMATION_DECK='t_shirt')
+    def test_snapshot_lists_the_configured_deck(self):
+        room = self.room_with_stories(1)
+        cards = list(DECKS['t_shirt'].cards)
+        self.assertEqual(room_snapshot(room)['deck'], cards)
+        self.assertEqual(LiveRoom.load(room.code).snapshot()['deck'], cards)
+
+
+def legacy_fibonacci_estimate(votes):
+    """The consumer's estimate before rooms.estimation, kept as the oracle"""
+    fibonacci_sequence = [1, 2, 3, 5, 8, 13, 21, 34, 55, 89]
+    vote_values = sorted(int(v) for v in votes)
+    min_pos = next((i for i, fib in enumerate(fibonacci_sequence) if fib >= vote_values[0]), 0)
+    max_pos = next((i for i, fib in enumerate(fibonacci_sequence) if fib >= vote_values[-1]), len(fibonacci_sequence) - 1)
+    if max_pos - min_pos > 2:
+        if len(vote_values) == 1:
+            return vote_values[0]
+        target = statistics.quantiles(vote_values, n=4)[2]
+    else:
+        target = statistics.median(vote_values)
+    return next((fib for fib in fibonacci_sequence if target <= fib), fibonacci_sequence[-1])
+
+
+class EstimationPropertyTests(TestCase):
+    ROUNDS = 500
+
+    def setUp(self):
+        self.random = random.Random(1234)
+
+    def random_hand(self, deck, wildcards=True):
+        cards = list(deck.cards) if wildcards else list(deck.values)
+        return [self.random.choice(cards) for _ in range(self.random.randint(1, 12))]
+
+    def test_fibonacci_matches_legacy_estimate(self):
+        for _ in range(self.ROUNDS):
+            hand = self.random_hand(FIBONACCI)
+            numeric = [card for card in hand if card not in ('?', 'coffee')]
+            with self.subTest(hand=hand):
+                expected = legacy_fibonacci_estimate(numeric) if numeric else None
+                self.assertEqual(FIBONACCI.estimate(hand), expected)
+
+    def test_estimate_is_always_on_the_scale(self):
+        for deck in DECKS.values():
+            for _ in range(self.ROUNDS):
+                hand = self.random_hand(deck, wildcards=False)
+                with self.subTest(deck=deck.key, hand=hand):
+                    estimate = deck.estimate(hand)
+                    value = deck.values[estimate] if not deck.numeric else estimate
+                    self.assertIn(value, deck.scale)
+
+    def test_unanimous_vote_on_a_scale_card_is_the_estimate(self):
+        for deck in DECKS.values():
+            for card, value in deck.values.items():
+                if value not in deck.scale:
+                    continue
+                with self.subTest(deck=deck.key, card=card):
+                    estimate = deck.estimate([card] * self.random.randint(1, 8))
+                    self.assertEqual(estimate, value if deck.numeric else card)
+
+    def test_round_up_is_smallest_scale_entry_not_below(self):
+        for deck in DECKS.values():
+            for _ in range(self.ROUNDS):
+                value = self.random.uniform(0, deck.scale[-1] * 1.5)
+                with self.subTest(deck=deck.key, value=value):
+                    above = [entry for entry in deck.scale if entry >= value]
+                    self.assertEqual(deck.round_up(value), above[0] if above else deck.scale[-1])
+
+    def test_median_and_upper_quartile_match_statistics(self):
+        for _ in range(self.ROUNDS):
+            values = sorted(self.random.choice([0, 0.5, 1, 2, 3, 5, 8, 13, 21, 40, 100])
+                            for _ in range(self.random.randint(2, 15)))
+            with self.subTest(values=values):
+                self.assertEqual(median(values), statistics.median(values))
+                self.assertEqual(upper_quartile(values), statistics.quantiles(values, n=4)[2])
+
+    def test_wildcards_only_has_no_summary(self):
+        self.assertIsNone(summarize_votes([('?', 'alice'), ('coffee', 'bob')], deck=FIBONACCI))
+
+    def test_wide_spread_names_lowest_and_highest_voters(self):
+        summary = summarize_votes([('1', 'alice'), ('2', 'bob'), ('21', 'carol'), ('?', 'dave')], deck=FIBONACCI)
+
+        self.assertEqual(summary['average'], 8)
+        self.assertEqual(summary['rounded'], 21)
+        discussion = summary['discussion_message']
+        self.assertEqual((discussion['min_voter'], discussion['max_voter']), ('alice', 'carol'))
+        self.assertEqual((discussion['min_vote'], discussion['max_vote']), (1, 21))
+        self.assertEqual(discussion['spread_level'], 'high')
+
+    def test_close_votes_need_no_discussion(self):
+        summary = summarize_votes([('3', 'alice'), ('5', 'bob')], deck=FIBONACCI)
+        self.assertEqual(summary['rounded'], 5)
+        self.assertIsNone(summary['discussion_message'])
+
+    def test_t_shirt_estimate_is_a_card(self):
+        summary = summarize_votes([('S', 'alice'), ('M', 'bob'), ('M', 'carol')], deck=T_SHIRT)
+        self.assertEqual(summary['rounded'], 'M')
+
+
+class MetricsExpositionTests(TestCase):
+    def worker_snapshot(self, votes, latencies):
+        registry = Registry()
+        messages = registry.counter('ws_messages_received_total', 'Messages')
+        latency = registry.histogram('ws_command_duration_seconds', 'Latency', buckets=(0.01, 0.1))
+        messages.inc(votes, type='vote')
+        for value in latencies:
+            latency.observe(value, type='vote')
+        return registry.snapshot()
+
+    def test_workers_are_summed(self):
+        merged = merge_snapshots({'a:1': self.worker_snapshot(2, [0.005]), 'b:2': self.worker_snapshot(3, [0.05, 1])})
+        text = render_prometheus(merged)
+
+        self.assertIn('# TYPE ws_messages_received_total counter', text)
+        self.assertIn('ws_messages_received_total{type="vote"} 5', text)
+        self.assertIn('ws_command_duration_seconds_bucket{type="vote",le="0.01"} 1', text)
+        self.assertIn('ws_command_duration_seconds_bucket{type="vote",le="0.1"} 2', text)
+        self.assertIn('ws_command_duration_seconds_bucket{type="vote",le="+Inf"} 3', text)
+        self.assertIn('ws_command_duration_seconds_count{type="vote"} 3', text)
+
+    def test_per_worker_keeps_a_worker_label(self):
+        merged = merge_snapshots({'a:1': self.worker_snapshot(2, []), 'b:2': self.worker_snapshot(3, [])}, per_worker=True)
+        text = render_prometheus(merged)
+
+        self.assertIn('ws_messages_received_total{type="vote",worker="a:1"} 2', text)
+        self.assertIn('ws_messages_received_total{type="vote",worker="b:2"} 3', text)
+
+    def test_summary_is_safe_while_commands_are_recorded(self):
+        registry = Registry()
+        latency = registry.histogram('ws_command_duration_seconds', 'Latency')
+        errors = registry.counter('ws_command_errors_total', 'Errors')
+        stop = threading.Event()
+
+        def record():
+            for i in range(2000):
+                if stop.is_set():
+                    return
+                latency.observe(0.001, type=f'command{i}')
+                errors.inc(type=f'command{i}', reason='invalid')
+
+        worker = threading.Thread(target=record)
+        with mock.patch.multiple('rooms.metrics', command_latency=latency, command_errors=errors):
+            worker.start()
+            try:
+                for _ in range(200):
+                    rows = command_summary()
+            finally:
+                stop.set()
+                worker.join()
+
+        self.assertTrue(all(row['count'] == 1 and row['p50_seconds'] == 0.001 for row in rows))
+
+
+class HealthEndpointTests(TestCase):
+    def setUp(self):
+        # The probe is process-wide; whatever a test sets is undone afterwards
+        patcher = mock.patch.object(redis_probe, 'result', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def probe_result(self, healthy, age=0):
+        redis_probe.result = {'healthy': healthy, 'checked_at': time.time() - age, 'duration_ms': 1.0}
+
+    def test_liveness_does_not_depend_on_redis(self):
+        self.probe_result(False)
+        self.assertEqual(self.client.get('/healthz').status_code, 200)
+
+    def test_not_ready_before_the_first_probe(self):
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['status'], 'starting')
+
+    def test_ready_follows_the_latest_probe(self):
+        self.probe_result(True)
+        self.assertEqual(self.client.get('/readyz').status_code, 200)
+        self.probe_result(False)
+        self.assertEqual(self.client.get('/readyz').status_code, 503)
+
+    @override_settings(REDIS_HEALTH_INTERVAL=10)
+    def test_stale_probe_is_not_ready(self):
+        self.probe_result(True, age=31)
+        self.assertEqual(self.client.get('/readyz').status_code, 503)
+
+
+class EventJournalTests(TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'events.journal')
+
+    def write(self, *events):
+        journal = EventJournal()
+        with override_settings(EVENT_JOURNAL_PATH=self.path, EVENT_JOURNAL_FSYNC_INTERVAL=0.01):
+            for event, fields in events:
+                journal.record(event, 'ROOM1', **fields)
+            journal.stop()
+
+    def test_events_read_back_in_order(self):
+        self.write(
+            ('story_added', {'story': 's1', 'story_id': 'A-1', 'title': 'Login', 'current': True, 'cleared_story': None, 'version': 1}),
+            ('vote_cast', {'story': 's1', 'participant': 'p1', 'value': '5', 'version': 2}),
+        )
+        self.write(('vote_cast', {'story': 's1', 'participant': 'p2', 'value': '8', 'version': 3}))
+
+        events = list(read_journal(self.path))
+
+        self.assertEqual([(e['event'], e['version']) for e in events], [('story_added', 1), ('vote_cast', 2), ('vote_cast', 3)])
+        self.assertEqual(events[1]['room'], 'ROOM1')
+
+    def test_torn_last_record_is_skipped(self):
+        self.write(('vote_cast', {'story': 's1', 'participant': 'p1', 'value': '5', 'version': 1}),
+                   ('vote_cast', {'story': 's1', 'participant': 'p2', 'value': '8', 'version': 2}))
+        with open(self.path, 'r+b') as journal_file:
+            journal_file.truncate(os.path.getsize(self.path) - 3)
+
+        self.assertEqual([e['version'] for e in read_journal(self.path)], [1])
+
+    def test_replay_rebuilds_votes_and_points(self):
+        self.write(
+            ('story_added', {'story': 's1', 'story_id': 'A-1', 'title': 'Login', 'current': True, 'cleared_story': None, 'version': 1}),
+            ('vote_cast', {'story': 's1', 'participant': 'p1', 'value': '5', 'version': 2}),
+            ('vote_cast', {'story': 's1', 'participant': 'p2', 'value': '8', 'version': 3}),
+            ('votes_revealed', {'story': 's1', 'votes': {'p1': '5', 'p2': '8'}, 'rounded': 8, 'version': 4}),
+            ('points_confirmed', {'story': 's1', 'points': '8', 'version': 5}),
+            ('story_added', {'story': 's2', 'story_id': 'A-2', 'title': 'Logout', 'current': True, 'cleared_story': 's1', 'version': 6}),
+        )
+
+        room = replay_events(read_journal(self.path))['ROOM1']
+
+        self.assertEqual((room['current_story'], room['version']), ('s2', 6))
+        self.assertEqual(room['stories']['s1']['points'], '8')
+        self.assertEqual(room['stories']['s1']['votes'], {})
+        self.assertEqual(room['stories']['s2']['story_id'], 'A-2')
+
+    def test_replay_follows_current_story_changes(self):
+        self.write(
+            ('story_added', {'story': 's1', 'story_id': 'A-1', 'title': 'Login', 'current': True, 'cleared_story': None, 'version': 1}),
+            ('story_added', {'story': 's2', 'story_id': 'A-2', 'title': 'Logout', 'current': True, 'cleared_story': 's1', 'version': 2}),
+            ('story_changed', {'story': 's1', 'version': 3}),
+        )
+
+        room = replay_events(read_journal(self.path))['ROOM1']
+
+        self.assertEqual((room['current_story'], room['version']), ('s1', 3))
+        self.assertEqual(set(room['stories']), {'s1', 's2'})
+
+
+class SqliteSettingsTests(TestCase):
+    def synchronous(self):
+        """PRAGMA synchronous of a new connection (0 OFF, 1 NORMAL, 2 FULL)"""
+        new_connection = connections.create_connection('default')
+        try:
+            with new_connection.cursor() as cursor:
+                return cursor.execute('PRAGMA synchronous').fetchone()[0]
+        finally:
+            new_connection.close()
+
+    def test_synchronous_is_only_changed_when_configured(self):
+        with self.settings(SQLITE_SYNCHRONOUS=None):
+            self.assertEqual(self.synchronous(), 2)
+        with self.settings(SQLITE_SYNCHRONOUS='normal'):
+            self.assertEqual(self.synchronous(), 1)
+
+    @override_settings(SQLITE_SYNCHRONOUS='NORMAL; DROP TABLE rooms_room')
+    def test_unknown_synchronous_mode_is_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.synchronous()
+
+
+class WriteQueueTests(TestCase):
+    def test_failed_write_does_not_roll_back_its_batch(self):
+        room = Room.objects.create()
+
+        def add_story(story_id):
+            return Story.objects.create(room=room, story_id=story_id).story_id
+
+        def fail():
+            Story.objects.create(room=room, story_id='LOST')
+            raise CommandError('Participant or story is not in this room')
+
+        batch = [(Future(), func, args, {}) for func, args in [(add_story, ('A-1',)), (fail, ()), (add_story, ('A-2',))]]
+        WriteQueue().write_batch(batch)
+
+        self.assertEqual(batch[0][0].result(), 'A-1')
+        self.assertIsInstance(batch[1][0].exception(), CommandError)
+        self.assertEqual(batch[2][0].result(), 'A-2')
+        self.assertEqual(sorted(room.stories.values_list('story_id', flat=True)), ['A-1', 'A-2'])
+
+    @override_settings(ROOM_STATE_BACKEND='local')
+    def test_presence_changes_once_the_batch_commits(self):
+        room = Room.objects.create()
+        participant = Participant.objects.create(room=room, username='alice', session_id='alice')
+        consumer = RoomConsumer()
+        consumer.room_code = room.code
+        self.addCleanup(presence.disconnect, room.code, str(participant.id))
+
+        future = Future()
+        with self.captureOnCommitCallbacks() as callbacks:
+            WriteQueue().write_batch([(future, consumer.set_presence, (str(participant.id), True), {})])
+            self.assertEqual(future.result()['version'], 1)
+            self.assertEqual(presence.connected_ids(room.code), set())
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(presence.connected_ids(room.code), {str(participant.id)})
@@ -1,10 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import RoomViewSet
+from .views import RoomViewSet, command_metrics
 
 router = DefaultRouter()
 router.register(r'rooms', RoomViewSet, basename='room')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('metrics/commands/', command_metrics, name='command-metrics'),
 ]
@@ -1,11 +1,23 @@
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404
+from django.db import transaction
 from django.utils import timezone
 import logging
-import json
-from .models import Room, Participant, Story, Vote
+from .models import Room, Participant, Story, Vote, bump_room_version, clear_story_estimate, clear_votes
+from . import patches
+from .broadcast import publish_room_message
+from .engine import room_engine
+from .journal import journal
+from .log_queue import LazyJson
+from .estimation import summarize_votes
+from .metrics import command_summary, outbox_summary, rejection_summary, render_prometheus
+from .worker_metrics import worker_metrics
+from .presence import presence
+from .redis_health import redis_probe
+from .snapshots import room_snapshot
 from .serializers import (
     RoomSerializer,
     ParticipantSerializer,
@@ -21,357 +33,399 @@ db_logger = logging.getLogger('rooms.database')
 
 
 class RoomViewSet(viewsets.ModelViewSet):
-    queryset = Room.objects.all()
+    queryset = Room.objects.prefetch_related(*RoomSerializer.PREFETCH)
     serializer_class = RoomSerializer
     lookup_field = 'code'
 
     def create(self, request):
         """Create a new room with optional initial story"""
-        api_logger.info(f"API CREATE ROOM - Request received from IP: {request.META.get('REMOTE_ADDR')}")
-        api_logger.debug(f"API CREATE ROOM - Request data: {json.dumps(request.data, default=str)}")
+        api_logger.info("API CREATE ROOM - Request received from IP: %s", request.META.get('REMOTE_ADDR'))
+        api_logger.debug("API CREATE ROOM - Request data: %s", LazyJson(request.data))
         
         from .models import generate_funny_story
         
         try:
             serializer = CreateRoomSerializer(data=request.data)
             serializer.is_valid(raise_exception=True)
-            api_logger.debug(f"API CREATE ROOM - Serializer validation passed: {serializer.validated_data}")
+            api_logger.debug("API CREATE ROOM - Serializer validation passed: %s", serializer.validated_data)
 
             # Database operation: Create room
             db_logger.info("DB CREATE - Creating new Room object")
             room = Room.objects.create()
-            db_logger.info(f"DB CREATE - Room created with code: {room.code}")
+            db_logger.info("DB CREATE - Room created with code: %s", room.code)
 
             # Create initial story if provided, or generate a funny one
             story_id = serializer.validated_data.get('story_id')
             title = serializer.validated_data.get('title')
-            api_logger.debug(f"API CREATE ROOM - Story data: story_id='{story_id}', title='{title}'")
+            api_logger.debug("API CREATE ROOM - Story data: story_id='%s', title='%s'", story_id, title)
 
             if story_id or title:
-                db_logger.info(f"DB CREATE - Creating story with provided data: {story_id}, {title}")
+                db_logger.info("DB CREATE - Creating story with provided data: %s, %s", story_id, title)
                 story = Story.objects.create(
                     room=room,
                     story_id=story_id or '',
                     title=title or '',
                     order=0
                 )
-                db_logger.info(f"DB CREATE - Story created with ID: {story.id}")
+                db_logger.info("DB CREATE - Story created with ID: %s", story.id)
                 room.current_story = story
-                db_logger.info(f"DB UPDATE - Room {room.code} current_story set to {story.id}")
+                db_logger.info("DB UPDATE - Room %s current_story set to %s", room.code, story.id)
                 room.save()
             else:
                 # Generate a funny story as the initial story
                 funny_id, funny_title = generate_funny_story()
-                api_logger.debug(f"API CREATE ROOM - Generated funny story: {funny_id}, {funny_title}")
-                db_logger.info(f"DB CREATE - Creating funny story: {funny_id}, {funny_title}")
+                api_logger.debug("API CREATE ROOM - Generated funny story: %s, %s", funny_id, funny_title)
+                db_logger.info("DB CREATE - Creating funny story: %s, %s", funny_id, funny_title)
                 story = Story.objects.create(
                     room=room,
                     story_id=funny_id,
                     title=funny_title,
                     order=0
                 )
-                db_logger.info(f"DB CREATE - Funny story created with ID: {story.id}")
+                db_logger.info("DB CREATE - Funny story created with ID: %s", story.id)
                 room.current_story = story
-                db_logger.info(f"DB UPDATE - Room {room.code} current_story set to {story.id}")
+                db_logger.info("DB UPDATE - Room %s current_story set to %s", room.code, story.id)
                 room.save()
 
+            RoomSerializer.prefetch([room])
             response_data = RoomSerializer(room).data
-            api_logger.info(f"API CREATE ROOM - Success: Room {room.code} created with story {story.id}")
-            api_logger.debug(f"API CREATE ROOM - Response data: {json.dumps(response_data, default=str)}")
+            api_logger.info("API CREATE ROOM - Success: Room %s created with story %s", room.code, story.id)
+            api_logger.debug("API CREATE ROOM - Response data: %s", LazyJson(response_data))
             return Response(response_data, status=status.HTTP_201_CREATED)
             
         except Exception as e:
-            api_logger.error(f"API CREATE ROOM - Error: {str(e)}")
+            api_logger.error("API CREATE ROOM - Error: %s", e)
             raise
 
     def retrieve(self, request, code=None):
         """Get room details"""
-        api_logger.info(f"API GET ROOM - Request for room {code} from IP: {request.META.get('REMOTE_ADDR')}")
+        api_logger.info("API GET ROOM - Request for room %s from IP: %s", code, request.META.get('REMOTE_ADDR'))
         
         try:
-            db_logger.info(f"DB READ - Fetching room with code: {code}")
-            room = get_object_or_404(Room, code=code)
-            db_logger.info(f"DB READ - Room {code} found with {room.participants.count()} participants")
-            
-            response_data = RoomSerializer(room).data
-            api_logger.info(f"API GET ROOM - Success: Room {code} data retrieved")
-            api_logger.debug(f"API GET ROOM - Response data: {json.dumps(response_data, default=str)}")
+            # A live engine room is authoritative; the database may lag behind it
+            response_data = room_engine.peek_snapshot(code)
+            if response_data is None:
+                db_logger.info("DB READ - Fetching room with code: %s", code)
+                room = get_object_or_404(Room, code=code)
+                db_logger.info("DB READ - Room %s found at version %s", code, room.version)
+                response_data = room_snapshot(room)
+            api_logger.info("API GET ROOM - Success: Room %s data retrieved", code)
+            api_logger.debug("API GET ROOM - Response data: %s", LazyJson(response_data))
             return Response(response_data)
             
         except Exception as e:
-            api_logger.error(f"API GET ROOM - Error retrieving room {code}: {str(e)}")
+            api_logger.error("API GET ROOM - Error retrieving room %s: %s", code, e)
             raise
 
     @action(detail=True, methods=['post'])
     def join(self, request, code=None):
         """Join a room"""
-        api_logger.info(f"API JOIN ROOM - Request to join room {code} from IP: {request.META.get('REMOTE_ADDR')}")
-        api_logger.debug(f"API JOIN ROOM - Request data: {json.dumps(request.data, default=str)}")
+        api_logger.info("API JOIN ROOM - Request to join room %s from IP: %s", code, request.META.get('REMOTE_ADDR'))
+        api_logger.debug("API JOIN ROOM - Request data: %s", LazyJson(request.data))
         
         try:
-            db_logger.info(f"DB READ - Fetching room with code: {code}")
+            # A live engine room's queued writes must land before this change
+            room_engine.forget(code)
+            db_logger.info("DB READ - Fetching room with code: %s", code)
             room = get_object_or_404(Room, code=code)
             
             serializer = JoinRoomSerializer(data=request.data)
             serializer.is_valid(raise_exception=True)
-            api_logger.debug(f"API JOIN ROOM - Serializer validation passed: {serializer.validated_data}")
+            api_logger.debug("API JOIN ROOM - Serializer validation passed: %s", serializer.validated_data)
 
             username = serializer.validated_data['username']
             session_id = serializer.validated_data['session_id']
-            api_logger.info(f"API JOIN ROOM - User '{username}' attempting to join room {code}")
+            api_logger.info("API JOIN ROOM - User '%s' attempting to join room %s", username, code)
 
-            # Check if participant already exists
-            db_logger.info(f"DB READ/CREATE - Checking if participant '{username}' exists in room {code}")
-            participant, created = Participant.objects.get_or_create(
-                room=room,
-                username=username,
-                defaults={'session_id': session_id, 'connected': True}
-            )
+            with transaction.atomic():
+                # Check if participant already exists
+                db_logger.info("DB READ/CREATE - Checking if participant '%s' exists in room %s", username, code)
+                participant, created = Participant.objects.get_or_create(
+                    room=room,
+                    username=username,
+                    defaults={'session_id': session_id, 'connected': True}
+                )
 
-            if created:
-                db_logger.info(f"DB CREATE - New participant created: {username} in room {code}")
-                api_logger.info(f"API JOIN ROOM - New participant '{username}' created and joined room {code}")
-            else:
-                db_logger.info(f"DB UPDATE - Existing participant '{username}' reconnecting to room {code}")
-                participant.session_id = session_id
-                participant.connected = True
-                participant.save()
-                api_logger.info(f"API JOIN ROOM - Existing participant '{username}' reconnected to room {code}")
+                if created:
+                    db_logger.info("DB CREATE - New participant created: %s in room %s", username, code)
+                    api_logger.info("API JOIN ROOM - New participant '%s' created and joined room %s", username, code)
+                else:
+                    db_logger.info("DB UPDATE - Existing participant '%s' reconnecting to room %s", username, code)
+                    participant.session_id = session_id
+                    participant.connected = True
+                    participant.save()
+                    api_logger.info("API JOIN ROOM - Existing participant '%s' reconnected to room %s", username, code)
+                room.version = bump_room_version(code)
+                # Connected as far as presence knows; the socket join follows
+                participant_data = ParticipantSerializer(
+                    participant, context={'connected_ids': presence.connected_ids(code)}).data
+                publish_room_message(code, {
+                    'type': 'user_joined',
+                    'username': username,
+                    'version': room.version,
+                    'patch': patches.presence_patch(participant_data, connected=participant_data['connected']),
+                })
 
             response_data = {
                 'participant': ParticipantSerializer(participant).data,
-                'room': RoomSerializer(room).data
+                'room': room_snapshot(room)
             }
-            api_logger.info(f"API JOIN ROOM - Success: User '{username}' joined room {code}")
-            api_logger.debug(f"API JOIN ROOM - Response data: {json.dumps(response_data, default=str)}")
+            api_logger.info("API JOIN ROOM - Success: User '%s' joined room %s", username, code)
+            api_logger.debug("API JOIN ROOM - Response data: %s", LazyJson(response_data))
             return Response(response_data)
             
         except Exception as e:
-            api_logger.error(f"API JOIN ROOM - Error joining room {code}: {str(e)}")
+            api_logger.error("API JOIN ROOM - Error joining room %s: %s", code, e)
             raise
 
     @action(detail=True, methods=['post'])
     def add_story(self, request, code=None):
         """Add a new story to estimate"""
-        api_logger.info(f"API ADD STORY - Request to add story to room {code} from IP: {request.META.get('REMOTE_ADDR')}")
-        api_logger.debug(f"API ADD STORY - Request data: {json.dumps(request.data, default=str)}")
+        api_logger.info("API ADD STORY - Request to add story to room %s from IP: %s", code, request.META.get('REMOTE_ADDR'))
+        api_logger.debug("API ADD STORY - Request data: %s", LazyJson(request.data))
         
         from .models import generate_funny_story
         
         try:
-            db_logger.info(f"DB READ - Fetching room with code: {code}")
+            # A live engine room's queued writes must land before this change
+            room_engine.forget(code)
+            db_logger.info("DB READ - Fetching room with code: %s", code)
             room = get_object_or_404(Room, code=code)
 
             story_id = request.data.get('story_id', '')
             title = request.data.get('title', '')
-            api_logger.debug(f"API ADD STORY - Original story data: story_id='{story_id}', title='{title}'")
+            api_logger.debug("API ADD STORY - Original story data: story_id='%s', title='%s'", story_id, title)
 
             # Generate funny story if both ID and title are empty
             if not story_id and not title:
                 story_id, title = generate_funny_story()
-                api_logger.debug(f"API ADD STORY - Generated funny story (both empty): {story_id}, {title}")
+                api_logger.debug("API ADD STORY - Generated funny story (both empty): %s, %s", story_id, title)
             # If only story_id is missing, generate a funny story_id
             elif not story_id:
                 funny_id, _ = generate_funny_story()
                 story_id = funny_id
-                api_logger.debug(f"API ADD STORY - Generated funny ID: {story_id}")
+                api_logger.debug("API ADD STORY - Generated funny ID: %s", story_id)
             # If only title is missing, generate a funny title  
             elif not title:
                 _, funny_title = generate_funny_story()
                 title = funny_title
-                api_logger.debug(f"API ADD STORY - Generated funny title: {title}")
+                api_logger.debug("API ADD STORY - Generated funny title: %s", title)
 
             # Get the highest order number
-            db_logger.info(f"DB READ - Getting story count for room {code}")
+            db_logger.info("DB READ - Getting story count for room %s", code)
             max_order = Story.objects.filter(room=room).count()
-            api_logger.debug(f"API ADD STORY - New story order will be: {max_order}")
+            api_logger.debug("API ADD STORY - New story order will be: %s", max_order)
 
-            db_logger.info(f"DB CREATE - Creating story: {story_id}, {title} in room {code}")
+            db_logger.info("DB CREATE - Creating story: %s, %s in room %s", story_id, title, code)
             story = Story.objects.create(
                 room=room,
                 story_id=story_id,
                 title=title,
                 order=max_order
             )
-            db_logger.info(f"DB CREATE - Story created with ID: {story.id}")
+            db_logger.info("DB CREATE - Story created with ID: %s", story.id)
 
             # Set as current story if no current story
             if not room.current_story:
-                db_logger.info(f"DB UPDATE - Setting new story as current story for room {code}")
+                db_logger.info("DB UPDATE - Setting new story as current story for room %s", code)
+                # Leave version alone; saving the stale value would undo concurrent bumps
                 room.current_story = story
-                room.save()
-                api_logger.info(f"API ADD STORY - New story set as current story")
-
+                room.save(update_fields=['current_story', 'updated_at'])
+                api_logger.info("API ADD STORY - New story set as current story")
+
+            room.version = bump_room_version(code)
+            current = room.current_story_id == story.id
+            journal.record(
+                'story_added', code, story=story.id, story_id=story.story_id, title=story.title,
+                current=current, cleared_story=None, version=room.version,
+            )
             response_data = StorySerializer(story).data
-            api_logger.info(f"API ADD STORY - Success: Story '{story_id}' added to room {code}")
-            api_logger.debug(f"API ADD STORY - Response data: {json.dumps(response_data, default=str)}")
+            publish_room_message(code, {
+                'type': 'story_added',
+                'version': room.version,
+                'patch': patches.story_added_patch(response_data, current=current),
+            })
+            api_logger.info("API ADD STORY - Success: Story '%s' added to room %s", story_id, code)
+            api_logger.debug("API ADD STORY - Response data: %s", LazyJson(response_data))
             return Response(response_data, status=status.HTTP_201_CREATED)
             
         except Exception as e:
-            api_logger.error(f"API ADD STORY - Error adding story to room {code}: {str(e)}")
+            api_logger.error("API ADD STORY - Error adding story to room %s: %s", code, e)
             raise
 
     @action(detail=True, methods=['post'])
     def reset(self, request, code=None):
         """Reset room - clear all votes and estimation for current story"""
-        api_logger.info(f"API RESET ROOM - Request to reset room {code} from IP: {request.META.get('REMOTE_ADDR')}")
+        api_logger.info("API RESET ROOM - Request to reset room %s from IP: %s", code, request.META.get('REMOTE_ADDR'))
         
         try:
-            db_logger.info(f"DB READ - Fetching room with code: {code}")
+            # A live engine room's queued writes must land before this change
+            room_engine.forget(code)
+            db_logger.info("DB READ - Fetching room with code: %s", code)
             room = get_object_or_404(Room, code=code)
 
-            if room.current_story:
-                story_id = room.current_story.id
-                api_logger.info(f"API RESET ROOM - Resetting current story {story_id} in room {code}")
-                
-                # Delete all votes for current story
-                db_logger.info(f"DB DELETE - Removing all votes for story {story_id} in room {code}")
-                vote_count = Vote.objects.filter(room=room, story=room.current_story).count()
-                Vote.objects.filter(room=room, story=room.current_story).delete()
-                db_logger.info(f"DB DELETE - {vote_count} votes deleted for story {story_id}")
-                
-                # Reset story estimation - clear final points and timestamp
-                db_logger.info(f"DB UPDATE - Clearing estimation data for story {story_id}")
-                room.current_story.final_points = None
-                room.current_story.estimated_at = None
-                room.current_story.save()
-                api_logger.info(f"API RESET ROOM - Story {story_id} estimation data cleared")
-            else:
-                api_logger.info(f"API RESET ROOM - No current story in room {code} to reset")
+            with transaction.atomic():
+                if room.current_story_id:
+                    story_id = room.current_story_id
+                    api_logger.info("API RESET ROOM - Resetting current story %s in room %s", story_id, code)
 
-            api_logger.info(f"API RESET ROOM - Success: Room {code} reset completed")
+                    # One DELETE for the votes and one UPDATE for the estimation data
+                    vote_count = clear_votes(room.pk, story_id, reason='reset')
+                    clear_story_estimate(story_id)
+                    api_logger.info("API RESET ROOM - %s votes deleted and estimation data cleared for story %s", vote_count, story_id)
+                else:
+                    api_logger.info("API RESET ROOM - No current story in room %s to reset", code)
+
+                room.version = bump_room_version(code)
+                publish_room_message(code, {
+                    'type': 'room_reset',
+                    'version': room.version,
+                    'patch': patches.votes_reset_patch(room.current_story_id),
+                })
+            journal.record('votes_reset', code, story=room.current_story_id, version=room.version)
+            api_logger.info("API RESET ROOM - Success: Room %s reset completed", code)
             return Response({'message': 'Room reset successfully'})
             
         except Exception as e:
-            api_logger.error(f"API RESET ROOM - Error resetting room {code}: {str(e)}")
+            api_logger.error("API RESET ROOM - Error resetting room %s: %s", code, e)
             raise
 
     @action(detail=True, methods=['post'])
     def reveal(self, request, code=None):
         """Reveal all votes for current story"""
-        api_logger.info(f"API REVEAL VOTES - Request to reveal votes in room {code} from IP: {request.META.get('REMOTE_ADDR')}")
+        api_logger.info("API REVEAL VOTES - Request to reveal votes in room %s from IP: %s", code, request.META.get('REMOTE_ADDR'))
         
         try:
-            db_logger.info(f"DB READ - Fetching room with code: {code}")
+            # A live engine room's queued writes must land before this change
+            room_engine.forget(code)
+            db_logger.info("DB READ - Fetching room with code: %s", code)
             room = get_object_or_404(Room, code=code)
-
-            if room.current_story:
-                story_id = room.current_story.id
-                api_logger.info(f"API REVEAL VOTES - Revealing votes for story {story_id} in room {code}")
-                
-                db_logger.info(f"DB READ - Fetching votes for story {story_id}")
-                votes = Vote.objects.filter(room=room, story=room.current_story)
-                vote_count = votes.count()
-                api_logger.debug(f"API REVEAL VOTES - Found {vote_count} votes to reveal")
-                
-                db_logger.info(f"DB UPDATE - Setting revealed=True for {vote_count} votes")
-                votes.update(revealed=True)
-
-                # Calculate average (excluding ? and coffee)
-                numeric_votes = votes.exclude(value__in=['?', 'coffee']).values_list('value', flat=True)
-                if numeric_votes:
-                    api_logger.debug(f"API REVEAL VOTES - Numeric votes: {list(numeric_votes)}")
-                    # Convert to integers and calculate estimate using Planning Poker best practices
-                    vote_values = [int(v) for v in numeric_votes]
-                    average = sum(vote_values) / len(vote_values)
-                    rounded = self.calculate_planning_poker_estimate(numeric_votes)
-                    api_logger.info(f"API REVEAL VOTES - Calculated average: {average:.2f}, recommended: {rounded}")
-
-                    # Store both average and rounded value (we'll use rounded as placeholder)
-                    db_logger.info(f"DB UPDATE - Setting final_points={rounded} for story {story_id}")
-                    room.current_story.final_points = str(rounded)
-                    room.current_story.estimated_at = timezone.now()
-                    room.current_story.save()
-                    api_logger.info(f"API REVEAL VOTES - Story {story_id} estimation saved: {rounded} points")
+            votes_data, calculation, estimate = [], None, {}
+
+            with transaction.atomic():
+                if room.current_story:
+                    story_id = room.current_story.id
+                    api_logger.info("API REVEAL VOTES - Revealing votes for story %s in room %s", story_id, code)
+
+                    db_logger.info("DB UPDATE - Setting revealed=True for votes of story %s", story_id)
+                    votes = Vote.objects.filter(room=room, story=room.current_story)
+                    votes.update(revealed=True)
+                    # One query for the votes and their voters; the estimate is built from the same rows
+                    votes_data = VoteSerializer(votes.select_related('participant'), many=True).data
+                    api_logger.debug("API REVEAL VOTES - Revealed %s votes", len(votes_data))
+
+                    # Calculate the estimate using Planning Poker best practices (excluding ? and coffee)
+                    calculation = summarize_votes((v['value'], v['participant_name']) for v in votes_data)
+                    if calculation:
+                        average = calculation['average']
+                        rounded = calculation['rounded']
+                        api_logger.info("API REVEAL VOTES - Calculated average: %.2f, recommended: %s", average, rounded)
+
+                        # Store both average and rounded value (we'll use rounded as placeholder)
+                        db_logger.info("DB UPDATE - Setting final_points=%s for story %s", rounded, story_id)
+                        room.current_story.final_points = str(rounded)
+                        room.current_story.estimated_at = timezone.now()
+                        room.current_story.save()
+                        estimate = {'final_points': room.current_story.final_points, 'estimated_at': room.current_story.estimated_at}
+                        api_logger.info("API REVEAL VOTES - Story %s estimation saved: %s points", story_id, rounded)
+                    else:
+                        api_logger.info("API REVEAL VOTES - No numeric votes found for story %s", story_id)
                 else:
-                    api_logger.info(f"API REVEAL VOTES - No numeric votes found for story {story_id}")
-            else:
-                api_logger.info(f"API REVEAL VOTES - No current story in room {code} to reveal")
-
-            response_data = RoomSerializer(room).data
-            api_logger.info(f"API REVEAL VOTES - Success: Votes revealed for room {code}")
-            api_logger.debug(f"API REVEAL VOTES - Response data: {json.dumps(response_data, default=str)}")
+                    api_logger.info("API REVEAL VOTES - No current story in room %s to reveal", code)
+
+                room.version = bump_room_version(code)
+                publish_room_message(code, {
+                    'type': 'votes_revealed',
+                    'version': room.version,
+                    'patch': patches.votes_revealed_patch(room.current_story_id, votes_data, **estimate),
+                    'average': calculation['average'] if calculation else None,
+                    'rounded': calculation['rounded'] if calculation else None,
+                    'discussion_message': calculation['discussion_message'] if calculation else None,
+                })
+            if room.current_story_id:
+                journal.record(
+                    'votes_revealed', code, story=room.current_story_id, version=room.version,
+                    votes={str(v['participant']): v['value'] for v in votes_data},
+                    rounded=calculation['rounded'] if calculation else None,
+                    points=room.current_story.final_points,
+                )
+            response_data = room_snapshot(room)
+            api_logger.info("API REVEAL VOTES - Success: Votes revealed for room %s", code)
+            api_logger.debug("API REVEAL VOTES - Response data: %s", LazyJson(response_data))
             return Response(response_data)
             
         except Exception as e:
-            api_logger.error(f"API REVEAL VOTES - Error revealing votes in room {code}: {str(e)}")
+            api_logger.error("API REVEAL VOTES - Error revealing votes in room %s: %s", code, e)
             raise
 
     @action(detail=True, methods=['post'])
     def confirm_points(self, request, code=None):
         """Confirm and finalize story points"""
-        api_logger.info(f"API CONFIRM POINTS - Request to confirm points in room {code} from IP: {request.META.get('REMOTE_ADDR')}")
-        api_logger.debug(f"API CONFIRM POINTS - Request data: {json.dumps(request.data, default=str)}")
+        api_logger.info("API CONFIRM POINTS - Request to confirm points in room %s from IP: %s", code, request.META.get('REMOTE_ADDR'))
+        api_logger.debug("API CONFIRM POINTS - Request data: %s", LazyJson(request.data))
         
         try:
-            db_logger.info(f"DB READ - Fetching room with code: {code}")
+            # A live engine room's queued writes must land before this change
+            room_engine.forget(code)
+            db_logger.info("DB READ - Fetching room with code: %s", code)
             room = get_object_or_404(Room, code=code)
             points = request.data.get('points')
-            api_logger.info(f"API CONFIRM POINTS - Confirming {points} points for current story in room {code}")
+            api_logger.info("API CONFIRM POINTS - Confirming %s points for current story in room %s", points, code)
 
             if room.current_story and points:
                 story_id = room.current_story.id
-                db_logger.info(f"DB UPDATE - Setting final_points={points} for story {story_id}")
+                db_logger.info("DB UPDATE - Setting final_points=%s for story %s", points, story_id)
                 room.current_story.final_points = points
                 room.current_story.estimated_at = timezone.now()
                 room.current_story.save()
-                api_logger.info(f"API CONFIRM POINTS - Story {story_id} points confirmed: {points}")
+                api_logger.info("API CONFIRM POINTS - Story %s points confirmed: %s", story_id, points)
             else:
                 if not room.current_story:
-                    api_logger.warning(f"API CONFIRM POINTS - No current story in room {code}")
+                    api_logger.warning("API CONFIRM POINTS - No current story in room %s", code)
                 if not points:
-                    api_logger.warning(f"API CONFIRM POINTS - No points provided in request")
-
-            response_data = RoomSerializer(room).data
-            api_logger.info(f"API CONFIRM POINTS - Success: Points confirmed for room {code}")
-            api_logger.debug(f"API CONFIRM POINTS - Response data: {json.dumps(response_data, default=str)}")
+                    api_logger.warning("API CONFIRM POINTS - No points provided in request")
+
+            room.version = bump_room_version(code)
+            story = room.current_story
+            publish_room_message(code, {
+                'type': 'points_confirmed',
+                'version': room.version,
+                'patch': patches.points_confirmed_patch(
+                    room.current_story_id, story and story.final_points, story and story.estimated_at),
+            })
+            if room.current_story_id and points:
+                journal.record('points_confirmed', code, story=room.current_story_id, points=points, version=room.version)
+            response_data = room_snapshot(room)
+            api_logger.info("API CONFIRM POINTS - Success: Points confirmed for room %s", code)
+            api_logger.debug("API CONFIRM POINTS - Response data: %s", LazyJson(response_data))
             return Response(response_data)
             
         except Exception as e:
-            api_logger.error(f"API CONFIRM POINTS - Error confirming points in room {code}: {str(e)}")
+            api_logger.error("API CONFIRM POINTS - Error confirming points in room %s: %s", code, e)
             raise
 
-    def calculate_planning_poker_estimate(self, votes):
-        """Calculate estimate using Planning Poker best practices"""
-        fibonacci_sequence = [1, 2, 3, 5, 8, 13, 21, 34, 55, 89]
-        
-        if not votes:
-            return None
-            
-        # Convert votes to integers and sort
-        vote_values = sorted([int(v) for v in votes])
-        min_vote = vote_values[0]
-        max_vote = vote_values[-1]
-        
-        # Find positions in Fibonacci sequence
-        min_pos = next((i for i, fib in enumerate(fibonacci_sequence) if fib >= min_vote), 0)
-        max_pos = next((i for i, fib in enumerate(fibonacci_sequence) if fib >= max_vote), len(fibonacci_sequence) - 1)
-        
-        # Check for wide spread (more than 2 Fibonacci steps apart)
-        spread = max_pos - min_pos
-        
-        if spread > 2:
-            # Wide spread - suggest towards higher estimate with median approach
-            # This encourages discussion and tends toward the complexity some see
-            if len(vote_values) == 1:
-                return vote_values[0]
-            
-            # Use 75th percentile approach for wide spreads
-            import statistics
-            percentile_75 = statistics.quantiles(vote_values, n=4)[2]  # 75th percentile
-            
-            # Round up to nearest Fibonacci
-            for fib in fibonacci_sequence:
-                if percentile_75 <= fib:
-                    return fib
-            return fibonacci_sequence[-1]
-        else:
-            # Normal spread - use median or standard approach
-            import statistics
-            median = statistics.median(vote_values)
-            
-            # Round to nearest Fibonacci (up)
-            for fib in fibonacci_sequence:
-                if median <= fib:
-                    return fib
-            return fibonacci_sequence[-1]
+
+async def healthz(request):
+    """Liveness: the process is up and serving requests"""
+    return JsonResponse({'status': 'ok'})
+
+
+async def readyz(request):
+    """Readiness from the latest background Redis probe; never waits on Redis itself"""
+    result = redis_probe.result
+    if result is None:
+        return JsonResponse({'status': 'starting', 'redis': None}, status=503)
+    ready = redis_probe.ready()
+    return JsonResponse({'status': 'ok' if ready else 'unavailable', 'redis': result}, status=200 if ready else 503)
+
+
+def prometheus_metrics(request):
+    """Metrics of every worker in the Prometheus text format, summed unless ?per_worker=1"""
+    merged = worker_metrics.merged(per_worker=request.GET.get('per_worker') == '1')
+    return HttpResponse(render_prometheus(merged), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_view(['GET'])
+def command_metrics(request):
+    """WebSocket command latency, error, rejection and send queue totals for this process"""
+    return Response({'commands': command_summary(), 'outbox': outbox_summary(), 'rejected': rejection_summary()})
@@ -0,0 +1,132 @@
+"""
+Compact binary wire protocol for room WebSocket frames
+
+Clients opt in by offering the ``planning-poker.msgpack.v1`` subprotocol when
+they open the socket; everyone else keeps getting JSON text frames. Binary
+frames are MessagePack with:
+
+- short field codes instead of key names (see ``FIELD_CODES``)
+- canonical UUID strings under id keys (``ID_FIELDS``) packed as 16 raw bytes
+- ISO-8601 timestamps under timestamp keys (``TIMESTAMP_FIELDS``) packed as
+  ext type 1 holding int64 epoch microseconds
+
+Values are converted by the key they sit under, never by what they look
+like, so user-entered text (a story titled like a timestamp, say) always
+passes through unchanged. Unknown keys and values pass through too, and
+decoding reverses every substitution, so handlers see the same dicts as with
+JSON.
+"""
+import re
+import struct
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import msgpack
+
+from .limits import MessageTooDeep, value_too_deep
+
+SUBPROTOCOL_MSGPACK = 'planning-poker.msgpack.v1'
+
+TIMESTAMP_EXT = 1
+
+FIELD_CODES = {
+    # Envelope
+    'type': 't', 'version': 'v', 'base_version': 'bv', 'patch': 'p', 'op': 'o',
+    'room': 'r', 'average': 'av', 'rounded': 'rd', 'discussion_message': 'dm',
+    'message': 'm', 'command': 'cm',
+    # Room
+    'code': 'cd', 'session_name': 'sn', 'created_at': 'ca', 'updated_at': 'ua',
+    'current_story': 'cs', 'current_story_data': 'csd', 'participants': 'ps',
+    'stories': 'ss', 'participants_count': 'pc', 'deck': 'dk',
+    # Participant
+    'id': 'i', 'username': 'un', 'connected': 'c', 'joined_at': 'ja', 'last_seen': 'ls',
+    'participant': 'pa', 'participant_id': 'pid',
+    # Story
+    'story': 's', 'story_id': 'sid', 'title': 'ti', 'final_points': 'fp',
+    'estimated_at': 'ea', 'order': 'or', 'votes': 'vs', 'votes_count': 'vc',
+    'cleared_story': 'cl', 'current': 'cu',
+    # Vote
+    'participant_name': 'pn', 'value': 'va', 'revealed': 'rv', 'points': 'pt',
+    # Discussion message
+    'min_vote': 'mnv', 'max_vote': 'mxv', 'min_voter': 'mnr', 'max_voter': 'mxr',
+    'spread_level': 'sl',
+}
+FIELD_NAMES = {code: name for name, code in FIELD_CODES.items()}
+
+# Keys holding UUIDs (or lists of them); 'story' and 'participant' hold a
+# nested dict in some patches, which is packed key by key instead
+ID_FIELDS = frozenset({
+    'id', 'participant', 'participant_id', 'participants', 'story', 'current_story', 'cleared_story',
+})
+TIMESTAMP_FIELDS = frozenset({'created_at', 'updated_at', 'joined_at', 'last_seen', 'estimated_at'})
+
+_UUID_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+_TIMESTAMP_RE = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{1,6})?(Z|[+-]\d{2}:\d{2})$')
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+# What decoding a malformed frame can raise: msgpack's errors are mostly
+# ValueErrors, but not all of them, and out-of-range values raise their own
+DECODE_ERRORS = (ValueError, TypeError, OverflowError, msgpack.UnpackException)
+
+
+def _pack_timestamp(moment):
+    micros = (moment - _EPOCH) // _MICROSECOND
+    return msgpack.ExtType(TIMESTAMP_EXT, struct.pack('>q', micros))
+
+
+def _pack_value(value, key=None):
+    """Pack a value found under ``key``; list items are packed under their list's key"""
+    if isinstance(value, str):
+        if key in ID_FIELDS and _UUID_RE.match(value):
+            return uuid.UUID(value).bytes
+        if key in TIMESTAMP_FIELDS and _TIMESTAMP_RE.match(value):
+            return _pack_timestamp(datetime.fromisoformat(value.replace('Z', '+00:00')))
+        return value
+    if isinstance(value, dict):
+        return {FIELD_CODES.get(k, k): _pack_value(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_pack_value(v, key) for v in value]
+    if isinstance(value, uuid.UUID):
+        return value.bytes
+    if isinstance(value, datetime):
+        return _pack_timestamp(value) if value.tzinfo is not None else value.isoformat()
+    return value
+
+
+def _unpack_value(value):
+    if isinstance(value, bytes) and len(value) == 16:
+        return str(uuid.UUID(bytes=value))
+    if isinstance(value, dict):
+        return {FIELD_NAMES.get(k, k): _unpack_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_unpack_value(v) for v in value]
+    return value
+
+
+def _ext_hook(code, data):
+    if code == TIMESTAMP_EXT:
+        try:
+            micros = struct.unpack('>q', data)[0]
+            moment = _EPOCH + micros * _MICROSECOND
+        except (struct.error, OverflowError) as e:
+            raise ValueError(f"Malformed timestamp: {e}")
+        return moment.isoformat().replace('+00:00', 'Z')
+    return msgpack.ExtType(code, data)
+
+
+def encode_binary(message):
+    """Encode a message dict into a compact binary frame"""
+    return msgpack.packb(_pack_value(message), use_bin_type=True)
+
+
+def decode_binary(frame, max_depth=None):
+    """Decode a binary frame back into a message dict with full key names.
+
+    msgpack's C unpacker doesn't recurse, so nesting is checked on its output
+    before the recursive key mapping; too deep raises ``MessageTooDeep``.
+    """
+    value = msgpack.unpackb(frame, raw=False, ext_hook=_ext_hook)
+    if max_depth is not None and value_too_deep(value, max_depth):
+        raise MessageTooDeep(f"Message is nested deeper than {max_depth} levels")
+    return _unpack_value(value)
@@ -0,0 +1,138 @@
+"""
+Metrics from every worker, for one ``/metrics`` scrape
+
+Each worker process has its own registry (rooms.metrics), and a scrape
+through the load balancer only reaches one of them. Every worker therefore
+publishes a snapshot of its registry every ``METRICS_PUBLISH_INTERVAL``
+seconds to the Redis hash ``metrics:workers``, keyed by
+``<hostname>:<pid>``. ``/metrics`` publishes the serving worker's snapshot,
+reads the others and merges them. Snapshots older than
+``METRICS_WORKER_TTL`` are from workers that stopped and are dropped.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+from .metrics import merge_snapshots, registry
+from .redis_client import get_client, use_local_state
+
+redis_logger = logging.getLogger('rooms.redis')
+
+WORKERS_KEY = 'metrics:workers'
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class RedisWorkerMetricsBackend:
+    def publish(self, worker, raw):
+        get_client().hset(WORKERS_KEY, worker, raw)
+
+    def all(self):
+        return {worker.decode('utf8'): raw for worker, raw in get_client().hgetall(WORKERS_KEY).items()}
+
+    def remove(self, workers):
+        get_client().hdel(WORKERS_KEY, *workers)
+
+
+class LocalWorkerMetricsBackend:
+    def __init__(self):
+        self.workers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, worker, raw):
+        with self._lock:
+            self.workers[worker] = raw
+
+    def all(self):
+        with self._lock:
+            return dict(self.workers)
+
+    def remove(self, workers):
+        with self._lock:
+            for worker in workers:
+                self.workers.pop(worker, None)
+
+
+class WorkerMetrics:
+    def __init__(self):
+        self._backend = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def publish_interval(self):
+        return getattr(settings, 'METRICS_PUBLISH_INTERVAL', 15)
+
+    @property
+    def worker_ttl(self):
+        return getattr(settings, 'METRICS_WORKER_TTL', 60)
+
+    @property
+    def backend(self):
+        local = use_local_state()
+        if self._backend is None or isinstance(self._backend, LocalWorkerMetricsBackend) != local:
+            self._backend = LocalWorkerMetricsBackend() if local else RedisWorkerMetricsBackend()
+        return self._backend
+
+    def publish(self):
+        """Store this worker's current registry snapshot"""
+        raw = json.dumps({'time': time.time(), 'metrics': registry.snapshot()})
+        try:
+            self.backend.publish(worker_id(), raw)
+        except redis.RedisError as e:
+            redis_logger.error("REDIS METRICS - Failed to publish metrics for worker %s: %s", worker_id(), e)
+
+    def collect(self):
+        """Snapshots of every live worker, this one always fresh"""
+        own = registry.snapshot()
+        self.publish()
+        try:
+            published = self.backend.all()
+        except redis.RedisError as e:
+            redis_logger.error("REDIS METRICS - Failed to read worker metrics: %s", e)
+            published = {}
+
+        snapshots = {}
+        stale = []
+        cutoff = time.time() - self.worker_ttl
+        for worker, raw in published.items():
+            data = json.loads(raw)
+            if data['time'] < cutoff:
+                stale.append(worker)
+            else:
+                snapshots[worker] = data['metrics']
+        if stale:
+            try:
+                self.backend.remove(stale)
+            except redis.RedisError as e:
+                redis_logger.error("REDIS METRICS - Failed to drop stale workers %s: %s", stale, e)
+        snapshots[worker_id()] = own
+        return snapshots
+
+    def merged(self, per_worker=False):
+        return merge_snapshots(self.collect(), per_worker=per_worker)
+
+    def ensure_publisher(self):
+        """Start this process's background publisher thread once"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='worker-metrics', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.publish_interval)
+            self.publish()
+
+
+# Process-wide metrics publisher
+worker_metrics = WorkerMetrics()
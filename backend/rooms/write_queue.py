@@ -0,0 +1,126 @@
+"""
+Single-writer queue for SQLite writes
+
+SQLite allows one writer at a time. With many rooms voting at once, consumer
+threads (see rooms.db_executor) all try to write and most of them wait in
+the busy timeout or fail with "database is locked". With
+``DB_WRITE_QUEUE_ENABLED`` the consumer's mutating methods and presence
+flushes are instead queued to one writer thread, which:
+
+- takes up to ``DB_WRITE_BATCH_SIZE`` queued writes at a time and runs them
+  in one transaction, each in its own savepoint so a failing write (a vote
+  for a story that isn't in the room) doesn't take the rest down with it
+- hands every caller its result only once that transaction has committed
+- runs writes in the order they were queued, so each room's commands still
+  apply in order
+
+Reads keep going through the regular executors; with the database in WAL mode
+(``SQLITE_WAL``) they don't wait for the writer.
+"""
+import asyncio
+import functools
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .db_executor import room_database_sync_to_async
+
+db_logger = logging.getLogger('rooms.database')
+
+
+class WriteQueue:
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'DB_WRITE_QUEUE_ENABLED', False)
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'DB_WRITE_BATCH_SIZE', 256)
+
+    def submit(self, func, *args, **kwargs):
+        """Queue a write; the returned Future resolves after its transaction commits"""
+        future = Future()
+        self.queue.put((future, func, args, kwargs))
+        self._ensure_writer()
+        return future
+
+    def _ensure_writer(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.write_batch(batch)
+
+    def write_batch(self, batch):
+        close_old_connections()
+        outcomes = []
+        try:
+            with transaction.atomic():
+                for future, func, args, kwargs in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with transaction.atomic():
+                            outcomes.append((future, func(*args, **kwargs), None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+        except Exception as e:
+            db_logger.error("DB WRITE QUEUE - Batch of %s writes failed to commit: %s", len(batch), e)
+            for future, _, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            close_old_connections()
+
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        db_logger.debug("DB WRITE QUEUE - Committed %s writes in one transaction", len(outcomes))
+
+
+# Process-wide writer
+write_queue = WriteQueue()
+
+
+async def database_write(func, *args, **kwargs):
+    """Run a write on the single writer when the queue is enabled, else like ``database_sync_to_async``"""
+    if write_queue.enabled:
+        return await asyncio.wrap_future(write_queue.submit(func, *args, **kwargs))
+    return await database_sync_to_async(func)(*args, **kwargs)
+
+
+def room_database_write(func):
+    """``room_database_sync_to_async`` for consumer methods that write, queued to the single writer when enabled"""
+    on_room_executor = room_database_sync_to_async(func)
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        if write_queue.enabled:
+            return await asyncio.wrap_future(write_queue.submit(func, self, *args, **kwargs))
+        return await on_room_executor(self, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,46 @@
+#!/usr/bin/env bash
+# Start (or stop) several local redis-server processes to run the sharded
+# channel layer against.
+#
+#   scripts/redis_shards.sh start [count] [first port]   # default: 3 nodes from 6380
+#   scripts/redis_shards.sh stop  [count] [first port]
+#
+# Then point Django at them:
+#
+#   export CHANNEL_LAYER_HOSTS=redis://127.0.0.1:6380/0,redis://127.0.0.1:6381/0,redis://127.0.0.1:6382/0
+#   daphne -p 8000 config.asgi:application
+#
+# After growing or shrinking the list, move existing groups with
+#   python manage.py rebalance_channel_layer --from <previous URLs>
+set -euo pipefail
+
+action=${1:-start}
+count=${2:-3}
+first_port=${3:-6380}
+data_dir=${REDIS_SHARDS_DIR:-/tmp/planning-poker-redis}
+
+hosts=()
+for ((i = 0; i < count; i++)); do
+    port=$((first_port + i))
+    case "$action" in
+        start)
+            mkdir -p "$data_dir/$port"
+            redis-server --port "$port" --dir "$data_dir/$port" --save "" --appendonly no \
+                --daemonize yes --pidfile "$data_dir/$port/redis.pid" --logfile "$data_dir/$port/redis.log"
+            echo "🟢 redis-server on port $port"
+            ;;
+        stop)
+            redis-cli -p "$port" shutdown nosave >/dev/null 2>&1 && echo "🔴 stopped port $port" || echo "⚪ nothing on port $port"
+            ;;
+        *)
+            echo "usage: $0 start|stop [count] [first port]" >&2
+            exit 1
+            ;;
+    esac
+    hosts+=("redis://127.0.0.1:$port/0")
+done
+
+if [[ "$action" == start ]]; then
+    echo
+    echo "export CHANNEL_LAYER_HOSTS=$(IFS=,; echo "${hosts[*]}")"
+fi
@@ -0,0 +1,85 @@
+// Applies the typed room patches broadcast by the backend (see backend/rooms/patches.py)
+
+export interface RoomPatch {
+  op: string;
+  [key: string]: any;
+}
+
+type PatchableRoom = {
+  current_story: string | null;
+  current_story_data?: any;
+  participants: any[];
+  stories: any[];
+  version?: number;
+};
+
+const withCurrentStory = <T extends PatchableRoom>(room: T): T => ({
+  ...room,
+  current_story_data: room.stories.find((s) => s.id === room.current_story) ?? undefined,
+});
+
+const updateStory = <T extends PatchableRoom>(room: T, storyId: string | null, update: (story: any) => any): T => {
+  if (!storyId) return room;
+  return withCurrentStory({
+    ...room,
+    stories: room.stories.map((s) => (s.id === storyId ? update(s) : s)),
+  });
+};
+
+const clearVotes = (story: any) => ({ ...story, votes: [], votes_count: 0 });
+
+export function applyRoomPatch<T extends PatchableRoom>(room: T, patch: RoomPatch): T {
+  switch (patch.op) {
+    case 'votes':
+      return updateStory(room, patch.story, (story) => {
+        const voted = new Set<string>(patch.participants);
+        const votes = [
+          ...story.votes.filter((v: any) => !voted.has(v.participant)),
+          ...patch.participants.map((participant: string) => ({ id: '', participant, value: '', revealed: false })),
+        ];
+        return { ...story, votes, votes_count: votes.length };
+      });
+    case 'presence': {
+      const participant = { ...patch.participant, connected: patch.connected };
+      const exists = room.participants.some((p) => p.id === participant.id);
+      return {
+        ...room,
+        participants: exists
+          ? room.participants.map((p) => (p.id === participant.id ? { ...p, ...participant } : p))
+          : [...room.participants, participant],
+      };
+    }
+    case 'current_story':
+      return withCurrentStory({ ...room, current_story: patch.story });
+    case 'story_added': {
+      const stories = room.stories
+        .map((s) => (s.id === patch.cleared_story ? clearVotes(s) : s))
+        .filter((s) => s.id !== patch.story.id);
+      // REST-added stories only become current when the room had none
+      const current_story = patch.current === false ? room.current_story : patch.story.id;
+      return withCurrentStory({ ...room, stories: [...stories, patch.story], current_story });
+    }
+    case 'votes_revealed':
+      return updateStory(room, patch.story, (story) => ({
+        ...story,
+        votes: patch.votes,
+        votes_count: patch.votes.length,
+        // Only REST reveals save the estimate right away
+        ...('final_points' in patch ? { final_points: patch.final_points, estimated_at: patch.estimated_at } : {}),
+      }));
+    case 'votes_reset':
+      return updateStory(room, patch.story, (story) => ({
+        ...clearVotes(story),
+        final_points: null,
+        estimated_at: null,
+      }));
+    case 'points_confirmed':
+      return updateStory(room, patch.story, (story) => ({
+        ...story,
+        final_points: patch.final_points,
+        estimated_at: patch.estimated_at,
+      }));
+    default:
+      return room;
+  }
+}
@@ -605,7 +605,7 @@ export default function Room() {
             <div className="space-y-3 sm:space-y-4" data-testid="voting-section">
               <h2 className="text-lg sm:text-xl font-semibold" data-testid="voting-section-title">Cast Your Vote</h2>
               <div className="grid grid-cols-5 sm:flex sm:flex-wrap gap-2 sm:gap-3" data-testid="voting-cards-container">
-                {VOTE_OPTIONS.map((value) => (
+                {(room?.deck ?? VOTE_OPTIONS).map((value) => (
                   <VotingCard
                     key={value}
                     value={value}
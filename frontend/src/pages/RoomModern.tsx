@@ -39,6 +39,7 @@ import ParticipantCard from '@/components/modern/ParticipantCard';
 import HeaderBar from '@/components/modern/HeaderBar';
 import { cn } from '@/lib/utils';
 import { logger, LogCategory } from '@/lib/logger';
+import { applyRoomPatch } from '@/lib/roomPatches';
 
 interface Room {
   code: string;
@@ -48,6 +49,8 @@ interface Room {
   participants: Participant[];
   stories: Story[];
   current_story_data?: Story;
+  deck?: string[];
+  version?: number;
 }
 
 interface Participant {
@@ -75,7 +78,16 @@ interface Vote {
   revealed: boolean;
 }
 
-const voteOptions = ['1', '2', '3', '5', '8', '13', '21', '?', 'coffee'];
+// Used until the room state tells us the backend's deck
+const DEFAULT_VOTE_OPTIONS = ['0', '1', '2', '3', '5', '8', '13', '21', '?', 'coffee'];
+
+// Close code the backend uses when a client falls too far behind (rooms/outbox.py)
+const RESYNC_CLOSE_CODE = 4009;
+
+// Keeps our presence alive; must be well under the backend's PRESENCE_TTL (60s)
+const HEARTBEAT_INTERVAL_MS = 20000;
+
+const RECONNECT_DELAY_MS = 1000;
 
 function RoomModern() {
   const { code } = useParams<{ code: string }>();
@@ -91,7 +103,15 @@ function RoomModern() {
   const [showAverageModal, setShowAverageModal] = useState(false);
   const [averageData, setAverageData] = useState<{ average: number; rounded: number; discussion_message?: any } | null>(null);
   const [newStory, setNewStory] = useState({ story_id: '', title: '' });
+  // Bumped to reopen the WebSocket when the server asks for a resync
+  const [connectionAttempt, setConnectionAttempt] = useState(0);
   const wsRef = useRef<WebSocket | null>(null);
+  // Every room version up to this one is in `room` (from a snapshot or patches
+  // applied in order). Broadcast frames span consecutive versions only, so a
+  // frame at or below it carries nothing new.
+  const versionRef = useRef<number>(0);
+  const syncRequestedRef = useRef(false);
+  const isApplied = (version: number) => version <= versionRef.current;
 
   const currentParticipantId = localStorage.getItem('participant_id');
   const currentUsername = localStorage.getItem('username');
@@ -139,7 +159,11 @@ function RoomModern() {
             participantCount: data.participants?.length || 0,
             storyCount: data.stories?.length || 0 
           }, componentName);
-          setRoom(data);
+          // A WebSocket snapshot may already have delivered this state or a newer one
+          if (versionRef.current === 0 || !isApplied(data.version ?? 0)) {
+            versionRef.current = data.version ?? 0;
+            setRoom(data);
+          }
         } else {
           logger.apiResponse('GET', `${import.meta.env.VITE_API_URL}/rooms/${code}/`, response.status, undefined, componentName);
           logger.warn(LogCategory.NAVIGATION, `Room ${code} not found, redirecting to home`, { status: response.status }, componentName);
@@ -175,14 +199,18 @@ function RoomModern() {
     const wsUrl = `${import.meta.env.VITE_WS_URL}/ws/room/${code}/`;
     logger.info(LogCategory.WEBSOCKET_SEND, 'Establishing WebSocket connection', { wsUrl }, componentName);
     const websocket = new WebSocket(wsUrl);
+    let disposed = false;
     
     websocket.onopen = () => {
       logger.info(LogCategory.WEBSOCKET_RECEIVE, 'WebSocket connection established', { wsUrl }, componentName);
+      syncRequestedRef.current = false;
       
       const joinMessage = {
         type: 'user_joined',
         username: currentUsername,
-        participant_id: currentParticipantId
+        participant_id: currentParticipantId,
+        // On a reconnect the server replays only what we missed since this version
+        ...(versionRef.current > 0 ? { last_version: versionRef.current } : {})
       };
       
       logger.websocketSend('user_joined', joinMessage, componentName);
@@ -208,6 +236,12 @@ function RoomModern() {
         reason: event.reason,
         wasClean: event.wasClean
       }, componentName);
+      // Reconnect after a dropped connection, or when the server dropped us for falling too far behind
+      if (!disposed && (event.code === RESYNC_CLOSE_CODE || !event.wasClean)) {
+        window.setTimeout(() => {
+          if (!disposed) setConnectionAttempt((attempt) => attempt + 1);
+        }, RECONNECT_DELAY_MS);
+      }
     };
 
     websocket.onerror = (error) => {
@@ -220,7 +254,15 @@ function RoomModern() {
     wsRef.current = websocket;
     setWs(websocket);
 
+    const heartbeat = window.setInterval(() => {
+      if (websocket.readyState === WebSocket.OPEN) {
+        websocket.send(JSON.stringify({ type: 'heartbeat' }));
+      }
+    }, HEARTBEAT_INTERVAL_MS);
+
     return () => {
+      disposed = true;
+      window.clearInterval(heartbeat);
       if (websocket.readyState === WebSocket.OPEN) {
         websocket.send(JSON.stringify({
           type: 'user_left',
@@ -229,10 +271,42 @@ function RoomModern() {
       }
       websocket.close();
     };
-  }, [code, currentParticipantId, currentUsername]);
+  }, [code, currentParticipantId, currentUsername, connectionAttempt]);
+
+  const requestSync = () => {
+    const websocket = wsRef.current;
+    if (syncRequestedRef.current || !websocket || websocket.readyState !== WebSocket.OPEN) return;
+    syncRequestedRef.current = true;
+    logger.warn(LogCategory.WEBSOCKET_SEND, 'Room version gap detected, requesting missed updates', {
+      version: versionRef.current
+    }, componentName);
+    websocket.send(JSON.stringify({ type: 'sync', version: versionRef.current }));
+  };
+
+  const applyPatch = (data: any) => {
+    // Already covered by a snapshot or an earlier patch
+    if (isApplied(data.version)) return;
+    // Coalesced vote bursts span base_version..version. On a gap, this and any
+    // frame before the server's replay/snapshot answer is resent in that answer.
+    if (syncRequestedRef.current || (data.base_version ?? data.version) > versionRef.current + 1) {
+      requestSync();
+      return;
+    }
+    versionRef.current = data.version;
+    setRoom(prev => (prev ? applyRoomPatch(prev, data.patch) : prev));
+  };
 
   const handleWebSocketMessage = (data: any) => {
     switch (data.type) {
+      case 'snapshot':
+        versionRef.current = data.version;
+        syncRequestedRef.current = false;
+        setRoom(data.room);
+        break;
+      case 'replay':
+        // The missed frames follow, in order
+        syncRequestedRef.current = false;
+        break;
       case 'vote_cast':
       case 'room_reset':
       case 'story_changed':
@@ -240,10 +314,10 @@ function RoomModern() {
       case 'user_joined':
       case 'user_left':
       case 'points_confirmed':
-        setRoom(data.room);
+        applyPatch(data);
         break;
       case 'votes_revealed':
-        setRoom(data.room);
+        applyPatch(data);
         if (data.average && data.rounded) {
           setAverageData({ 
             average: data.average, 
@@ -506,7 +580,7 @@ function RoomModern() {
                 {votesRevealed ? 'Votes Revealed' : 'Cast Your Vote'}
               </h3>
               <div className="grid grid-cols-5 sm:grid-cols-9 gap-3 justify-center">
-                {voteOptions.map((value, index) => (
+                {(room.deck ?? DEFAULT_VOTE_OPTIONS).map((value) => (
                   <VoteCard
                     key={value}
                     value={value}
@@ -8,6 +8,9 @@ export interface Room {
   participants: Participant[];
   stories: Story[];
   participants_count: number;
+  // Cards of the backend's ESTIMATION_DECK
+  deck?: VoteValue[];
+  version: number;
 }
 
 export interface Participant {
@@ -39,6 +42,8 @@ export interface Vote {
   created_at: string;
 }
 
-export type VoteValue = '0' | '1' | '2' | '3' | '5' | '8' | '13' | '21' | '?' | 'coffee';
+// Decks are configured on the backend, so any card it sends is a valid vote
+export type VoteValue = string;
 
+// Fallback for room states from backends that don't send their deck
 export const VOTE_OPTIONS: VoteValue[] = ['0', '1', '2', '3', '5', '8', '13', '21', '?', 'coffee'];